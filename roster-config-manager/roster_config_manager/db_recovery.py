@@ -42,6 +42,8 @@ import os
 import bz2
 import cPickle
 
+from roster_core import audit_log
+
 
 roster_core.core.CheckCoreVersionMatches(__version__)
 
@@ -69,6 +71,11 @@ class Recover(object):
     self.core_instance = roster_core.Core(self.username, self.config_instance)
     self.core_helper_instance = roster_core.CoreHelpers(
          self.core_instance)
+    self.audit_log_archive = None
+    archive_dir = self.config_instance.config_file['exporter'][
+        'audit_log_archive_dir']
+    if( archive_dir ):
+      self.audit_log_archive = audit_log.AuditLogArchive(archive_dir)
 
   def PushBackup(self, audit_log_id):
     """Restores database from sql backup with specified audit log id
@@ -89,7 +96,26 @@ class Recover(object):
 
     self.db_instance.StartTransaction()
     self.db_instance.cursor.execute(full_dump_file_contents)
+    self.db_instance.InvalidateViewDependencyGraph()
+    self.db_instance.MarkConfigChanged()
     self.db_instance.EndTransaction()
+    # Backups made before flat_records existed do not have its rows.
+    self.RebuildFlatRecords()
+
+  def RebuildFlatRecords(self):
+    """Rebuilds flat_records from record_arguments_records_assignments
+
+    Outputs:
+      int: number of records rebuilt
+    """
+    self.db_instance.StartTransaction()
+    try:
+      record_count = self.db_instance.RebuildFlatRecords()
+    except:
+      self.db_instance.EndTransaction(rollback=True)
+      raise
+    self.db_instance.EndTransaction()
+    return record_count
 
   def RunAuditStep(self, audit_log_id):
     """Runs a step from the audit_log
@@ -101,14 +127,8 @@ class Recover(object):
       RecoverError: Should a error occur in recovery.
     """
     forbidden_actions = ['ExportAllBindTrees']
-    audit_dict = self.db_instance.GetEmptyRowDict('audit_log')
-    audit_dict['audit_log_id'] = audit_log_id
-    self.db_instance.StartTransaction()
-    try:
-      audit_log = self.db_instance.ListRow('audit_log', audit_dict)
-    finally:
-      self.db_instance.EndTransaction()
-    if( audit_log == () ):
+    audit_log = self.ListAuditLogRow(audit_log_id)
+    if( not audit_log ):
       print 'Not replaying action with id %s, action is blank.' % audit_log_id
       return False
     action = audit_log[0]['action']
@@ -132,6 +152,49 @@ class Recover(object):
             "Function %s does not exist." % action)
     return True
 
+  def GetSnapshotAuditLogId(self, audit_log_id):
+    """Gets the highest audit log id contained in the backup made by an
+    export.
+
+    Exports read from a consistent snapshot and record the highest audit log
+    id the snapshot could see. Actions logged after that id are not in the
+    backup even if they were logged before the export itself.
+
+    Inputs:
+      audit_log_id: integer of audit_log_id of the export
+
+    Outputs:
+      int: highest audit_log_id in the backup
+    """
+    audit_log = self.ListAuditLogRow(audit_log_id)
+    if( audit_log ):
+      audit_args = cPickle.loads(str(audit_log[0]['data']))['audit_args']
+      if( 'snapshot_audit_log_id' in audit_args ):
+        return audit_args['snapshot_audit_log_id']
+    return audit_log_id
+
+  def ListAuditLogRow(self, audit_log_id):
+    """Lists an audit log row, looking in the audit log archive if it has
+    been moved out of the database.
+
+    Inputs:
+      audit_log_id: integer of audit_log_id
+
+    Outputs:
+      list: list of the audit_log row dict, empty if it is not found
+    """
+    audit_dict = self.db_instance.GetEmptyRowDict('audit_log')
+    audit_dict['audit_log_id'] = audit_log_id
+    self.db_instance.StartTransaction()
+    try:
+      audit_log = self.db_instance.ListRow('audit_log', audit_dict)
+    finally:
+      self.db_instance.EndTransaction()
+    if( not audit_log and self.audit_log_archive is not None ):
+      audit_log = self.audit_log_archive.ListRows(
+          begin_audit_log_id=audit_log_id, end_audit_log_id=audit_log_id)
+    return list(audit_log)
+
   def RunAuditRange(self, audit_log_id):
     """Runs a range of audit steps
 
@@ -149,8 +212,11 @@ class Recover(object):
     for audit_id in reversed(sorted(db_dumps)):
       if( audit_id < audit_log_id ):
         break
+    snapshot_audit_log_id = audit_id
+    if( audit_id ):
+      snapshot_audit_log_id = self.GetSnapshotAuditLogId(audit_id)
     self.PushBackup(audit_id)
 
-    for current_id in range(audit_id + 1, audit_log_id):
+    for current_id in range(snapshot_audit_log_id + 1, audit_log_id):
       self.RunAuditStep(current_id)
     return True
@@ -46,6 +46,7 @@ import os
 import StringIO
 import shutil
 import tarfile
+import tempfile
 
 from roster_core import punycode_lib
 from roster_core import audit_log
@@ -61,6 +62,34 @@ from roster_config_manager import zone_exporter_lib
 core.CheckCoreVersionMatches(__version__)
 
 
+# Number of rows put in each INSERT statement of the database dumps.
+DUMP_ROWS_PER_INSERT = 100
+
+# Stole these lines from mysqldump output, not sure all are needed
+DUMP_HEADER = ['SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT;\n',
+               'SET @OLD_CHARACTER_SET_RESULTS=@@CHARACTER_SET_RESULTS;\n',
+               'SET @OLD_COLLATION_CONNECTION=@@COLLATION_CONNECTION;\n',
+               'SET NAMES utf8;\n'
+               'SET @OLD_TIME_ZONE=@@TIME_ZONE;\n',
+               "SET TIME_ZONE='+00:00';\n",
+               'SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS;\n',
+               'SET UNIQUE_CHECKS=0;\n',
+               'SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS;\n',
+               'SET FOREIGN_KEY_CHECKS=0;\n',
+               'SET @OLD_SQL_MODE=@@SQL_MODE;\n',
+               "SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n",
+               'SET @OLD_SQL_NOTES=@@SQL_NOTES;\n'
+               'SET SQL_NOTES=0;\n']
+
+DUMP_FOOTER = ['SET SQL_MODE=@OLD_SQL_MODE;\n',
+               'SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;\n',
+               'SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS;\n',
+               'SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT;\n',
+               'SET CHARACTER_SET_RESULTS=@OLD_CHARACTER_SET_RESULTS;\n',
+               'SET COLLATION_CONNECTION=@OLD_COLLATION_CONNECTION;\n',
+               'SET SQL_NOTES=@OLD_SQL_NOTES;\n']
+
+
 class Error(errors.CoreError):
   pass
 
@@ -159,45 +188,44 @@ class BindTreeExport(object):
           key=lambda k: k['argument_order'])
     return sorted_record_arguments
 
+  @helpers_lib.AuditedMethod
   def ExportAllBindTrees(self, force=False):
     """Exports bind trees to files
 
+    All data is read from one consistent snapshot of the database, so no
+    tables are locked and writers are not held up by the export. The highest
+    audit log id in the snapshot is recorded in the audit log entry of the
+    export as snapshot_audit_log_id.
+
     Inputs:
       force: boolean of if the export should continue if no changes are found
              in the database
     """
     function_name, current_args = helpers_lib.GetFunctionNameAndArgs()
     success = False
+    dump_file_names = ()
     try:
       self.db_instance.StartTransaction()
       try:
-        self.db_instance.LockDb()
-        try:
-          if( not force ):
-            if( self.db_instance.CheckMaintenanceFlag() ):
-              raise MaintenanceError('Database currently under maintenance.')
-            audit_log_dict = self.db_instance.GetEmptyRowDict('audit_log')
-            audit_log_dict['action'] = u'ExportAllBindTrees'
-            audit_log_dict['success'] = 1
-            audit_rows = self.db_instance.ListRow('audit_log', audit_log_dict)
-            if( audit_rows ):
-              audit_rows = self.db_instance.ListRow(
-                  'audit_log', self.db_instance.GetEmptyRowDict('audit_log'),
-                  column='audit_log_timestamp',
-                  range_values=(audit_rows[-1]['audit_log_timestamp'],
-                              datetime.datetime.now()),
-                  is_date=True)
-              for row in audit_rows:
-                if( row['action'] != u'ExportAllBindTrees' ):
-                  break
-              else:
-                raise ChangesNotFoundError('No changes have been made to the '
-                                           'database since last export, '
-                                           'no export needed.')
-          data, raw_dump = self.GetRawData()
-          current_time = self.db_instance.GetCurrentTime()
-        finally:
-          self.db_instance.UnlockDb()
+        # Changes committed while the last export was running are after its
+        # snapshot, not after its own audit log row.
+        last_export_snapshot_audit_log_id = (
+            self.db_instance.GetLastExportSnapshotAuditLogId())
+        snapshot_audit_log_id = self.db_instance.StartConsistentSnapshot()
+        current_args['audit_args'][
+            'snapshot_audit_log_id'] = snapshot_audit_log_id
+        if( not force ):
+          if( self.db_instance.CheckMaintenanceFlag() ):
+            raise MaintenanceError('Database currently under maintenance.')
+          if( last_export_snapshot_audit_log_id is not None and
+              not self.db_instance.CheckAuditLogChanges(
+                  last_export_snapshot_audit_log_id, snapshot_audit_log_id) ):
+            raise ChangesNotFoundError('No changes have been made to the '
+                                       'database since last export, '
+                                       'no export needed.')
+        data = self.GetRawData()
+        current_time = self.db_instance.GetCurrentTime()
+        dump_file_names = self.WriteDatabaseDump()
       finally:
         self.db_instance.EndTransaction()
       cooked_data = self.CookData(data)
@@ -306,9 +334,6 @@ class BindTreeExport(object):
             named_conf_file_handle.close()
             named_conf_binary_file_handle.close()
             root_hint_file_handle.close()
-          
-
-      audit_log_replay_dump, full_database_dump = self.CookRawDump(raw_dump)
 
       success = True
     finally:
@@ -316,37 +341,112 @@ class BindTreeExport(object):
                                            function_name,
                                            current_args,
                                            success)
+      if( not success ):
+        for dump_file_name in dump_file_names:
+          if( os.path.exists(dump_file_name) ):
+            os.remove(dump_file_name)
 
 
     self.tar_file_name = '%s/dns_tree_%s-%s.tar.bz2' % (
         self.backup_dir, current_time.strftime("%d_%m_%yT%H_%M"), log_id)
+
+    # The dumps were written before the id of this export was known.
+    audit_log_replay_dump_file_name, full_dump_file_name = dump_file_names
+    os.rename(audit_log_replay_dump_file_name,
+              '%s/audit_log_replay_dump-%s.bz2' % (self.backup_dir, log_id))
+    os.rename(full_dump_file_name,
+              '%s/full_database_dump-%s.bz2' % (self.backup_dir, log_id))
+
+    self.config_lib_instance.TarDnsTree(log_id)
+
+  def WriteDatabaseDump(self):
+    """Streams the database into the compressed audit log replay dump and
+    full database dump files, table by table.
+
+    This must be run in the transaction the export reads from. The files are
+    written under temporary names in the backup directory and are renamed
+    once the audit log id of the export is known.
+
+    Outputs:
+      tuple: string of audit log replay dump file name and string of full
+             database dump file name
+    """
     if( not os.path.exists(self.backup_dir) ):
       os.makedirs(self.backup_dir)
-
-    audit_log_replay_dump_file = bz2.BZ2File(
-        '%s/audit_log_replay_dump-%s.bz2' % (self.backup_dir, log_id), 'w')
+    # mkstemp creates each file, so concurrent exports can not pick the
+    # same name.
+    dump_file_names = []
     try:
-      for audit_index, audit_entry in enumerate(audit_log_replay_dump):
-        audit_log_replay_dump[audit_index] = audit_entry.encode('utf-8')
-      audit_log_replay_dump_file.writelines(audit_log_replay_dump)
-    finally:
-      audit_log_replay_dump_file.close()
+      for prefix in ('.audit_log_replay_dump-', '.full_database_dump-'):
+        dump_file_descriptor, dump_file_name = tempfile.mkstemp(
+            suffix='.bz2.tmp', prefix=prefix, dir=self.backup_dir)
+        os.close(dump_file_descriptor)
+        dump_file_names.append(dump_file_name)
+      audit_log_replay_dump_file_name, full_dump_file_name = dump_file_names
+      audit_log_replay_dump_file = bz2.BZ2File(
+          audit_log_replay_dump_file_name, 'w')
+      try:
+        full_dump_file = bz2.BZ2File(full_dump_file_name, 'w')
+        try:
+          audit_log_replay_dump_file.writelines(DUMP_HEADER)
+          full_dump_file.writelines(DUMP_HEADER)
+          for table_name, schema, columns, rows in (
+              self.db_instance.IterDumpTables()):
+            replayed = table_name not in constants.TABLES_NOT_AUDIT_LOGGED
+            # Row values are already utf-8 strings.
+            for line in self.MakeTableDumpLines(
+                table_name.encode('utf-8'), schema.encode('utf-8'),
+                [column.encode('utf-8') for column in columns], rows):
+              full_dump_file.write(line)
+              if( replayed ):
+                audit_log_replay_dump_file.write(line)
+          audit_log_replay_dump_file.writelines(DUMP_FOOTER)
+          full_dump_file.writelines(DUMP_FOOTER)
+        finally:
+          full_dump_file.close()
+      finally:
+        audit_log_replay_dump_file.close()
+    except:
+      for dump_file_name in dump_file_names:
+        if( os.path.exists(dump_file_name) ):
+          os.remove(dump_file_name)
+      raise
 
-    full_dump_file = bz2.BZ2File('%s/full_database_dump-%s.bz2' %
-                                 (self.backup_dir, log_id), 'w')
-    try:
-      for full_dump_index, full_dump_entry in enumerate(full_database_dump):
-        full_database_dump[full_dump_index] = full_dump_entry.encode('utf-8')
-      full_dump_file.writelines(full_database_dump)
-    finally:
-      full_dump_file.close()
+    return tuple(dump_file_names)
 
-    self.config_lib_instance.TarDnsTree(log_id)
+  def MakeTableDumpLines(self, table_name, schema, columns, rows):
+    """Makes the statements that recreate a table with its rows.
+
+    Inputs:
+      table_name: string of table name
+      schema: string of CREATE TABLE statement
+      columns: list of column names
+      rows: iterable of lists of the row's values quoted for mysql, in
+            column order
+
+    Outputs:
+      generator of strings of statements, rows are put in multi row INSERT
+      statements of up to DUMP_ROWS_PER_INSERT rows
+    """
+    yield 'DROP TABLE IF EXISTS `%s`;\n' % table_name
+    yield '%s;\n' % schema
+    insert_start = 'INSERT INTO %s (%s) VALUES ' % (table_name,
+                                                   ','.join(columns))
+    insert_values = []
+    for row in rows:
+      insert_values.append('(%s)' % ', '.join(row))
+      if( len(insert_values) >= DUMP_ROWS_PER_INSERT ):
+        yield '%s%s;\n' % (insert_start, ','.join(insert_values))
+        insert_values = []
+    if( insert_values ):
+      yield '%s%s;\n' % (insert_start, ','.join(insert_values))
 
   def CookRawDump(self, raw_dump):
     """This takes raw data from the database and turns it into a
     mysqldump-like output.
 
+    Exports stream the dump straight to files with WriteDatabaseDump.
+
     Inputs:
       raw_dump: list of dictionaries that contain all of the tables
                 and their associated metadata
@@ -354,52 +454,23 @@ class BindTreeExport(object):
     Outputs:
       list: tuple of list of strings to be concatenated into mysql dump files
     """
-    # Stole these lines from mysqldump output, not sure all are needed
-    header = ['SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT;\n',
-              'SET @OLD_CHARACTER_SET_RESULTS=@@CHARACTER_SET_RESULTS;\n',
-              'SET @OLD_COLLATION_CONNECTION=@@COLLATION_CONNECTION;\n',
-              'SET NAMES utf8;\n'
-              'SET @OLD_TIME_ZONE=@@TIME_ZONE;\n',
-              "SET TIME_ZONE='+00:00';\n",
-              'SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS;\n',
-              'SET UNIQUE_CHECKS=0;\n',
-              'SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS;\n',
-              'SET FOREIGN_KEY_CHECKS=0;\n',
-              'SET @OLD_SQL_MODE=@@SQL_MODE;\n',
-              "SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n",
-              'SET @OLD_SQL_NOTES=@@SQL_NOTES;\n'
-              'SET SQL_NOTES=0;\n']
-
-    footer = ['SET SQL_MODE=@OLD_SQL_MODE;\n',
-              'SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;\n',
-              'SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS;\n',
-              'SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT;\n',
-              'SET CHARACTER_SET_RESULTS=@OLD_CHARACTER_SET_RESULTS;\n',
-              'SET COLLATION_CONNECTION=@OLD_COLLATION_CONNECTION;\n',
-              'SET SQL_NOTES=@OLD_SQL_NOTES;\n']
-
     full_database_dump = []
-    full_database_dump.extend(header)
+    full_database_dump.extend(DUMP_HEADER)
     audit_log_replay_dump = []
-    audit_log_replay_dump.extend(header)
+    audit_log_replay_dump.extend(DUMP_HEADER)
 
     for table_name, table_data in raw_dump.iteritems():
-      table_lines = []
-      table_lines.append('DROP TABLE IF EXISTS `%s`;\n' % table_name)
-      table_lines.append(table_data['schema'])
-      table_lines[-1] = '%s;' % table_lines[-1]
-      for row in table_data['rows']:
-        insert_row = "INSERT INTO %s (%s) VALUES (%%(%s)s);\n" % (
-            table_name, ','.join(table_data['columns']),
-            ")s, %(".join(table_data['columns']))
-        table_lines.append(insert_row % row)
+      rows = [[row[column] for column in table_data['columns']] for
+              row in table_data['rows']]
+      table_lines = list(self.MakeTableDumpLines(
+          table_name, table_data['schema'], table_data['columns'], rows))
 
       full_database_dump.extend(table_lines)
       if( table_name not in constants.TABLES_NOT_AUDIT_LOGGED ):
         audit_log_replay_dump.extend(table_lines)
 
-    full_database_dump.extend(footer)
-    audit_log_replay_dump.extend(footer)
+    full_database_dump.extend(DUMP_FOOTER)
+    audit_log_replay_dump.extend(DUMP_FOOTER)
 
     return (audit_log_replay_dump, full_database_dump)
 
@@ -589,28 +660,17 @@ class BindTreeExport(object):
   def GetRawData(self):
     """Gets raw data from database
 
+    The database dump is written separately by WriteDatabaseDump.
+
     Outputs:
-      tuple of two dictionaries:
-        dictionary of raw data keyed by data name with values of dicts
-            containing values of that type's attributes
-        dictionary of the raw dump keyed by data name with values of
-            dicts containing the db dump keyed by row, column, and schema
+      dictionary of raw data keyed by data name with values of dicts
+          containing values of that type's attributes
       example:
-        ({'view_acl_assignments': ({
+        {'view_acl_assignments': ({
           'view_acl_assignments_view_name': u'external',
           'view_acl_assignments_dns_server_set_name': u'external_dns',
           'view_acl_assignments_acl_name': u'public',
-          'view_acl_assignments_acl_range_allowed': 1})},
-        { u'zones':
-          {'rows':[{}],
-           'columns': [u'zones_id', u'zone_name'],
-           'schema':(
-               u'CREATE TABLE `zones` (\n  `zones_id` mediumint(8) ',
-               'unsigned NOT NULL auto_increment,\n  `zone_name` varchar(255) ',
-               'NOT NULL,\n  PRIMARY KEY  (`zones_id`),\n  UNIQUE KEY ;
-               '`zone_name` (`zone_name`),\n  KEY `zone_name_1` '
-               '(`zone_name`)\n) ENGINE=InnoDB AUTO_INCREMENT=9 DEFAULT ',
-               'CHARSET=utf8')}}),
+          'view_acl_assignments_acl_range_allowed': 1})}
     """
     data = {}
     named_conf_global_options_dict = self.db_instance.GetEmptyRowDict(
@@ -652,17 +712,11 @@ class BindTreeExport(object):
     acl_ranges_dict = self.db_instance.GetEmptyRowDict('acl_ranges')
     data['acl_ranges'] = self.db_instance.ListRow('acl_ranges', acl_ranges_dict)
 
-    record_arguments_records_assignments_dict = (
-        self.db_instance.GetEmptyRowDict(
-          'record_arguments_records_assignments'))
-    data['record_arguments_records_assignments'] = self.db_instance.ListRow(
-        'record_arguments_records_assignments',
-        record_arguments_records_assignments_dict)
-
+    flat_records_dict = self.db_instance.GetEmptyRowDict('flat_records')
     records_dict = self.db_instance.GetEmptyRowDict('records')
-    data['records'] = self.db_instance.ListRow(
-        'records', records_dict, 'record_arguments_records_assignments',
-        record_arguments_records_assignments_dict)
+    # Records are sorted as they are read rather than held in memory.
+    data['sorted_records'] = self.SortRecords(self.db_instance.IterRow(
+        'records', records_dict, 'flat_records', flat_records_dict))
 
     zone_view_assignments_dict = self.db_instance.GetEmptyRowDict(
         'zone_view_assignments')
@@ -672,15 +726,14 @@ class BindTreeExport(object):
     record_arguments_dict = self.db_instance.GetEmptyRowDict('record_arguments')
     data['record_arguments'] = self.db_instance.ListRow('record_arguments',
                                                         record_arguments_dict)
-    raw_dump = self.db_instance.DumpDatabase()
 
-    return (data, raw_dump)
+    return data
 
   def SortRecords(self, records):
     """Sorts records for zone exporter
 
     Inputs:
-      records: list of records
+      records: iterable of rows of records joined with flat_records
 
     Outputs:
       dict: dictionary keyed by tuple (zone, view_dep)
@@ -703,40 +756,20 @@ class BindTreeExport(object):
     for record in records:
       zone_name =  record['record_zone_name']
       view_dep = record['record_view_dependency']
-      record_id = record['record_arguments_records_assignments_record_id']
-      arg_name = record[
-          'record_arguments_records_assignments_argument_name']
+      record_id = record['records_id']
 
       if( not sorted_records.has_key((zone_name, view_dep)) ):
         sorted_records[(zone_name, view_dep)] = {}
-      if( not sorted_records[(zone_name, view_dep)].has_key(record_id) ):
-        sorted_records[(zone_name, view_dep)][record_id] = {}
-
-        sorted_records[(zone_name, view_dep)][record_id]['record_type'] = (
-            record['record_type'])
-
-        sorted_records[(zone_name, view_dep)][record_id]['zone_name'] = (
-            record['record_zone_name'])
-
-        sorted_records[(zone_name, view_dep)][record_id]['view_name'] = (
-            record['record_view_dependency'].rsplit('_dep', 1)[0])
-
-        sorted_records[(zone_name, view_dep)][record_id]['target'] = (
-            record['record_target'])
-
-        sorted_records[(zone_name, view_dep)][record_id]['ttl'] = (
-            record['record_ttl'])
-
-        sorted_records[(zone_name, view_dep)][record_id]['last_user'] = (
-            record['record_last_user'])
-
-      sorted_records[(zone_name, view_dep)][record_id][arg_name] = record[
-              'argument_value']
 
-      if( sorted_records[(zone_name, view_dep)][record_id][
-          arg_name].isdigit() ):
-        sorted_records[(zone_name, view_dep)][record_id][arg_name] = int(
-            sorted_records[(zone_name, view_dep)][record_id][arg_name])
+      record_dict = helpers_lib.GetRecordArgsFromFlatRecordRow(record)
+      record_dict['record_type'] = record['record_type']
+      record_dict['zone_name'] = record['record_zone_name']
+      record_dict['view_name'] = record['record_view_dependency'].rsplit(
+          '_dep', 1)[0]
+      record_dict['target'] = record['record_target']
+      record_dict['ttl'] = record['record_ttl']
+      record_dict['last_user'] = record['record_last_user']
+      sorted_records[(zone_name, view_dep)][record_id] = record_dict
 
     return sorted_records
 
@@ -793,7 +826,7 @@ class BindTreeExport(object):
     cooked_data = {}
     cooked_data['dns_server_sets'] = {}
     cooked_data['dns_servers'] = {}
-    sorted_records = self.SortRecords(data['records'])
+    sorted_records = data['sorted_records']
 
     for dns_server_set in data['dns_server_sets']:
       dns_server_set_name = dns_server_set['dns_server_set_name']
@@ -73,5 +73,6 @@ setup(name='RosterConfigManager',
                  'scripts/dnstreeexport', 'scripts/dnscheckconfig',
                  'scripts/dnsexportconfig', 'scripts/dnsrecover',
                  'scripts/dnszonecompare', 'scripts/dnsquerycheck', 
-                 'scripts/dnsservercheck', 'scripts/dnsversioncheck']
+                 'scripts/dnsservercheck', 'scripts/dnsversioncheck',
+                 'scripts/dnsarchiveauditlog']
      )
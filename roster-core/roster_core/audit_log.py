@@ -37,16 +37,555 @@ __license__ = 'BSD'
 __version__ = "#TRUNK#"
 
 
+import atexit
+import bz2
 import cPickle
 import datetime
+import os
+import Queue
 import syslog
+import threading
 import unicodedata
 
+import constants
+import errors
+import helpers_lib
+
+
+# syslog.openlog applies to the whole process, so it is only run once and the
+# syslog handle is kept open.
+syslog_state = {'opened': False}
+syslog_lock = threading.Lock()
+
+
+def WriteSyslog(log_string):
+  """Writes log string to syslog, opening it the first time.
+
+  Inputs:
+    log_string: string of message to write to syslog
+  """
+  if( not syslog_state['opened'] ):
+    syslog_lock.acquire()
+    try:
+      if( not syslog_state['opened'] ):
+        syslog.openlog('dnsManagement')
+        syslog_state['opened'] = True
+    finally:
+      syslog_lock.release()
+  # Convert the unicode strings to ascii if needed
+  if( isinstance(log_string, unicode) ):
+    log_string = unicodedata.normalize('NFKD', log_string).encode(
+        'ASCII', 'replace')
+  syslog.syslog(log_string)
+
+
+class AuditLogWriter(object):
+  """Writes audit log entries to the database, syslog and a log file.
+
+  Entries are put in a bounded queue and written by a background thread.
+  Each pass the thread takes every waiting entry, up to AUDIT_LOG_BATCH_SIZE,
+  inserts them in one transaction and then writes them to syslog and to the
+  log file. The log file is kept open and flushed once per batch, it is
+  reopened if it has been moved or removed.
+  """
+  def __init__(self, db_instance, log_to_syslog, log_to_file, log_file_name):
+    """Sets where entries are written.
+
+    Inputs:
+      db_instance: instance of DbAccess class
+      log_to_syslog: bool of if syslog is used
+      log_to_file: bool of if file is used
+      log_file_name: string of file name to log to
+    """
+    self.db_instance = db_instance
+    self.log_to_syslog = log_to_syslog
+    self.log_to_file = log_to_file
+    self.log_file_name = log_file_name
+    self.queue = Queue.Queue(constants.AUDIT_LOG_QUEUE_SIZE)
+    self.writer_thread = None
+    self.thread_lock = threading.Lock()
+    self.stopping = False
+    self.log_file = None
+    self.file_lock = threading.Lock()
+
+  def Put(self, entry):
+    """Queues an entry for the writer thread, starting the thread the first
+    time. Blocks while the queue is full.
+
+    Inputs:
+      entry: dictionary of entry
+        ex: {'log_dict': audit_log row dict or None,
+             'log_string': string of log message or None,
+             'done': threading.Event set once written or None,
+             'audit_log_id': None, 'error': None}
+    """
+    if( self.writer_thread is None ):
+      self.thread_lock.acquire()
+      try:
+        if( self.writer_thread is None ):
+          self.writer_thread = threading.Thread(target=self.WriteLoop)
+          self.writer_thread.daemon = True
+          self.writer_thread.start()
+      finally:
+        self.thread_lock.release()
+    self.queue.put(entry)
+
+  def WriteLoop(self):
+    """Writes out batches of queued entries until Close is run."""
+    while( not self.stopping or not self.queue.empty() ):
+      entries = [self.queue.get()]
+      while( len(entries) < constants.AUDIT_LOG_BATCH_SIZE ):
+        try:
+          entries.append(self.queue.get_nowait())
+        except Queue.Empty:
+          break
+      # Entries are still written to syslog and the log file when the
+      # database insert fails.
+      for write_function in [self.WriteToDatabase, self.WriteLogStrings]:
+        try:
+          write_function(entries)
+        except Exception, error:
+          self.ReportError(entries, error)
+      for entry in entries:
+        if( entry['done'] is not None ):
+          entry['done'].set()
+    self.thread_lock.acquire()
+    try:
+      self.writer_thread = None
+    finally:
+      self.thread_lock.release()
+
+  def WriteToDatabase(self, entries):
+    """Inserts the audit log rows of entries in one transaction and sets
+    their audit_log_id.
+
+    Inputs:
+      entries: list of entry dictionaries, see Put
+    """
+    db_entries = [entry for entry in entries if entry['log_dict'] is not None]
+    if( not db_entries ):
+      return
+    self.db_instance.StartTransaction()
+    try:
+      audit_log_ids = self.db_instance.MakeRows(
+          'audit_log', [entry['log_dict'] for entry in db_entries])
+    except:
+      self.db_instance.EndTransaction(rollback=True)
+      raise
+    self.db_instance.EndTransaction()
+    for entry, audit_log_id in zip(db_entries, audit_log_ids):
+      entry['audit_log_id'] = audit_log_id
+
+  def WriteLogStrings(self, entries):
+    """Writes the log strings of entries to syslog and the log file.
+
+    Inputs:
+      entries: list of entry dictionaries, see Put
+    """
+    log_strings = [entry['log_string'] for entry in entries
+                   if entry['log_string'] is not None]
+    if( self.log_to_syslog ):
+      for log_string in log_strings:
+        WriteSyslog(log_string)
+    if( self.log_to_file ):
+      self.WriteToFile(log_strings)
+
+  def WriteToFile(self, log_strings):
+    """Appends log strings to the log file and flushes it.
+
+    Inputs:
+      log_strings: list of strings of messages to write to file
+    """
+    if( not log_strings ):
+      return
+    self.file_lock.acquire()
+    try:
+      if( self.log_file is not None ):
+        try:
+          if( os.stat(self.log_file_name).st_ino !=
+              os.fstat(self.log_file.fileno()).st_ino ):
+            self.CloseFile()
+        except OSError:
+          self.CloseFile()
+      if( self.log_file is None ):
+        self.log_file = open(self.log_file_name, 'a')
+      try:
+        for log_string in log_strings:
+          self.log_file.write('%s\n' % log_string)
+      finally:
+        self.log_file.flush()
+    finally:
+      self.file_lock.release()
+
+  def CloseFile(self):
+    """Closes the log file if it is open."""
+    if( self.log_file is not None ):
+      log_file = self.log_file
+      self.log_file = None
+      log_file.close()
+
+  def ReportError(self, entries, error):
+    """Hands a write error to the callers waiting on entries, and reports it
+    to syslog if nobody is waiting.
+
+    Inputs:
+      entries: list of entry dictionaries, see Put
+      error: exception raised while writing entries
+    """
+    lost_entries = 0
+    for entry in entries:
+      if( entry['done'] is not None ):
+        entry['error'] = error
+      elif( entry['log_dict'] is not None or entry['log_string'] is not None ):
+        lost_entries += 1
+    if( lost_entries ):
+      WriteSyslog('Could not write %s audit log entries: %s' % (
+          lost_entries, error))
+
+  def Flush(self):
+    """Waits for every entry queued so far to be written."""
+    if( self.writer_thread is None ):
+      return
+    entry = {'log_dict': None, 'log_string': None,
+             'done': threading.Event(), 'audit_log_id': None, 'error': None}
+    self.queue.put(entry)
+    entry['done'].wait()
+
+  def Close(self):
+    """Writes out queued entries, stops the writer thread and closes the log
+    file."""
+    self.stopping = True
+    self.Flush()
+    self.file_lock.acquire()
+    try:
+      self.CloseFile()
+    finally:
+      self.file_lock.release()
+
+
+# Audit log writers are shared by every AuditLog instance writing to the
+# same places.
+audit_log_writers = {}
+audit_log_writers_lock = threading.Lock()
+
+
+def GetAuditLogWriter(db_instance, log_to_syslog, log_to_file, log_file_name):
+  """Gets the process wide audit log writer for a set of log destinations,
+  creating it if needed.
+
+  Inputs:
+    db_instance: instance of DbAccess class
+    log_to_syslog: bool of if syslog is used
+    log_to_file: bool of if file is used
+    log_file_name: string of file name to log to
+
+  Outputs:
+    AuditLogWriter instance
+  """
+  # Every DbAccess instance with the same connection settings shares a
+  # connection pool.
+  writer_key = (getattr(db_instance, 'connection_pool', None), log_to_syslog,
+                log_to_file, log_file_name)
+  audit_log_writer = audit_log_writers.get(writer_key)
+  if( audit_log_writer is None ):
+    audit_log_writers_lock.acquire()
+    try:
+      audit_log_writer = audit_log_writers.get(writer_key)
+      if( audit_log_writer is None ):
+        audit_log_writer = AuditLogWriter(db_instance, log_to_syslog,
+                                          log_to_file, log_file_name)
+        audit_log_writers[writer_key] = audit_log_writer
+    finally:
+      audit_log_writers_lock.release()
+  return audit_log_writer
+
+
+def CloseAuditLogs():
+  """Writes out every queued audit log entry, run when the process exits."""
+  for audit_log_writer in audit_log_writers.values():
+    audit_log_writer.Close()
+
+atexit.register(CloseAuditLogs)
+
+
+class AuditLogArchive(object):
+  """Compressed, date partitioned files of audit log rows that have been
+  moved out of the database.
+
+  Each file holds rows of one day as pickled row dicts in a bz2 stream. The
+  files are named audit_log-<YYYY-MM-DD>-<first id>-<last id>.bz2 so that
+  rows can be found by date or by audit_log_id without opening every file.
+  """
+  def __init__(self, archive_dir):
+    """Sets the archive directory.
+
+    Inputs:
+      archive_dir: string of directory of archive files
+    """
+    self.archive_dir = archive_dir
+
+  def ListFiles(self):
+    """Lists the archive files.
+
+    Outputs:
+      list: sorted list of tuples of date, int of first audit_log_id, int of
+            last audit_log_id and string of file name
+    """
+    if( not os.path.isdir(self.archive_dir) ):
+      return []
+    archive_files = []
+    for file_name in os.listdir(self.archive_dir):
+      if( not file_name.startswith('audit_log-') or
+          not file_name.endswith('.bz2') ):
+        continue
+      try:
+        year, month, day, first_audit_log_id, last_audit_log_id = (
+            file_name[len('audit_log-'):-len('.bz2')].split('-'))
+        archive_files.append((datetime.date(int(year), int(month), int(day)),
+                              int(first_audit_log_id), int(last_audit_log_id),
+                              os.path.join(self.archive_dir, file_name)))
+      except ValueError:
+        continue
+    archive_files.sort()
+    return archive_files
+
+  def ReadFile(self, file_name):
+    """Reads the rows of an archive file.
+
+    Inputs:
+      file_name: string of archive file name
+
+    Outputs:
+      generator of audit_log row dicts
+    """
+    archive_file = bz2.BZ2File(file_name, 'r')
+    try:
+      while( True ):
+        try:
+          yield cPickle.load(archive_file)
+        except EOFError:
+          break
+    finally:
+      archive_file.close()
+
+  def OpenDay(self, date):
+    """Starts a new archive file of a day under a temporary name, with the
+    rows of the day that are already archived copied into it.
+
+    Inputs:
+      date: datetime.date of rows
+
+    Outputs:
+      dict: dictionary of open day file for WriteDayRow and CloseDay
+    """
+    if( not os.path.isdir(self.archive_dir) ):
+      os.makedirs(self.archive_dir)
+    temp_file_name = os.path.join(self.archive_dir, '.audit_log-%s.tmp' % (
+        date.strftime('%Y-%m-%d')))
+    day = {'date': date, 'temp_file_name': temp_file_name,
+           'file': bz2.BZ2File(temp_file_name, 'w'),
+           'old_file_names': [archive_file[3] for archive_file in
+                              self.ListFiles() if archive_file[0] == date],
+           'audit_log_ids': set()}
+    try:
+      for old_file_name in day['old_file_names']:
+        for row in self.ReadFile(old_file_name):
+          self.WriteDayRow(day, row)
+    except:
+      self.AbortDay(day)
+      raise
+    return day
+
+  def WriteDayRow(self, day, row):
+    """Writes a row to an open day file, rows that are already in it are
+    kept once.
+
+    Inputs:
+      day: dictionary of open day file from OpenDay
+      row: audit_log row dict
+    """
+    if( row['audit_log_id'] in day['audit_log_ids'] ):
+      return
+    day['audit_log_ids'].add(row['audit_log_id'])
+    cPickle.dump(row, day['file'], cPickle.HIGHEST_PROTOCOL)
+
+  def CloseDay(self, day):
+    """Moves an open day file in place of the old files of the day.
+
+    Inputs:
+      day: dictionary of open day file from OpenDay
+    """
+    day['file'].close()
+    if( not day['audit_log_ids'] ):
+      os.remove(day['temp_file_name'])
+      return
+    file_name = os.path.join(self.archive_dir, 'audit_log-%s-%s-%s.bz2' % (
+        day['date'].strftime('%Y-%m-%d'), min(day['audit_log_ids']),
+        max(day['audit_log_ids'])))
+    os.rename(day['temp_file_name'], file_name)
+    for old_file_name in day['old_file_names']:
+      if( old_file_name != file_name ):
+        os.remove(old_file_name)
+
+  def AbortDay(self, day):
+    """Drops an open day file, leaving the old files of the day as they were.
+
+    Inputs:
+      day: dictionary of open day file from OpenDay
+    """
+    day['file'].close()
+    if( os.path.exists(day['temp_file_name']) ):
+      os.remove(day['temp_file_name'])
+
+  def WriteRows(self, date, rows):
+    """Adds rows to the archive file of a day. The file is written under a
+    temporary name and then moved in place of the old one, rows that are
+    already in the archive are kept once.
+
+    Inputs:
+      date: datetime.date of rows
+      rows: list of audit_log row dicts
+    """
+    day = self.OpenDay(date)
+    try:
+      for row in rows:
+        self.WriteDayRow(day, row)
+    except:
+      self.AbortDay(day)
+      raise
+    self.CloseDay(day)
+
+  def ListRows(self, audit_dict=None, begin_timestamp=None,
+               end_timestamp=None, begin_audit_log_id=None,
+               end_audit_log_id=None):
+    """Lists archived rows. Files outside of the timestamp and id ranges are
+    not opened.
+
+    Inputs:
+      audit_dict: audit_log row dict of values to match, None matches all
+      begin_timestamp: datetime object of beginning timestamp
+      end_timestamp: datetime object of ending timestamp
+      begin_audit_log_id: int of lowest audit_log_id
+      end_audit_log_id: int of highest audit_log_id
+
+    Outputs:
+      list: list of audit_log row dicts in audit_log_id order
+    """
+    match_items = []
+    if( audit_dict ):
+      match_items = [(key, value) for key, value in audit_dict.iteritems()
+                     if value is not None]
+    rows_by_id = {}
+    for date, first_audit_log_id, last_audit_log_id, file_name in (
+        self.ListFiles()):
+      if( (begin_timestamp is not None and date < begin_timestamp.date()) or
+          (end_timestamp is not None and date > end_timestamp.date()) or
+          (begin_audit_log_id is not None and
+           last_audit_log_id < begin_audit_log_id) or
+          (end_audit_log_id is not None and
+           first_audit_log_id > end_audit_log_id) ):
+        continue
+      for row in self.ReadFile(file_name):
+        if( (begin_timestamp is not None and
+             row['audit_log_timestamp'] < begin_timestamp) or
+            (end_timestamp is not None and
+             row['audit_log_timestamp'] > end_timestamp) or
+            (begin_audit_log_id is not None and
+             row['audit_log_id'] < begin_audit_log_id) or
+            (end_audit_log_id is not None and
+             row['audit_log_id'] > end_audit_log_id) ):
+          continue
+        for key, value in match_items:
+          if( row[key] != value ):
+            break
+        else:
+          rows_by_id[row['audit_log_id']] = row
+    return [rows_by_id[audit_log_id] for audit_log_id in sorted(rows_by_id)]
+
+  def ArchiveAuditLog(self, db_instance):
+    """Moves audit log rows older than the last checkpoint out of the
+    database into the archive.
+
+    The checkpoint is the snapshot of the last successful ExportAllBindTrees.
+    Every row up to it is in the backups of that export, later rows are kept
+    in the database for dnsrecover to replay. Rows are written to the
+    archive before they are removed from the database.
+
+    Each day file is written once per run. Audit log ids follow timestamps,
+    so a day is closed once a chunk of rows starts after it, a row that
+    comes later for a closed day only makes its file be written again.
+
+    Inputs:
+      db_instance: instance of DbAccess class
+
+    Outputs:
+      int: number of rows archived
+    """
+    db_instance.StartTransaction()
+    try:
+      checkpoint_audit_log_id = db_instance.GetLastExportSnapshotAuditLogId()
+    finally:
+      db_instance.EndTransaction()
+    if( checkpoint_audit_log_id is None ):
+      return 0
+
+    audit_log_id = 0
+    days = {}
+    try:
+      while( True ):
+        db_instance.StartTransaction()
+        try:
+          rows = db_instance.ListAuditLogRows(
+              audit_log_id, checkpoint_audit_log_id,
+              constants.AUDIT_LOG_ARCHIVE_CHUNK_SIZE)
+        finally:
+          db_instance.EndTransaction()
+        if( not rows ):
+          break
+        first_date = None
+        for row in rows:
+          date = row['audit_log_timestamp'].date()
+          if( first_date is None or date < first_date ):
+            first_date = date
+          if( date not in days ):
+            days[date] = self.OpenDay(date)
+          self.WriteDayRow(days[date], row)
+        audit_log_id = rows[-1]['audit_log_id']
+        for date in sorted(days):
+          if( date < first_date ):
+            self.CloseDay(days[date])
+            del days[date]
+      for date in sorted(days):
+        self.CloseDay(days[date])
+        del days[date]
+    finally:
+      for day in days.values():
+        self.AbortDay(day)
+
+    if( not audit_log_id ):
+      return 0
+    # Only rows that were read are removed, rows below the checkpoint are
+    # all committed before it.
+    archived_row_count = 0
+    while( True ):
+      db_instance.StartTransaction()
+      try:
+        row_count = db_instance.RemoveAuditLogRows(
+            audit_log_id, constants.AUDIT_LOG_ARCHIVE_CHUNK_SIZE)
+      except:
+        db_instance.EndTransaction(rollback=True)
+        raise
+      db_instance.EndTransaction()
+      archived_row_count += row_count
+      if( row_count < constants.AUDIT_LOG_ARCHIVE_CHUNK_SIZE ):
+        break
+    return archived_row_count
+
 
 class AuditLog(object):
 
   def __init__(self, log_to_syslog=False, log_to_db=False, db_instance=None,
-               log_to_file=False, log_file_name=None):
+               log_to_file=False, log_file_name=None, durability='sync'):
     """Sets where log messages get sent.
     
     Inputs:
@@ -55,16 +594,35 @@ class AuditLog(object):
       db_instance: instance of DbAccess class
       log_to_file: bool of if file is used
       log_file: string of file name to log to
+      durability: string of durability from constants.AUDIT_LOG_DURABILITIES
+
+    Raises:
+      ConfigError: Audit log durability is not supported.
     """
+    if( durability not in constants.AUDIT_LOG_DURABILITIES ):
+      raise errors.ConfigError('Audit log durability "%s" is not supported, '
+                               'use one of %s.' % (
+                                   durability,
+                                   ', '.join(constants.AUDIT_LOG_DURABILITIES)))
     self.log_to_syslog = log_to_syslog
     self.log_to_db = log_to_db
     self.db_instance = db_instance
     self.log_to_file = log_to_file
     self.log_file_name = log_file_name
+    self.durability = durability
 
   def LogAction(self, user, action, data, success, current_transaction=False):
     """Logs action to places specified in initalizer.
 
+    With sync durability everything is written before this returns. With
+    group_commit or async durability the entry is queued for the audit log
+    writer thread, group_commit waits for it to be written. Rows logged in
+    a current transaction are always inserted in that transaction so they
+    are committed or rolled back with it. The row of an AuditedMethod call
+    that was already inserted with LogCommittedAction is not inserted again,
+    which is the case for every call that committed changes. Durability
+    then only decides when the syslog and log file lines are written.
+
     Inputs:
       user: string of user name
       action: string of function name that is being logged
@@ -75,6 +633,10 @@ class AuditLog(object):
                             'acl_name': u'test_acl'}}
       success: bool of success of action
       current_transaction: boolean for if a transaction is already started
+
+    Outputs:
+      int: audit log id if the db is used, None if the row was queued with
+           async durability
     """
     current_datetime = datetime.datetime.now()
     current_timestamp = current_datetime.strftime('%Y-%m-%d %H:%M:%S')
@@ -82,58 +644,122 @@ class AuditLog(object):
                                                          success,
                                                          current_timestamp)
 
-    if( self.log_to_db ):
-      audit_log_id = self._LogToDatabase(user, action, data, success,
-                                         current_datetime, current_transaction)
+    audited_call = helpers_lib.GetAuditedCall(data)
+    audit_log_id = None
+    if( audited_call is not None ):
+      audit_log_id = audited_call['audit_log_id']
+    log_to_db = self.log_to_db and audit_log_id is None
 
-    if( self.log_to_syslog ):
-      self._LogToSyslog(pretty_print_log_string)
+    if( self.durability == 'sync' ):
+      if( log_to_db ):
+        audit_log_id = self._LogToDatabase(user, action, data, success,
+                                           current_datetime,
+                                           current_transaction)
 
-    if( self.log_to_file ):
-      self._LogToFile(pretty_print_log_string)
+      if( self.log_to_syslog ):
+        self._LogToSyslog(pretty_print_log_string)
 
+      if( self.log_to_file ):
+        self._LogToFile(pretty_print_log_string)
+
+    else:
+      entry = {'log_dict': None, 'log_string': None, 'done': None,
+               'audit_log_id': None, 'error': None}
+      if( log_to_db ):
+        if( current_transaction ):
+          audit_log_id = self._LogToDatabase(user, action, data, success,
+                                             current_datetime,
+                                             current_transaction)
+        else:
+          entry['log_dict'] = self._MakeLogDict(user, action, data, success,
+                                                current_datetime)
+      if( self.log_to_syslog or self.log_to_file ):
+        entry['log_string'] = pretty_print_log_string
+      if( entry['log_dict'] is not None or entry['log_string'] is not None ):
+        if( self.durability == 'group_commit' ):
+          entry['done'] = threading.Event()
+        self._GetWriter().Put(entry)
+        if( entry['done'] is not None ):
+          entry['done'].wait()
+          if( entry['error'] is not None ):
+            raise entry['error']
+          if( entry['log_dict'] is not None ):
+            audit_log_id = entry['audit_log_id']
+
+    if( log_to_db and current_transaction and audited_call is not None ):
+      audited_call['audit_log_id'] = audit_log_id
     if( self.log_to_db ):
       return audit_log_id
 
+  def LogCommittedAction(self, user, audited_call):
+    """Inserts the audit log row of a successful AuditedMethod call in the
+    current transaction, so that it is committed with the changes it logs.
+
+    Inputs:
+      user: string of user name
+      audited_call: dictionary of call from helpers_lib.GetAuditedCall
+    """
+    if( self.log_to_db ):
+      audited_call['audit_log_id'] = self._LogToDatabase(
+          user, audited_call['function_name'], audited_call['current_args'],
+          True, datetime.datetime.now(), True)
+
+  def _GetWriter(self):
+    """Gets the audit log writer for the places specified in initalizer.
+
+    Outputs:
+      AuditLogWriter instance
+    """
+    return GetAuditLogWriter(self.db_instance, self.log_to_syslog,
+                             self.log_to_file, self.log_file_name)
+
   def _LogToSyslog(self, log_string):
     """Writes log string to syslog.
 
     Inputs:
       log_string: string of message to write to syslog 
     """
-    syslog.openlog('dnsManagement')
-    # Convert the unicode strings to ascii if needed
-    if( isinstance(log_string, unicode) ):
-      log_string = unicodedata.normalize('NFKD', log_string).encode(
-          'ASCII', 'replace')
-    try:
-      syslog.syslog(log_string)
-    finally:
-      syslog.closelog()
+    WriteSyslog(log_string)
+
+  def _MakeLogDict(self, user, action, data, success, current_timestamp):
+    """Makes an audit_log row dict.
 
-  def _LogToDatabase(self, user, action, data, success, 
-                     current_timestamp, current_transaction):
-    """Writes log data to db.
-    
     Inputs:
       user: string of user name
       action: string of action
       data: string of data
       success: bool of success of action
       current_timestamp: string of mysql formated time stamp
-      current_transaction: boolean for if a transaction is already started
+
+    Outputs:
+      dict: audit_log row dict
     """
     if( success ):
       success = 1
     else:
       success = 0
     data = cPickle.dumps(data)
-    log_dict = {'audit_log_id': None,
-                'audit_log_user_name': user,
-                'action': action,
-                'data': data,
-                'success': success,
-                'audit_log_timestamp': current_timestamp}
+    return {'audit_log_id': None,
+            'audit_log_user_name': user,
+            'action': action,
+            'data': data,
+            'success': success,
+            'audit_log_timestamp': current_timestamp}
+
+  def _LogToDatabase(self, user, action, data, success, 
+                     current_timestamp, current_transaction):
+    """Writes log data to db.
+    
+    Inputs:
+      user: string of user name
+      action: string of action
+      data: string of data
+      success: bool of success of action
+      current_timestamp: string of mysql formated time stamp
+      current_transaction: boolean for if a transaction is already started
+    """
+    log_dict = self._MakeLogDict(user, action, data, success,
+                                 current_timestamp)
     if( not current_transaction ):
       self.db_instance.StartTransaction()
     try:
@@ -152,12 +778,7 @@ class AuditLog(object):
     Inputs:
       log_string: string of message to write to file
     """
-    log_file = open(self.log_file_name, 'a')
-    try:
-      log_file.write('%s\n' % log_string)
-    finally:
-      log_file.flush()
-      log_file.close()
+    self._GetWriter().WriteToFile([log_string])
 
   def _PrettyPrintLogString(self, user, action, data, success,
                             current_timestamp):
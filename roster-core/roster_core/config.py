@@ -59,6 +59,9 @@ class Config(object):
       ConfigError: Variable is not used
       ConfigError: Datatype is not supported
       ConfigError: Variable is missing in config file section
+
+    Variables in constants.CONFIG_FILE_DEFAULTS may be left out of the file,
+    their default is used.
     """
     cp = ConfigParser.SafeConfigParser()
     a = cp.read(file_name)
@@ -68,9 +71,10 @@ class Config(object):
       raise errors.ConfigError('Could not read the file %s' % file_name)
 
     file_schema = constants.CONFIG_FILE_SCHEMA
+    file_defaults = constants.CONFIG_FILE_DEFAULTS
 
     for section in file_schema:
-      self.config_file[section] = {}
+      self.config_file[section] = dict(file_defaults.get(section, {}))
       if( cp.has_section(section) ):
         variables = file_schema[section]
         file_variables = cp.options(section)
@@ -80,6 +84,8 @@ class Config(object):
                                      variable, file_name))
         for variable in variables:
           if( variable not in file_variables ):
+            if( variable in self.config_file[section] ):
+              continue
             raise errors.ConfigError('Variable "%s" is missing in config file: '
                                      '"%s", in the "%s" section.' % ( 
                                      variable, file_name, section))
@@ -119,13 +125,16 @@ class Config(object):
             self.config_file['database']['database'],
             self.config_file['database']['big_lock_timeout'],
             self.config_file['database']['big_lock_wait']]
-    kwargs = {}
+    kwargs = {'connection_pool_size':
+                  self.config_file['database']['connection_pool_size'],
+              'db_slow_query_seconds':
+                  self.config_file['database']['db_slow_query_seconds'],
+              'db_debug_log': self.config_file['database']['db_debug_log']}
     if( self.config_file['database']['ssl'] ):
       kwargs['ssl'] = True
       kwargs['ssl_ca'] = self.config_file['database']['ssl_ca']
     if( self.config_file['database']['db_debug'] ):
       kwargs['db_debug'] = self.config_file['database']['db_debug']
-      kwargs['db_debug_log'] = self.config_file['database']['db_debug_log']
     
     return db_access.dbAccess(*args, **kwargs)
 
@@ -52,6 +52,40 @@ MAX_SOA_SERIAL = 4294967295
 # database of records or read each record individually
 RECORD_RATIO = 20
 
+# This is how many rows IterRow fetches from the server side cursor at a time.
+ITER_ROW_CHUNK_SIZE = 1000
+
+# This is how many rows MakeRows puts in a single multi row INSERT.
+MAKE_ROWS_CHUNK_SIZE = 500
+
+# This is how many ids RemoveRowsById and UpdateRowsById put in one IN list.
+ROWS_BY_ID_CHUNK_SIZE = 1000
+
+# This is how many new records ListRecordConflicts checks in one statement.
+RECORD_CONFLICTS_CHUNK_SIZE = 100
+
+# These are the audit log durabilities that can be set with
+# audit_log_durability in the database section of the config file. The
+# audit log row of a call that changed the database is always inserted in
+# the transaction of its changes, durability only applies to the rows of
+# failed or read only calls and to syslog and log file lines.
+#   sync: entries are written before LogAction returns
+#   group_commit: entries are written by the audit log writer thread in
+#                 batches, LogAction waits for the batch to be committed
+#   async: entries are written by the audit log writer thread in batches,
+#          LogAction returns as soon as the entry is queued
+AUDIT_LOG_DURABILITIES = ['sync', 'group_commit', 'async']
+
+# This is how many audit log entries may be waiting for the writer thread,
+# LogAction blocks when the queue is full.
+AUDIT_LOG_QUEUE_SIZE = 10000
+
+# This is the most audit log entries the writer thread writes in one batch.
+AUDIT_LOG_BATCH_SIZE = 500
+
+# This is how many audit log rows are moved into the archive at a time.
+AUDIT_LOG_ARCHIVE_CHUNK_SIZE = 10000
+
 # These are access levels in enum like variables for readability. These
 # access levels are primarilly for the user table and it's type checking.
 # Any access level used in the code should be listed here.
@@ -63,7 +97,18 @@ ACCESS_LEVELS = {'dns_admin': 128,
 
 # This is a list of tables that are not audit logged when changes are made.
 # it is important not to overwrite these tables when doing a partial replay
-TABLES_NOT_AUDIT_LOGGED = ['audit_log', 'locks']
+TABLES_NOT_AUDIT_LOGGED = ['audit_log', 'locks', 'config_generation']
+
+# Writes to these tables move the database to a new config generation, see
+# dbAccess.GetConfigSnapshot.
+CONFIG_GENERATION_TABLES = ['users', 'groups', 'user_group_assignments',
+                            'forward_zone_permissions',
+                            'reverse_range_permissions',
+                            'group_forward_permissions',
+                            'group_reverse_permissions', 'zones',
+                            'zone_view_assignments', 'views',
+                            'view_dependencies',
+                            'view_dependency_assignments', 'locks']
 
 # This is a list of record types that can be indexed by IP address.
 RECORD_TYPES_INDEXED_BY_IP = ['ptr', 'a', 'aaaa']
@@ -79,7 +124,10 @@ CONFIG_FILE_SCHEMA = {'database': {'server': 'str', 'login': 'str',
                                    'big_lock_timeout': 'int',
                                    'big_lock_wait': 'int', 'ssl': 'boolean',
                                    'ssl_ca': 'str', 'db_debug': 'boolean',
-                                   'db_debug_log': 'str'},
+                                   'db_debug_log': 'str',
+                                   'connection_pool_size': 'int',
+                                   'db_slow_query_seconds': 'float',
+                                   'audit_log_durability': 'str'},
                       'server': {'inf_renew_time': 'int', 'core_die_time': 'int',
                                  'get_credentials_wait_increment': 'int',
                                  'run_as_username': 'str',
@@ -97,7 +145,8 @@ CONFIG_FILE_SCHEMA = {'database': {'server': 'str', 'login': 'str',
                                    'system_email': 'str',
                                    'email_subject': 'str',
                                    'max_threads': 'int',
-                                   'exporter_debug': 'str'},
+                                   'exporter_debug': 'str',
+                                   'audit_log_archive_dir': 'str'},
                       'zone_defaults': {'refresh_seconds': 'int',
                                                    'expiry_seconds': 'int',
                                                    'minimum_seconds': 'int',
@@ -105,6 +154,13 @@ CONFIG_FILE_SCHEMA = {'database': {'server': 'str', 'login': 'str',
                                                    'ns_ttl': 'int',
                                                    'soa_ttl': 'int'}} 
 
+# Variables of CONFIG_FILE_SCHEMA that were added after config files were
+# deployed, with the values used when a config file does not set them.
+CONFIG_FILE_DEFAULTS = {'database': {'connection_pool_size': 10,
+                                     'db_slow_query_seconds': 0.0,
+                                     'audit_log_durability': 'sync'},
+                        'exporter': {'audit_log_archive_dir': ''}}
+
 # The SUPPORTED_METHODS hash contains a hash for every supported method.
 # 'check' indicates whether the target zone/IP range should be checked.
 # 'write' indicates whether the method requires write access.
@@ -375,6 +431,11 @@ SUPPORTED_METHODS = {
                      'write': True,
                      'access_level': ACCESS_LEVELS['user']},
 
+    'AllocateHosts':
+                    {'check': True,
+                     'write': True,
+                     'access_level': ACCESS_LEVELS['user']},
+
     'ListZones':    {'check': False,
                      'write': False,
                      'access_level': ACCESS_LEVELS['user']},
@@ -625,6 +686,9 @@ TABLES = {
     'locks':
         {'lock_name': 'UnicodeString', 'locked': 'IntBool'},
 
+    'config_generation':
+        {'config_generation': 'UnsignedInt'},
+
     'ipv4_index':
         {'ipv4_dec_address': 'UnsignedInt',
          'ipv4_index_record_id': 'UnsignedInt'},
@@ -632,7 +696,32 @@ TABLES = {
     'ipv6_index':
         {'ipv6_dec_upper': 'UnsignedInt',
          'ipv6_dec_lower': 'UnsignedInt',
-         'ipv6_index_record_id': 'UnsignedInt'}}
+         'ipv6_index_record_id': 'UnsignedInt'},
+
+    'ip_allocations':
+        {'ip_allocation_cidr_block': 'UnicodeString',
+         'ip_allocation_next_upper': 'UnsignedInt',
+         'ip_allocation_next_lower': 'UnsignedInt'},
+
+    'flat_records':
+        {'flat_records_record_id': 'UnsignedInt',
+         'flat_records_type': 'UnicodeString',
+         'assignment_ip': 'UnicodeString',
+         'assignment_host': 'UnicodeString',
+         'hardware': 'UnicodeString',
+         'os': 'UnicodeString',
+         'quoted_text': 'UnicodeString',
+         'name_server': 'UnicodeString',
+         'admin_email': 'UnicodeString',
+         'serial_number': 'UnsignedInt',
+         'refresh_seconds': 'UnsignedInt',
+         'retry_seconds': 'UnsignedInt',
+         'expiry_seconds': 'UnsignedInt',
+         'minimum_seconds': 'UnsignedInt',
+         'priority': 'UnsignedInt',
+         'weight': 'UnsignedInt',
+         'port': 'UnsignedInt',
+         'mail_server': 'UnicodeString'}}
 
 
 # vi: set ai aw sw=2:
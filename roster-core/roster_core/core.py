@@ -70,13 +70,17 @@ class Core(object):
     self.dirty = False
     self.unittest_timestamp = unittest_timestamp
     self.db_instance = config_instance.GetDb()
-    self.log_instance = audit_log.AuditLog(log_to_syslog=True, log_to_db=True,
-                                           db_instance=self.db_instance)
+    self.log_instance = audit_log.AuditLog(
+        log_to_syslog=True, log_to_db=True, db_instance=self.db_instance,
+        durability=config_instance.config_file['database'][
+            'audit_log_durability'])
     self.user_instance = user.User(user_name, self.db_instance,
                                    self.log_instance)
+    self.db_instance.SetAuditLog(self.log_instance, user_name)
     self.parent_server_instance = parent_server_instance
     self.config_instance = config_instance
 
+  @helpers_lib.AuditedMethod
   def MakeUser(self, user_name, access_level):
     """Create a user.
 
@@ -131,6 +135,7 @@ class Core(object):
 
     return user_access_level_dict
 
+  @helpers_lib.AuditedMethod
   def RemoveUser(self, user_name):
     """Removes a user.
 
@@ -166,6 +171,7 @@ class Core(object):
 
     return row_count
 
+  @helpers_lib.AuditedMethod
   def UpdateUser(self, search_user_name, update_user_name=None,
                  update_access_level=None):
     """Updates a user.
@@ -224,6 +230,7 @@ class Core(object):
 
     return group_list
 
+  @helpers_lib.AuditedMethod
   def MakeGroup(self, group_name):
     """Make group.
 
@@ -250,6 +257,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveGroup(self, group_name):
     """Remove group.
 
@@ -280,6 +288,7 @@ class Core(object):
                                   current_args, success)
     return row_count
 
+  @helpers_lib.AuditedMethod
   def UpdateGroup(self, search_group_name, update_group_name):
     """Update group.
 
@@ -365,6 +374,7 @@ class Core(object):
 
     return assignments_dict
 
+  @helpers_lib.AuditedMethod
   def MakeUserGroupAssignment(self, user_name, group_name):
     """Make user-group assignment.
 
@@ -393,6 +403,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveUserGroupAssignment(self, user_name, group_name):
     """Remove user-group.
 
@@ -460,6 +471,7 @@ class Core(object):
 
     return acl_cidr_range_dict
 
+  @helpers_lib.AuditedMethod
   def MakeACL(self, acl_name, cidr_block):
     """Makes an acl from args.
 
@@ -489,6 +501,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveACL(self, acl_name):
     """Removes an acl from args. Will also remove relevant acl-view assignments.
 
@@ -520,6 +533,7 @@ class Core(object):
     return row_count
 
 
+  @helpers_lib.AuditedMethod
   def RemoveCIDRBlockFromACL(self, acl_name, cidr_block):
     """Makes CIDR Block from ACL
 
@@ -593,6 +607,7 @@ class Core(object):
 
     return dns_server_dict
 
+  @helpers_lib.AuditedMethod
   def MakeDnsServer(self, dns_server_name, dns_server_ssh_username, 
                     dns_server_bind_dir, dns_server_test_dir):
     """Makes one dns server
@@ -626,6 +641,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveDnsServer(self, dns_server_name):
     """Removes dns server.
 
@@ -665,6 +681,7 @@ class Core(object):
                                   current_args, success)
     return row_count
 
+  @helpers_lib.AuditedMethod
   def UpdateDnsServer(self, search_dns_server_name, update_dns_server_name, 
       update_dns_server_ssh_username, update_dns_server_bind_dir, 
       update_dns_server_test_dir):
@@ -738,6 +755,7 @@ class Core(object):
 
     return dns_server_set_list
 
+  @helpers_lib.AuditedMethod
   def MakeDnsServerSet(self, dns_server_set_name):
     """Make dns server set.
 
@@ -764,6 +782,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveDnsServerSet(self, dns_server_set_name):
     """Remove dns server set.
 
@@ -795,6 +814,7 @@ class Core(object):
                                   current_args, success)
     return row_count
 
+  @helpers_lib.AuditedMethod
   def UpdateDnsServerSet(self, search_dns_server_set_name,
                          update_dns_server_set_name):
     """Update dns_server_set.
@@ -836,6 +856,7 @@ class Core(object):
                                   current_args, success)
     return row_count
 
+  @helpers_lib.AuditedMethod
   def UpdateDnsServerSetViewAssignments(self, search_dns_server_set_name, 
       search_view_name, update_view_order=None, update_view_options=None):
     """Update dns_server_set's view order and view options
@@ -934,6 +955,7 @@ class Core(object):
 
     return assignments_dict
 
+  @helpers_lib.AuditedMethod
   def MakeDnsServerSetAssignments(self, dns_server_name, dns_server_set_name):
     """Make dns server set assignment.
 
@@ -971,6 +993,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveDnsServerSetAssignments(self, dns_server_name, dns_server_set_name):
     """Remove a dns server set assignment
 
@@ -1069,6 +1092,7 @@ class Core(object):
 
     return assignments_dict
 
+  @helpers_lib.AuditedMethod
   def MakeDnsServerSetViewAssignments(self, view_name, view_order, dns_server_set_name,
       view_options=None):
     """Make dns server set view assignment
@@ -1107,6 +1131,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveDnsServerSetViewAssignments(self, view_name, dns_server_set_name):
     """Remove dns server set view assignment
 
@@ -1188,6 +1213,7 @@ class Core(object):
       view_dep_list.append(dep['view_dependency'])
     return view_dep_list
   
+  @helpers_lib.AuditedMethod
   def MakeView(self, view_name):
     """Makes a view and all of the other things that go with a view.
 
@@ -1220,6 +1246,7 @@ class Core(object):
           'view_dependency_assignments_view_dependency'] = u'any'
         self.db_instance.MakeRow('view_dependency_assignments',
                                  view_dependency_assignments_dict)
+        self.db_instance.InvalidateViewDependencyGraph()
       except:
         self.db_instance.EndTransaction(rollback=True)
         raise
@@ -1229,6 +1256,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveView(self, view_name):
     """Removes a view.
 
@@ -1266,6 +1294,7 @@ class Core(object):
           row_count += self.db_instance.RemoveRow('views', view_dict[0])
           row_count += self.db_instance.RemoveRow('view_dependencies',
                                                   view_dep_dict)
+          self.db_instance.InvalidateViewDependencyGraph()
       except:
         self.db_instance.EndTransaction(rollback=True)
         raise
@@ -1276,6 +1305,7 @@ class Core(object):
                                   current_args, success)
     return row_count
 
+  @helpers_lib.AuditedMethod
   def UpdateView(self, search_view_name, update_view_name=None):
     """Updates a view.
 
@@ -1313,6 +1343,7 @@ class Core(object):
         row_count += self.db_instance.UpdateRow('view_dependencies',
                                                 search_view_dep_dict,
                                                 update_view_dep_dict)
+        self.db_instance.InvalidateViewDependencyGraph()
       except:
         self.db_instance.EndTransaction(rollback=True)
         raise
@@ -1374,6 +1405,7 @@ class Core(object):
 
     return view_assignments_dict
 
+  @helpers_lib.AuditedMethod
   def MakeViewAssignment(self, view_superset, view_subset):
     """Assigns a view to view.
 
@@ -1408,6 +1440,7 @@ class Core(object):
       try:
         self.db_instance.MakeRow('view_dependency_assignments',
                                  view_dependency_assignments_dict)
+        self.db_instance.InvalidateViewDependencyGraph()
       except:
         self.db_instance.EndTransaction(rollback=True)
         raise
@@ -1417,6 +1450,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveViewAssignment(self, view_superset, view_subset):
     """Removes a view assignment.
 
@@ -1439,6 +1473,7 @@ class Core(object):
       try:
         row_count = self.db_instance.RemoveRow('view_dependency_assignments',
                                                view_dependency_assignments_dict)
+        self.db_instance.InvalidateViewDependencyGraph()
       except:
         self.db_instance.EndTransaction(rollback=True)
         raise
@@ -1494,6 +1529,7 @@ class Core(object):
 
     return assignments_dicts
 
+  @helpers_lib.AuditedMethod
   def MakeViewToACLAssignments(self, view_name, dns_server_set_name,
                                acl_name, acl_range_allowed):
     """Makes view to acl assignment
@@ -1526,6 +1562,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveViewToACLAssignments(self, view_name, dns_server_set_name,
                                  acl_name, acl_range_allowed):
     """Removes view to acl assignment
@@ -1627,6 +1664,7 @@ class Core(object):
 
     return zone_view_assignments
 
+  @helpers_lib.AuditedMethod
   def MakeZone(self, zone_name, zone_type, zone_origin, view_name=None,
                zone_options=None, make_any=True):
     """Makes a zone.
@@ -1694,6 +1732,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveZone(self, zone_name, view_name=None):
     """Removes a zone.
 
@@ -1748,6 +1787,7 @@ class Core(object):
                                   current_args, success)
     return row_count
 
+  @helpers_lib.AuditedMethod
   def UpdateZone(self, search_zone_name, search_view_name=None,
                  update_zone_name=None, update_zone_options=None):
     """Updates zone options or zone type of zone
@@ -1836,6 +1876,7 @@ class Core(object):
 
     return reverse_range_dict
 
+  @helpers_lib.AuditedMethod
   def MakeReverseRangeZoneAssignment(self, zone_name, cidr_block):
     """Makes a reverse range to zone assignment.
 
@@ -1864,6 +1905,7 @@ class Core(object):
                                   current_args, success)
 
 
+  @helpers_lib.AuditedMethod
   def RemoveReverseRangeZoneAssignment(self, zone_name, cidr_block):
     """Remove reverse range to zone assignment.
 
@@ -1895,6 +1937,7 @@ class Core(object):
                                   current_args, success)
     return row_count
 
+  @helpers_lib.AuditedMethod
   def ListForwardZonePermissions(self, zone_name=None, group_name=None,
                                  group_permission=None):
     """List forward zone permissions.
@@ -1979,6 +2022,7 @@ class Core(object):
 
     return forward_zone_perms_dict
 
+  @helpers_lib.AuditedMethod
   def MakeForwardZonePermission(self, zone_name, group_name,
                                 group_permission=None):
     """Make forward zone permission.
@@ -2029,6 +2073,7 @@ class Core(object):
       if( self.parent_server_instance is not None ):
         self.parent_server_instance.SetCoreCacheDirty()
 
+  @helpers_lib.AuditedMethod
   def UpdateGroupForwardPermission(self, zone_name, group_name, 
                                    new_permissions):
     """Updates forward zone group permissions
@@ -2110,6 +2155,7 @@ class Core(object):
       if( self.parent_server_instance is not None ):
         self.parent_server_instance.SetCoreCacheDirty()
 
+  @helpers_lib.AuditedMethod
   def RemoveForwardZonePermission(self, zone_name, group_name,
                                   group_permission):
     """Remove forward zone permissions.
@@ -2189,6 +2235,7 @@ class Core(object):
 
     return row_count
 
+  @helpers_lib.AuditedMethod
   def ListReverseRangePermissions(self, cidr_block=None, group_name=None,
                                   group_permission=None):
     """List reverse range permissions.
@@ -2276,6 +2323,7 @@ class Core(object):
 
     return reverse_range_perms_dict
 
+  @helpers_lib.AuditedMethod
   def MakeReverseRangePermission(self, cidr_block, group_name,
                                  group_permission=None):
     """Make reverse range permission.
@@ -2325,6 +2373,7 @@ class Core(object):
       if( self.parent_server_instance is not None ):
         self.parent_server_instance.SetCoreCacheDirty()
 
+  @helpers_lib.AuditedMethod
   def UpdateGroupReversePermission(self, cidr_block, group_name, 
                                    new_permissions):
     """Updates forward zone group permissions
@@ -2405,6 +2454,7 @@ class Core(object):
       if( self.parent_server_instance is not None ):
         self.parent_server_instance.SetCoreCacheDirty()
 
+  @helpers_lib.AuditedMethod
   def RemoveReverseRangePermission(self, cidr_block, group_name,
                                    group_permission):
     """Remove reverse range permissions.
@@ -2541,8 +2591,7 @@ class Core(object):
           view_name.endswith('_dep') ):
       view_name = '%s_dep' % view_name
     records_dict = self.db_instance.GetEmptyRowDict('records')
-    record_args_assignment_dict = self.db_instance.GetEmptyRowDict(
-        'record_arguments_records_assignments')
+    flat_records_dict = self.db_instance.GetEmptyRowDict('flat_records')
     records_dict['record_type'] =  record_type
     records_dict['record_target'] = target
     records_dict['record_ttl'] = ttl
@@ -2557,20 +2606,25 @@ class Core(object):
                                               none_ok=True)
     else:
       record_args_dict = {}
-
-
+    for argument_name, argument_value in record_args_dict.iteritems():
+      if( argument_value is not None and constants.TABLES['flat_records'][
+          argument_name] == 'UnicodeString' ):
+        argument_value = unicode(argument_value)
+      flat_records_dict[argument_name] = argument_value
 
     self.db_instance.StartTransaction()
     try:
-      records = self.db_instance.ListRow('records', records_dict,
-                                         'record_arguments_records_assignments',
-                                         record_args_assignment_dict)
+      # Argument filters are matched by the database on flat_records, the
+      # exact compare is still done when the rows are read since MySQL
+      # compares strings case insensitively.
+      records = self.db_instance.IterRow('records', records_dict,
+                                         'flat_records', flat_records_dict)
+      return helpers_lib.GetRecordsFromFlatRecordRows(
+          records, record_args_dict)
     finally:
       self.db_instance.EndTransaction()
 
-    return helpers_lib.GetRecordsFromRecordRowsAndArgumentRows(
-        records, record_args_dict)
-
+  @helpers_lib.AuditedMethod
   def MakeRecord(self, record_type, target, zone_name, record_args_dict,
                  view_name=None, ttl=None):
     """Makes a record.
@@ -2623,10 +2677,6 @@ class Core(object):
     if( ttl is None ):
       ttl = constants.DEFAULT_TTL
 
-    if( record_type in ['cname', 'a', 'aaaa'] ):
-      search_type = None
-    else:
-      search_type = record_type
     records_dict = {'records_id': None,
                     'record_target': target,
                     'record_type': None,
@@ -2634,8 +2684,6 @@ class Core(object):
                     'record_zone_name': zone_name,
                     'record_view_dependency': None,
                     'record_last_user': None}
-    record_args_assignment_dict = self.db_instance.GetEmptyRowDict(
-        'record_arguments_records_assignments')
 
     zone_view_assignments_dict = self.db_instance.GetEmptyRowDict(
         'zone_view_assignments')
@@ -2646,27 +2694,8 @@ class Core(object):
     try:
       self.db_instance.StartTransaction()
       try:
-        view_assignments = self.db_instance.ListRow(
-            'view_dependency_assignments',
-            {'view_dependency_assignments_view_name': None,
-             'view_dependency_assignments_view_dependency': view_name})
-        views = []
-        view_deps = []
-        for view_assignment in view_assignments:
-          if( view_assignment['view_dependency_assignments_view_name'] 
-              not in views ):
-            views.append(view_assignment['view_dependency_assignments_'
-                                         'view_name'])
-          view_assignments_dependencies = self.db_instance.ListRow(
-              'view_dependency_assignments',
-              {'view_dependency_assignments_view_name': view_assignment['view_'
-                  'dependency_assignments_view_name'],
-              'view_dependency_assignments_view_dependency': None})
-          for view in view_assignments_dependencies:
-            if( view['view_dependency_assignments_view_dependency'] 
-                not in view_deps ):
-              view_deps.append(view['view_dependency_'
-                                    'assignments_view_dependency'])
+        views, view_deps = self.db_instance.GetViewDependencyClosure(
+            view_name)
 
         zone_view_assignments = self.db_instance.ListRow('zone_view_assignments',
             zone_view_assignments_dict)
@@ -2687,58 +2716,40 @@ class Core(object):
           raise errors.InvalidInputError('Cannot create records in %s zone %s' % (
               zone_type, zone_name))
 
-        if( record_type == 'cname' ):
-          all_records = self.db_instance.ListRow('records', records_dict)
-          if( len(all_records) > 0 ):
-            for record in all_records:
-              if( record['record_view_dependency'] in view_deps ):
-                raise errors.InvalidInputError('Record already exists with '
-                                               'target %s.' % target)
+        conflict_view_deps = set(view_deps)
+        for view in views:
+          conflict_view_deps.add('%s_dep' % view)
+        conflicts = self.db_instance.ListRecordConflicts(
+            [{'record_type': record_type, 'record_target': target,
+              'record_zone_name': zone_name,
+              'record_view_dependencies': conflict_view_deps,
+              'record_arguments': record_args_dict}],
+            cname_checks_all_views=True)[0]
+        if( conflicts ):
+          if( record_type == u'cname' ):
             raise errors.InvalidInputError('Record already exists with '
                                            'target %s.' % target)
-        records_dict['record_type'] = u'cname'
-        cname_records = self.db_instance.ListRow(
-            'records', records_dict)
-        if( len(cname_records) > 0 ):
-          for record in cname_records:
-            if( record['record_view_dependency'] in view_deps ):
+          for conflict in conflicts:
+            if( conflict['record_type'] == u'cname' ):
               raise errors.InvalidInputError('CNAME already exists with '
                                              'target %s.' % target)
+          raise errors.InvalidInputError('Duplicate record found')
 
-        records_dict['record_type'] = search_type
-        raw_records = self.db_instance.ListRow(
-            'records', records_dict, 'record_arguments_records_assignments',
-            record_args_assignment_dict)
-
-        current_records = (
-            helpers_lib.GetRecordsFromRecordRowsAndArgumentRows(
-                raw_records, record_args_dict))
         records_dict['record_ttl'] = ttl
         records_dict['record_type'] = record_type
         records_dict['record_last_user'] = self.user_instance.GetUserName()
-        
-        for record in current_records:
-          for arg in record_args_dict:
-            if( arg not in record ):
-              break
-            if( record_args_dict[arg] != record[arg] ):
-              break
-          else:
-            if( record['view_name'] in views or 
-                record['view_name'] in view_deps ):
-              raise errors.InvalidInputError('Duplicate record found')
-
-        records_dict['record_type'] = record_type
         records_dict['record_view_dependency'] = view_name
         record_id = self.db_instance.MakeRow('records', records_dict)
+        record_argument_assignments_dicts = []
         for arg_name in record_args_dict:
-          record_argument_assignments_dict = {
+          record_argument_assignments_dicts.append({
              'record_arguments_records_assignments_record_id': record_id,
              'record_arguments_records_assignments_type': record_type,
              'record_arguments_records_assignments_argument_name': arg_name,
-             'argument_value': unicode(record_args_dict[arg_name])}
-          self.db_instance.MakeRow('record_arguments_records_assignments',
-                                   record_argument_assignments_dict)
+             'argument_value': unicode(record_args_dict[arg_name])})
+        self.db_instance.MakeRows('record_arguments_records_assignments',
+                                  record_argument_assignments_dicts)
+        self.db_instance.RefreshFlatRecords([record_id])
         if( record_type in constants.RECORD_TYPES_INDEXED_BY_IP ):
           self._AddRecordToIpIndex(record_type, zone_name, view_name,
                                    record_id, target, record_args_dict)
@@ -2752,6 +2763,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def UpdateRecord(self, search_record_type, search_target, search_zone_name,
                    search_record_args_dict, search_view_name=None,
                    search_ttl=None, update_target=None, update_zone_name=None,
@@ -2914,56 +2926,30 @@ class Core(object):
           else:
             raise errors.InvalidInputError('Duplicate record found')
 
-        if( update_target is not None and update_target != search_target and
-            (search_record_type == 'a' or search_record_type == 'cname') ):
-          current_records = self.db_instance.ListRow('records',
-                                                     update_records_dict)
-        args_search_list = []
+        search_records_dict['record_target'] = search_target
         record_ids = []
-        final_id = []
-        record_id_dict = {}
-        for arg in search_args_list:
-          args_search_list.append(self.db_instance.ListRow(
-              'record_arguments_records_assignments', arg))
-        for index, search_record_args in enumerate(args_search_list):
-          record_ids.append([])
-          for search_args_dict in search_record_args:
-            record_ids[index].append(search_args_dict[
-                u'record_arguments_records_assignments_record_id'])
-        for id_list in record_ids:
-          for search_id in id_list:
-            if( search_id in record_id_dict ):
-              record_id_dict[search_id] += 1
-            else:
-              record_id_dict[search_id] = 1
-        existing_record_search_dict = search_records_dict
-        existing_record_search_dict['record_target'] = search_target
-        existing_records = self.db_instance.ListRow('records',
-                                                    existing_record_search_dict)
-        existing_ids = []
-        for record in existing_records:
-          existing_ids.append(record['records_id'])
-        for record_id in record_id_dict:
-          if( record_id_dict[record_id] == len(search_args_list) ):
-            final_id.append(record_id)
-        final_id_set = set(final_id).intersection(set(existing_ids))
-        if( len(final_id_set) == 0 ):
+        # Records are only found by the arguments that are searched on.
+        if( search_args_list ):
+          record_ids = self.db_instance.ListMatchingRecordIds(
+              search_records_dict, search_record_args_dict)
+        if( len(record_ids) == 0 ):
           raise errors.InvalidInputError('No records found.')
-        elif( len(final_id_set) == 1 ):
-          search_records_dict['records_id'] = final_id_set.pop()
-          new_records = self.db_instance.ListRow('records',
-                                                 search_records_dict)
-          self.db_instance.UpdateRow('records', new_records[0],
-                                                  update_records_dict)
+        elif( len(record_ids) == 1 ):
+          self.db_instance.UpdateRowsById('records', record_ids,
+                                          update_records_dict)
           for update_args in update_args_list:
             for search_args in search_args_list:
               if( search_args[
                   'record_arguments_records_assignments_argument_name'] == (
                       update_args[
                   'record_arguments_records_assignments_argument_name']) ):
+                search_args[
+                    'record_arguments_records_assignments_record_id'] = (
+                        record_ids[0])
                 self.db_instance.UpdateRow(
                     'record_arguments_records_assignments',
                     search_args, update_args)
+          self.db_instance.RefreshFlatRecords(record_ids)
         else:
           raise errors.InvalidInputError(
               'Multiple records found for used search '
@@ -2982,6 +2968,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveRecord(self, record_type, target, zone_name, record_args_dict,
                    view_name, ttl=None):
     """Remove record.
@@ -3019,52 +3006,18 @@ class Core(object):
 
     self.db_instance.ValidateRecordArgsDict(record_type, record_args_dict)
 
-    args_list = []
-    for argument in record_args_dict:
-      args_list.append(
-          {u'record_arguments_records_assignments_argument_name': argument,
-           u'record_arguments_records_assignments_type': record_type,
-           u'argument_value': unicode(record_args_dict[argument]),
-           u'record_arguments_records_assignments_record_id': None})
     success = False
     try:
       self.db_instance.StartTransaction()
       try:
-        new_records = self.db_instance.ListRow('records', records_dict)
-        args_search_list = []
-        record_ids = []
-        final_id = []
-        record_id_dict = {}
-        for arg in args_list:
-          args_search_list.append(self.db_instance.ListRow(
-              'record_arguments_records_assignments', arg))
-        for index, record_args in enumerate(args_search_list):
-          record_ids.append([])
-          for args_dict in record_args:
-            record_ids[index].append(args_dict[
-                u'record_arguments_records_assignments_record_id'])
-        for id_list in record_ids:
-          for search_id in id_list:
-            if( search_id in record_id_dict ):
-              record_id_dict[search_id] += 1
-            else:
-              record_id_dict[search_id] = 1
-        for record_id in record_id_dict:
-          if( record_id_dict[record_id] == len(args_list) ):
-            for record in new_records:
-              if( record['records_id'] == record_id ):
-                final_id.append(record_id)
-        if( len(final_id) == 0 ):
+        record_ids = self.db_instance.ListMatchingRecordIds(records_dict,
+                                                            record_args_dict)
+        if( len(record_ids) == 0 ):
           raise errors.InvalidInputError('No records found.')
-        elif( len(final_id) == 1 ):
-          records_dict['records_id'] = final_id[0]
-          for record in new_records:
-            if( record['records_id'] == final_id[0] ):
-              self.db_instance.RemoveRow('records', record)
-              break
-          else:
+        elif( len(record_ids) == 1 ):
+          if( not self.db_instance.RemoveRowsById('records', record_ids) ):
             raise errors.RecordError('Could not remove record with ID "%s" '
-                                   'for an unknown reason.' % final_id[0])
+                                   'for an unknown reason.' % record_ids[0])
         else:
           raise errors.InvalidInputError(
               'Multiple records found for used search '
@@ -3221,6 +3174,7 @@ class Core(object):
 
     return soa_record_args_dict, ns_record_args_dict
 
+  @helpers_lib.AuditedMethod
   def MakeZoneType(self, zone_type):
     """Makes a new zone type.
 
@@ -3245,6 +3199,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def RemoveZoneType(self, zone_type):
     """Removes a zone type.
 
@@ -3318,6 +3273,7 @@ class Core(object):
 
     return named_conf_list
 
+  @helpers_lib.AuditedMethod
   def MakeNamedConfGlobalOption(self, dns_server_set, options):
     """Makes named conf global option
 
@@ -3353,6 +3309,7 @@ class Core(object):
       self.log_instance.LogAction(self.user_instance.user_name, function_name,
                                   current_args, success)
 
+  @helpers_lib.AuditedMethod
   def MakeReservedWord(self, reserved_word):
     """Create a reserved word.
 
@@ -3399,6 +3356,7 @@ class Core(object):
 
     return reserved_word_list
 
+  @helpers_lib.AuditedMethod
   def RemoveReservedWord(self, reserved_word):
     """Removes a reserved word.
 
@@ -3438,88 +3396,24 @@ class Core(object):
   def _IncrementSoa(self, view_name, zone_name, missing_ok=False):
     """Increments soa serial number.
 
+    The increment is queued and made once per zone and view when the
+    transaction is committed, see dbAccess.QueueSoaIncrement.
+
     Inputs:
       view_name: string of view name
       zone_name: string of view namea
       missing_ok: boolean of whether or not missing SOA records are allowed
 
     Raises:
-      InvalidInputError: Multiple SOA records found..
-      RecordError: No SOA record found for zone.
-
-    Outputs:
-      int: number of rows modified
+      InvalidInputError: Multiple SOA records found.. (on commit)
+      RecordError: No SOA record found for zone. (on commit)
     """
-    soa_dict = self.db_instance.GetEmptyRowDict('records')
-    soa_arguments_dict = self.db_instance.GetEmptyRowDict(
-        'record_arguments_records_assignments')
-    zone_view_assignments_dict = self.db_instance.GetEmptyRowDict(
-        'zone_view_assignments')
-    zone_view_assignments_dict['zone_view_assignments_zone_name'] = zone_name
-    row_count = 0
-
-    soa_dict['record_type'] = u'soa'
     if( view_name is None ):
       view_name = u'any'
-
-    zone_view_assignment_rows = self.db_instance.ListRow(
-        'zone_view_assignments', zone_view_assignments_dict)
-
-    zone_view_assignments = {}
-    for zone_view_assignment in zone_view_assignment_rows:
-      zv_zone_name = zone_view_assignment['zone_view_assignments_zone_name']
-      zv_view_name = zone_view_assignment[
-          'zone_view_assignments_view_dependency']
-      if( zv_zone_name not in zone_view_assignments ):
-        zone_view_assignments[zv_zone_name] = []
-      zone_view_assignments[zv_zone_name].append(zv_view_name)
-
-    view_deps = [view_name]
     if( view_name != u'any' and not view_name.endswith('_dep') ):
-      view_deps = [u'%s_dep' % view_name]
-    elif( view_name == u'any' ):
-      view_deps = zone_view_assignments[zone_name]
-
-    for view_name in view_deps:
-      if( view_name == u'any' ):
-        continue
-      soa_dict['record_view_dependency'] = view_name
-      soa_dict['record_zone_name'] = zone_name
-
-      soa_records_list = self.db_instance.ListRow('records', soa_dict)
-
-      if( len(soa_records_list) > 1 ):
-        raise errors.InvalidInputError('Multiple SOA records found: %s' % 
-                                       str(soa_records_list))
-
-      if( len(soa_records_list) == 0 ):
-        if( not missing_ok ):
-          raise errors.RecordError(
-              'No SOA record found for zone "%s" view "%s".' % (
-              zone_name, view_name))
-      else:
-        soa_records_list = soa_records_list[0]
-        soa_arguments_dict[
-            'record_arguments_records_assignments_record_id'] = (
-                soa_records_list['records_id'])
-        soa_record_arguments = self.db_instance.ListRow(
-            'record_arguments_records_assignments', soa_arguments_dict)
-        for argument in soa_record_arguments:
-          if( argument[
-              'record_arguments_records_assignments_argument_name'] == (
-                  u'serial_number') ):
-            serial_number = int(argument['argument_value'])
-            search_soa_dict = argument
-
-        if( serial_number >= constants.MAX_SOA_SERIAL ):
-          soa_arguments_dict[u'argument_value'] = u'1'
-        else:
-          soa_arguments_dict[u'argument_value'] = unicode(serial_number + 1)
-
-        row_count += self.db_instance.UpdateRow(
-            'record_arguments_records_assignments', search_soa_dict,
-            soa_arguments_dict)
-    return row_count
+      view_name = u'%s_dep' % view_name
+    self.db_instance.QueueSoaIncrement(zone_name, view_name,
+                                       missing_ok=missing_ok)
 
   def _AddRecordToIpIndex(self, record_type, zone_name, view_name, record_id,
                           target, record_args_dict):
@@ -3533,11 +3427,62 @@ class Core(object):
       target: string of the target of the record
       record_args_dict: dictionary of args for the record
     """
+    ip_index_row = self._GetIpIndexRow(record_type, zone_name, view_name,
+                                       record_id, target, record_args_dict)
+    if( ip_index_row is not None ):
+      self.db_instance.MakeRow(*ip_index_row)
+
+  def _AddRecordsToIpIndex(self, records):
+    """Add records to the ipv4 and ipv6 indexes with one MakeRows per index.
+
+    Inputs:
+      records: list of tuples of the args of _AddRecordToIpIndex
+    """
+    zone_origins = {}
+    ip_index_rows = {'ipv4_index': [], 'ipv6_index': []}
+    for (record_type, zone_name, view_name, record_id, target,
+         record_args_dict) in records:
+      zone_origin = None
+      if( record_type == 'ptr' ):
+        if( (zone_name, view_name) not in zone_origins ):
+          zone_origins[(zone_name, view_name)] = (
+              self.db_instance.GetZoneOrigins(zone_name, view_name)[
+                  zone_name][0])
+        zone_origin = zone_origins[(zone_name, view_name)]
+      ip_index_row = self._GetIpIndexRow(record_type, zone_name, view_name,
+                                         record_id, target, record_args_dict,
+                                         zone_origin=zone_origin)
+      if( ip_index_row is not None ):
+        ip_index_rows[ip_index_row[0]].append(ip_index_row[1])
+    for table_name, row_dicts in ip_index_rows.iteritems():
+      self.db_instance.MakeRows(table_name, row_dicts)
+
+  def _GetIpIndexRow(self, record_type, zone_name, view_name, record_id,
+                     target, record_args_dict, zone_origin=None):
+    """Gets the ipv4_index or ipv6_index row of a record.
+
+    Inputs:
+      record_type: string of type of record
+      zone_name: string of zone name
+      view_name: string of view_name
+      record_id: int of id for record
+      target: string of the target of the record
+      record_args_dict: dictionary of args for the record
+      zone_origin: string of the origin of the zone of a ptr record, read
+                   from the database if it is None
+
+    Outputs:
+      tuple: string of table name and row dict, None if the record is not
+             indexed
+        example: ('ipv4_index', {'ipv4_dec_address': 3232235521,
+                                 'ipv4_index_record_id': 10})
+    """
     ip = ''
     if( record_type == 'ptr' ):
-      origin = self.db_instance.GetZoneOrigins(zone_name, view_name)[
-          zone_name][0]
-      ip = helpers_lib.UnReverseIP('%s.%s' % (target, origin))
+      if( zone_origin is None ):
+        zone_origin = self.db_instance.GetZoneOrigins(zone_name, view_name)[
+            zone_name][0]
+      ip = helpers_lib.UnReverseIP('%s.%s' % (target, zone_origin))
       if( self.db_instance.data_validation_instance is None ):
         self.db_instance.InitDataValidation()
       if( self.db_instance.data_validation_instance.isIPv4IPAddress(ip) ):
@@ -3551,7 +3496,7 @@ class Core(object):
       decimal_ip = int(IPy.IP(ip).strDec())
       ipv4_index_dict = {'ipv4_dec_address': decimal_ip,
                          'ipv4_index_record_id': record_id}
-      self.db_instance.MakeRow('ipv4_index', ipv4_index_dict)
+      return ('ipv4_index', ipv4_index_dict)
 
     if( record_type == 'aaaa' ):
       if( not ip ):
@@ -3562,8 +3507,9 @@ class Core(object):
       ipv6_index_dict = {'ipv6_dec_upper': decimal_ip_upper,
                          'ipv6_dec_lower': decimal_ip_lower,
                          'ipv6_index_record_id': record_id}
-      self.db_instance.MakeRow('ipv6_index', ipv6_index_dict)
+      return ('ipv6_index', ipv6_index_dict)
 
+    return None
 
   def _MakeCredential(self, credential, user_name, last_used=None,
                       infinite_cred=False):
@@ -3714,6 +3660,7 @@ class Core(object):
 
     return row_count
 
+  @helpers_lib.AuditedMethod
   def MakeInfiniteCredential(self, user_name, credential=None):
     """Creates an infinite credential.
 
@@ -3760,6 +3707,7 @@ class Core(object):
                                  infinite_cred=infinite_cred,
                                  key_by_user=True)
 
+  @helpers_lib.AuditedMethod
   def RemoveCredential(self, credential=None, user_name=None):
     """Removes a credential
 
@@ -3782,7 +3730,8 @@ class Core(object):
 
   def ListAuditLog(self, user_name=None, action=None, success=None,
                    begin_timestamp=None, end_timestamp=None):
-    """Lists audit log
+    """Lists audit log, including rows that have been moved into the audit
+    log archive.
 
     Inputs:
       user_name: string of user name
@@ -3820,6 +3769,17 @@ class Core(object):
     finally:
       self.db_instance.EndTransaction()
 
+    archive_dir = self.config_instance.config_file['exporter'][
+        'audit_log_archive_dir']
+    if( archive_dir ):
+      audit_log_ids = set([row['audit_log_id'] for row in audit_log_rows])
+      archived_rows = [
+          row for row in audit_log.AuditLogArchive(archive_dir).ListRows(
+              audit_dict, begin_timestamp, end_timestamp)
+          if row['audit_log_id'] not in audit_log_ids]
+      if( archived_rows ):
+        audit_log_rows = tuple(archived_rows) + tuple(audit_log_rows)
+
     return audit_log_rows
 
   def SetMaintenanceFlag(self, value):
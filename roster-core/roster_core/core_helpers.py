@@ -40,6 +40,7 @@ import errors
 import helpers_lib
 
 import datetime
+import itertools
 import dns.zone
 import IPy
 
@@ -68,11 +69,13 @@ class CoreHelpers(object):
     return helpers_lib.UnReverseIP(ip_address)
 
   def CIDRExpand(self, cidr_block, begin=None, end=None):
-    return helpers_lib.CIDRExpand(cidr_block, begin, end)
+    # Clients page through large blocks with begin and end.
+    return list(helpers_lib.CIDRExpand(cidr_block, begin, end))
 
   def ExpandIPV6(self, ip_address):
     return helpers_lib.ExpandIPV6(ip_address)
 
+  @helpers_lib.AuditedMethod
   def GetViewsByUser(self, username):
     """Lists view names available to given username
 
@@ -456,9 +459,8 @@ class CoreHelpers(object):
     for i in range(1, num_octets - 1):
       cidr_for_ipy = '%s.%s' % (cidr_for_ipy, cidr_octets[i])
     cidr_for_ipy = '%s.%s/%s' % (cidr_for_ipy, '0', netmask)
-    expanded_cidr = self.CIDRExpand(cidr_for_ipy,
-                                    begin=long(broadcast_last_octet))
-    expanded_cidr.remove(expanded_cidr[-1])
+    expanded_cidr = helpers_lib.CIDRExpand(
+        cidr_for_ipy, begin=long(broadcast_last_octet))[:-1]
 
     zone_name = self.ListZoneByIPAddress(cidr_block)
     if( zone_name is None ):
@@ -557,13 +559,20 @@ class CoreHelpers(object):
     return access_levels_dict
 
   def ListAvailableIpsInCIDR(self, cidr_block, num_ips=1, view_name=None,
-                             zone_name=None):
+                             zone_name=None, offset=0):
     """Finds first available ips. Only lists as many IPs as are available.
     Returns empty list if no IPs are available in given cidr block and a
     truncated list if only a portion of IPs are available.
 
+    Taken addresses are read in order out of the ip indexes and merged with
+    the block, reading stops once enough free addresses are found.
+
     Inputs:
       cidr_block: string of ipv4 or ipv6 cidr block
+      num_ips: int of the most ips to list
+      view_name: string of view name to look for taken ips in
+      zone_name: string of zone name to look for taken ips in
+      offset: int of how many available ips to skip
 
     Raises:
       InvalidInputError: IP is in a reserved IP space.
@@ -571,6 +580,215 @@ class CoreHelpers(object):
     Outputs:
       list: list of strings of ip addresses
     """
+    cidr_block_ipy = self._GetUnreservedCIDRBlock(cidr_block)
+    self.user_instance.Authorize('ListRecordsByCIDRBlock')
+    if( view_name is not None and not view_name.endswith('_dep') and
+        view_name != u'any' ):
+      view_name = '%s_dep' % view_name
+    first_address = cidr_block_ipy.int()
+    last_address = first_address + cidr_block_ipy.len() - 1
+    avail_ips = []
+    if( num_ips <= 0 ):
+      return avail_ips
+    self.db_instance.StartTransaction()
+    try:
+      taken_addresses = self.db_instance.IterIndexedAddresses(
+          first_address, last_address, cidr_block_ipy.version(),
+          view_dependency=view_name, zone_name=zone_name)
+      for free_first, free_last in helpers_lib.IterFreeAddressRanges(
+          first_address, last_address, taken_addresses):
+        free_count = free_last - free_first + 1
+        if( offset >= free_count ):
+          offset -= free_count
+          continue
+        free_first += offset
+        offset = 0
+        free_last = min(free_last, free_first + num_ips - len(avail_ips) - 1)
+        # xrange does not take ipv6 sized ints.
+        while( free_first <= free_last ):
+          avail_ips.append(helpers_lib.FormatIPAddress(
+              free_first, cidr_block_ipy.version()))
+          free_first += 1
+        if( len(avail_ips) >= num_ips ):
+          break
+    finally:
+      self.db_instance.EndTransaction()
+    return avail_ips
+
+  @helpers_lib.AuditedMethod
+  def AllocateHosts(self, cidr_block, hostnames, view_name, zone_name,
+                    ttl=None):
+    """Allocates free ips in a cidr block to hostnames, making an A or AAAA
+    record and a PTR record for each in one transaction.
+
+    Allocations are run one at a time on the ip_allocations rows of the
+    outermost reverse ranges their block overlaps, so allocations in
+    overlapping blocks never hand out the same address. The block's own row
+    holds the address the last allocation stopped at so the next one
+    continues from there instead of rescanning the block. The network and
+    broadcast addresses of ipv4 blocks larger than a /31 are not allocated.
+
+    Inputs:
+      cidr_block: string of ipv4 or ipv6 cidr block
+      hostnames: list of strings of hostnames, targets in zone_name
+      view_name: string of view name
+      zone_name: string of forward zone name
+      ttl: int of time to live of the records
+
+    Raises:
+      InvalidInputError: IP is in a reserved IP space.
+      InvalidInputError: Not a valid cidr block
+      InvalidInputError: Not enough available ips in cidr block.
+      InvalidInputError: No suitable reverse range zone assignments found.
+      InvalidInputError: Zone does not exist in view.
+
+    Outputs:
+      list: list of strings of ip addresses in the order of hostnames
+    """
+    function_name, current_args = helpers_lib.GetFunctionNameAndArgs()
+    cidr_block_ipy = self._GetUnreservedCIDRBlock(cidr_block)
+    ip_version = cidr_block_ipy.version()
+    if( ip_version == 4 ):
+      record_type = u'a'
+    else:
+      record_type = u'aaaa'
+    if( not view_name.endswith('_dep') and view_name != u'any' ):
+      view_name = '%s_dep' % view_name
+    cidr_block = unicode(cidr_block_ipy.strNormal(1))
+    first_address = cidr_block_ipy.int()
+    last_address = first_address + cidr_block_ipy.len() - 1
+    if( ip_version == 4 and cidr_block_ipy.prefixlen() < 31 ):
+      first_address += 1
+      last_address -= 1
+    ip_addresses = []
+    success = False
+    try:
+      self.db_instance.StartTransaction()
+      try:
+        reverse_ranges = []
+        for row in self.db_instance.ListRow(
+            'reverse_range_zone_assignments',
+            self.db_instance.GetEmptyRowDict(
+                'reverse_range_zone_assignments')):
+          reverse_range = IPy.IP(
+              row['reverse_range_zone_assignments_cidr_block'])
+          if( reverse_range.version() == ip_version ):
+            reverse_ranges.append((
+                reverse_range.int(),
+                reverse_range.int() + reverse_range.len() - 1,
+                row['reverse_range_zone_assignments_zone_name'],
+                unicode(reverse_range.strNormal(1))))
+        # Addresses outside of every reverse range are never allocated, so
+        # two blocks that share an address that can be allocated overlap the
+        # same outermost reverse range. Rows are locked in address order.
+        lock_ranges = set()
+        for range_first, range_last, reverse_zone_name, range_cidr in (
+            reverse_ranges):
+          if( range_first > last_address or range_last < first_address ):
+            continue
+          for outer_first, outer_last, outer_zone_name, outer_cidr in (
+              reverse_ranges):
+            if( outer_first <= range_first and range_last <= outer_last and
+                (outer_first, outer_last) != (range_first, range_last) ):
+              break
+          else:
+            lock_ranges.add((range_first, range_cidr))
+        for range_first, range_cidr in sorted(lock_ranges):
+          self.db_instance.LockIpAllocation(range_cidr, range_first)
+        next_address = self.db_instance.LockIpAllocation(cidr_block,
+                                                         first_address)
+        if( not first_address <= next_address <= last_address ):
+          next_address = first_address
+        # Allocation continues from the next address to the end of the block
+        # then wraps around to its start.
+        addresses = []
+        for walk_first, walk_last in ((next_address, last_address),
+                                      (first_address, next_address - 1)):
+          taken_addresses = self.db_instance.IterIndexedAddresses(
+              walk_first, walk_last, ip_version)
+          for free_first, free_last in helpers_lib.IterFreeAddressRanges(
+              walk_first, walk_last, taken_addresses):
+            while( free_first <= free_last and
+                   len(addresses) < len(hostnames) ):
+              addresses.append(free_first)
+              free_first += 1
+            if( len(addresses) >= len(hostnames) ):
+              break
+          if( len(addresses) >= len(hostnames) ):
+            break
+        else:
+          raise errors.InvalidInputError(
+              'Not enough available ips in %s for %s hosts.' % (
+                  cidr_block, len(hostnames)))
+
+        zone_origins = {}
+        add_records = []
+        for hostname, address in zip(hostnames, addresses):
+          ip_address = helpers_lib.FormatIPAddress(address, ip_version)
+          for range_first, range_last, reverse_zone_name, range_cidr in (
+              reverse_ranges):
+            if( range_first <= address <= range_last ):
+              break
+          else:
+            raise errors.InvalidInputError(
+                'No suitable reverse range zone assignments found.')
+          for origin_zone_name in (zone_name, reverse_zone_name):
+            if( origin_zone_name not in zone_origins ):
+              origins = self.db_instance.GetZoneOrigins(origin_zone_name,
+                                                        view_name)
+              if( not origins ):
+                raise errors.InvalidInputError(
+                    'Zone %s does not exist in view %s.' % (
+                        origin_zone_name, view_name))
+              zone_origins[origin_zone_name] = origins[origin_zone_name][0]
+          # Count number of characters in zone origin, add one to count the
+          # extra period and remove that number of characters from the
+          # target.
+          ptr_target = helpers_lib.ReverseIP(ip_address)[
+              :-(len(zone_origins[reverse_zone_name]) + 1)]
+          add_records.append(
+              {'record_type': record_type, 'record_target': hostname,
+               'record_zone_name': zone_name,
+               'record_view_dependency': view_name, 'ttl': ttl,
+               'record_arguments': {u'assignment_ip': ip_address}})
+          add_records.append(
+              {'record_type': u'ptr', 'record_target': ptr_target,
+               'record_zone_name': reverse_zone_name,
+               'record_view_dependency': view_name, 'ttl': ttl,
+               'record_arguments': {u'assignment_host': u'%s.%s' % (
+                   hostname, zone_origins[zone_name])}})
+          ip_addresses.append(ip_address)
+        self._ProcessRecordsBatch([], add_records, {'delete': [], 'add': []},
+                                  function_name)
+
+        if( addresses ):
+          next_address = addresses[-1] + 1
+          if( next_address > last_address ):
+            next_address = first_address
+          self.db_instance.SetIpAllocation(cidr_block, next_address)
+      except:
+        self.db_instance.EndTransaction(rollback=True)
+        raise
+      self.db_instance.EndTransaction()
+      success = True
+    finally:
+      self.log_instance.LogAction(self.user_instance.user_name, function_name,
+                                  current_args, success)
+    return ip_addresses
+
+  def _GetUnreservedCIDRBlock(self, cidr_block):
+    """Makes an IPy.IP of a cidr block that is not in a reserved IP space.
+
+    Inputs:
+      cidr_block: string of ipv4 or ipv6 cidr block
+
+    Raises:
+      InvalidInputError: IP is in a reserved IP space.
+      InvalidInputError: Not a valid cidr block
+
+    Outputs:
+      IPy.IP: cidr block
+    """
     try:
       cidr_block_ipy = IPy.IP(cidr_block)
     except ValueError:
@@ -584,24 +802,10 @@ class CoreHelpers(object):
     for cidr in reserved:
       reserved_ips.append(IPy.IP(cidr))
     for reserved_ip in reserved_ips:
-      if( IPy.IP(cidr_block) in reserved_ip ):
+      if( cidr_block_ipy in reserved_ip ):
         raise errors.InvalidInputError(
             '%s is in a reserved IP space' % cidr_block)
-    records = self.ListRecordsByCIDRBlock(cidr_block, view_name=view_name,
-                                          zone_name=zone_name)
-    taken_ips = []
-    avail_ips = []
-    for view in records:
-      for ip in records[view]:
-        taken_ips.append(ip)
-    count = 0L
-    while( count < cidr_block_ipy.len() ):
-      if( len(avail_ips) >= num_ips ):
-        break
-      if( cidr_block_ipy[count].strFullsize() not in taken_ips ):
-        avail_ips.append(cidr_block_ipy[count].strFullsize())
-      count += 1L
-    return avail_ips
+    return cidr_block_ipy
 
   def ListRecordsByCIDRBlock(self, cidr_block, view_name=None, zone_name=None):
     """Lists records in a given cidr block.
@@ -631,7 +835,7 @@ class CoreHelpers(object):
                           u'zone_origin': u'1.168.192.in-addr.arpa.'}]}}
     """
     self.user_instance.Authorize('ListRecordsByCIDRBlock')
-    record_list = {}
+    parsed_record_dict = {}
     try:
       IPy.IP(cidr_block)
     except ValueError:
@@ -656,9 +860,7 @@ class CoreHelpers(object):
     zone_view_assignments_dict = self.db_instance.GetEmptyRowDict(
         'zone_view_assignments')
     zone_dict = self.db_instance.GetEmptyRowDict('zones')
-    record_arguments_records_assignments_dict = (
-        self.db_instance.GetEmptyRowDict(
-            'record_arguments_records_assignments'))
+    flat_records_dict = self.db_instance.GetEmptyRowDict('flat_records')
 
     if( view_name is not None and
         view_name.endswith('_dep') or view_name == u'any' ):
@@ -676,15 +878,16 @@ class CoreHelpers(object):
       self.db_instance.StartTransaction()
       ip_index_dict = self.db_instance.GetEmptyRowDict('ipv4_index')
       try:
-        record_list = self.db_instance.ListRow(
+        record_list = self.db_instance.IterRow(
             'ipv4_index', ip_index_dict,
             'records', records_dict,
             'zones', zone_dict,
             'zone_view_assignments', zone_view_assignments_dict,
-            'record_arguments_records_assignments', 
-            record_arguments_records_assignments_dict,
+            'flat_records', flat_records_dict,
             column='ipv4_dec_address',
             range_values=(decimal_ip_lower, decimal_ip_upper))
+        parsed_record_dict = helpers_lib.GetRecordsByIPFromRecordRows(
+            record_list)
       finally:
         self.db_instance.EndTransaction()
     elif( cidr_ip.version() == 6 ):
@@ -715,84 +918,19 @@ class CoreHelpers(object):
         range_values = (decimal_ip_upper_lower, decimal_ip_upper_upper)
       self.db_instance.StartTransaction()
       try:
-        record_list = self.db_instance.ListRow(
+        record_list = self.db_instance.IterRow(
             'ipv6_index', ip_index_dict,
             'records', records_dict,
             'zones', zone_dict,
             'zone_view_assignments', zone_view_assignments_dict,
-            'record_arguments_records_assignments',
-            record_arguments_records_assignments_dict,
+            'flat_records', flat_records_dict,
             column=column,
             range_values=range_values)
+        parsed_record_dict = helpers_lib.GetRecordsByIPFromRecordRows(
+            record_list)
       finally:
         self.db_instance.EndTransaction()
 
-    ## Parse returned list
-    parsed_record_dict = {}
-    for _, record_entry in enumerate(record_list):
-      if( record_entry[u'record_type'] not in
-          constants.RECORD_TYPES_INDEXED_BY_IP ):
-        raise errors.IPIndexError('Record type not indexable by '
-                                  'IP: %s' % record_entry)
-      if( record_entry[u'record_view_dependency'].endswith('_dep') ):
-        record_view = record_entry[u'record_view_dependency'][:-4]
-      else:
-        record_view = record_entry[u'record_view_dependency']
-      if( record_view not in parsed_record_dict ):
-        parsed_record_dict[record_view] = {}
-      if( u'ipv4_dec_address' in record_entry ):
-        record_ip = u'%s' % (
-            IPy.IP(record_entry[u'ipv4_dec_address']).strNormal(1))
-        if( record_ip not in parsed_record_dict[record_view] ):
-          parsed_record_dict[record_view][record_ip] = []
-      elif( u'ipv6_dec_upper' in record_entry ):
-        decimal_ip = (
-            (record_entry[u'ipv6_dec_upper'] << 64) +
-            (record_entry[u'ipv6_dec_lower']) )
-        record_ip = u'%s' % IPy.IP(decimal_ip).strFullsize(0)
-        if( record_ip not in parsed_record_dict[record_view] ):
-          parsed_record_dict[record_view][record_ip] = []
-      else:
-        raise errors.IPIndexError(
-            'Record type unknown. Missing ipv4 or ipv6 dec index: %s' % (
-            record_entry))
-      record_item = {}
-      record_item['records_id'] = record_entry['records_id']
-      record_item['record_type'] = record_entry['record_type']
-      record_item['record_target'] = record_entry['record_target']
-      record_item['record_ttl'] = record_entry['record_ttl']
-      record_item['record_zone_name'] = record_entry['record_zone_name']
-      record_item[u'zone_origin'] = record_entry[u'zone_origin']
-      record_item['record_view_dependency'] = record_entry[
-          'record_view_dependency']
-      #record_item['record_last_updated'] = record_entry['record_last_updated']
-      record_item['record_last_user'] = record_entry['record_last_user']
-      if record_entry[u'record_view_dependency'].endswith('_dep'):
-        record_item[u'view_name'] = record_entry[u'record_view_dependency'][:-4]
-      else:
-        record_item[u'view_name'] = record_entry[u'record_view_dependency']
-      if( record_entry[u'record_type'] == u'a' or
-          record_entry[u'record_type'] == u'aaaa' ):
-        record_item[u'forward'] = True
-        record_item[u'host'] = '%s.%s' % (
-            record_entry[u'record_target'],
-            record_entry[u'zone_origin'][:-1])
-        record_item[u'zone_origin'] = record_entry['zone_origin']
-        record_item[u'record_target'] = record_entry['record_target']
-        record_item[u'record_args_dict'] = {
-            'assignment_ip': record_entry['argument_value']}
-        parsed_record_dict[record_view][record_ip].append( record_item )
-      elif( record_entry[u'record_type'] == u'ptr' ):
-        record_item[u'zone_origin'] = record_entry['zone_origin']
-        record_item[u'record_target'] = record_entry['record_target']
-        record_item[u'forward'] = False
-        record_item[u'host'] = record_entry[u'argument_value'][:-1]
-        assignment_ip = helpers_lib.UnReverseIP(
-            '%s.%s' % (
-                record_entry['record_target'],record_entry['zone_origin']))
-        record_item[u'record_args_dict'] = {'assignment_ip': assignment_ip}
-        parsed_record_dict[record_view][record_ip].insert(0, record_item )
-
     return parsed_record_dict
 
   def ListRecordsByZone(self, zone_name, view_name=None):
@@ -817,16 +955,13 @@ class CoreHelpers(object):
                           u'zone_origin': u'1.168.192.in-addr.arpa.'}]}}
     """
     self.user_instance.Authorize('ListRecordsByZone')
-    record_list = {}
-    
+
     records_dict = self.db_instance.GetEmptyRowDict('records')
     zone_view_assignments_dict = self.db_instance.GetEmptyRowDict(
         'zone_view_assignments')
     zone_dict = self.db_instance.GetEmptyRowDict('zones')
     zone_dict['zone_name'] = zone_name
-    record_arguments_records_assignments_dict = (
-        self.db_instance.GetEmptyRowDict(
-            'record_arguments_records_assignments'))
+    flat_records_dict = self.db_instance.GetEmptyRowDict('flat_records')
     ipv4_index_dict = self.db_instance.GetEmptyRowDict('ipv4_index')
     ipv6_index_dict = self.db_instance.GetEmptyRowDict('ipv6_index')
     if( view_name is not None and
@@ -837,81 +972,19 @@ class CoreHelpers(object):
 
     args_ipv4 = ['zone_view_assignments', zone_view_assignments_dict,
                  'zones', zone_dict, 'records', records_dict,
-                 'record_arguments_records_assignments',
-                 record_arguments_records_assignments_dict]
+                 'flat_records', flat_records_dict]
     args_ipv6 = args_ipv4 + ['ipv6_index', ipv6_index_dict]
     args_ipv4.append('ipv4_index')
     args_ipv4.append(ipv4_index_dict)
     self.db_instance.StartTransaction()
     try:
-      record_list = self.db_instance.ListRow(*args_ipv4)
-      record_list = record_list + self.db_instance.ListRow(*args_ipv6)
+      # The second query only runs once the first one has been read off.
+      record_list = itertools.chain(self.db_instance.IterRow(*args_ipv4),
+                                    self.db_instance.IterRow(*args_ipv6))
+      parsed_record_dict = helpers_lib.GetRecordsByIPFromRecordRows(
+          record_list)
     finally:
       self.db_instance.EndTransaction()
-    #Parsing Records
-    parsed_record_dict = {}
-    for record_entry in record_list:
-      if( record_entry[u'record_type'] not in 
-          constants.RECORD_TYPES_INDEXED_BY_IP ):
-        raise errors.IPIndexError('Record type not indexable by '
-                                  'IP: %s' % record_entry)
-      if( record_entry[u'record_view_dependency'].endswith('_dep') ):
-        record_view = record_entry[u'record_view_dependency'][:-4]
-      else:
-        record_view = record_entry[u'record_view_dependency']
-      if( record_view not in parsed_record_dict ):
-          parsed_record_dict[record_view] = {}
-      if( u'ipv4_dec_address' in record_entry ):
-        record_ip = u'%s' % (
-            IPy.IP(record_entry[u'ipv4_dec_address']).strNormal(1))
-        if( record_ip not in parsed_record_dict[record_view] ):
-          parsed_record_dict[record_view][record_ip] = []
-      elif( u'ipv6_dec_upper' in record_entry ):
-        decimal_ip = (
-            (record_entry[u'ipv6_dec_upper'] << 64) +
-            (record_entry[u'ipv6_dec_lower']) )
-        record_ip = u'%s' % IPy.IP(decimal_ip).strFullsize(0)
-        if( record_ip not in parsed_record_dict[record_view] ):
-          parsed_record_dict[record_view][record_ip] = []
-      else:
-        raise errors.IPIndexError(
-            'Record type unknown. Missing ipv4 or ipv6 dec index: %s' % (
-            record_entry))
-      record_item = {}
-      record_item['records_id'] = record_entry['records_id']
-      record_item['record_type'] = record_entry['record_type']
-      record_item['record_target'] = record_entry['record_target']
-      record_item['record_ttl'] = record_entry['record_ttl']
-      record_item['record_zone_name'] = record_entry['record_zone_name']
-      record_item[u'zone_origin'] = record_entry[u'zone_origin']
-      record_item['record_view_dependency'] = record_entry[
-                                              'record_view_dependency']
-      record_item['record_last_user'] = record_entry['record_last_user']
-      if record_entry[u'record_view_dependency'].endswith('_dep'):
-        record_item[u'view_name'] = record_entry[u'record_view_dependency'][:-4]
-      else:
-        record_item[u'view_name'] = record_entry[u'record_view_dependency']
-      if( record_entry[u'record_type'] == u'a' or
-          record_entry[u'record_type'] == u'aaaa' ):
-        record_item[u'forward'] = True
-        record_item[u'host'] = '%s.%s' % (
-            record_entry[u'record_target'],
-            record_entry[u'zone_origin'][:-1])
-        record_item[u'zone_origin'] = record_entry['zone_origin']
-        record_item[u'record_target'] = record_entry['record_target']
-        record_item[u'record_args_dict'] = {
-            'assignment_ip': record_entry['argument_value']}
-        parsed_record_dict[record_view][record_ip].append(record_item)
-      elif( record_entry[u'record_type'] == u'ptr' ):
-        record_item[u'zone_origin'] = record_entry['zone_origin']
-        record_item[u'record_target'] = record_entry['record_target']
-        record_item[u'forward'] = False
-        record_item[u'host'] = record_entry[u'argument_value'][:-1]
-        assignment_ip = helpers_lib.UnReverseIP(
-            '%s.%s' % (
-                record_entry['record_target'],record_entry['zone_origin']))
-        record_item[u'record_args_dict'] = {'assignment_ip': assignment_ip}
-        parsed_record_dict[record_view][record_ip].insert(0, record_item )
     return parsed_record_dict
 
   def SortRecordsByHost(self, records_dict):
@@ -974,6 +1047,7 @@ class CoreHelpers(object):
       if( user_ip in db_cidr ):
         return reverse_range_zone_assignment
 
+  @helpers_lib.AuditedMethod
   def RemoveCNamesByAssignmentHost(self, hostname, view_name, zone_name):
     """Removes cname's by assignment hostname, will not remove cnames
     that the user does not have permissin to remove. The function will continue
@@ -1012,6 +1086,7 @@ class CoreHelpers(object):
             'record_arguments_records_assignments',
             record_arguments_record_assignments_dict)
         remove_record_dict = {}
+        remove_record_ids = []
         for record_argument in found_record_arguments:
           remove_record_dict[record_argument[
               'record_arguments_records_assignments_record_id']] = {
@@ -1035,10 +1110,11 @@ class CoreHelpers(object):
                 current_transaction=True)
           except errors.AuthorizationError:
             continue
-          row_count += self.db_instance.RemoveRow(
-              'records', found_records_dict[0])
+          remove_record_ids.append(record_id)
           remove_record_dict[record_id].update({
               'cname_host': found_records_dict[0]['record_target']})
+        row_count += self.db_instance.RemoveRowsById('records',
+                                                     remove_record_ids)
       except:
         self.db_instance.EndTransaction(rollback=True)
         raise
@@ -1085,6 +1161,7 @@ class CoreHelpers(object):
 
     return record_args_dict
 
+  @helpers_lib.AuditedMethod
   def ProcessRecordsBatch(self, delete_records=None, add_records=None,
                           zone_import=False):
     """Proccess batches of records
@@ -1117,156 +1194,13 @@ class CoreHelpers(object):
     function_name, current_args = helpers_lib.GetFunctionNameAndArgs()
     log_dict = {'delete': [], 'add': []}
     row_count = 0
-    changed_view_dep = []
     success = False
     try:
-      for record in add_records:
-        self.db_instance.ValidateRecordArgsDict(record[u'record_type'], 
-                                                record[u'record_arguments'])
-
       self.db_instance.StartTransaction()
       try:
-        # REMOVE RECORDS
-        for record in delete_records:
-          record_dict = self.db_instance.GetEmptyRowDict('records')
-          record_dict['records_id'] = record['records_id']
-          record_dict['record_type'] = record['record_type']
-          record_dict['record_target'] = record['record_target']
-          record_dict['record_ttl'] = record['record_ttl']
-          if( record['record_view_dependency'].endswith('_dep') or
-              record['record_view_dependency'] == u'any' ):
-            record_dict['record_view_dependency'] = record[
-                'record_view_dependency']
-          else:
-            record_dict['record_view_dependency'] = (
-                '%s_dep' % record['record_view_dependency'])
-          record_dict['record_zone_name'] = record['record_zone_name']
-          record_dict['record_last_user'] = record['record_last_user']
-          record_args_dict = self.ConstructRecordArgsDictFromRecordID(
-              record['records_id'])
-
-          self.user_instance.Authorize('ProcessRecordsBatch',
-              record_data = {
-                  'target': record['record_target'],
-                  'zone_name': record['record_zone_name'],
-                  'view_name': record_dict['record_view_dependency'],
-                  'record_type': record['record_type'],
-                  'record_args_dict': record_args_dict},
-              current_transaction=True)
-
-          rows_deleted = self.db_instance.RemoveRow('records', record_dict)
-          log_dict['delete'].append(record)
-          row_count += 1
-          if( rows_deleted > 1 ):
-            raise errors.RecordsBatchError(
-                  'Record specification too broad, '
-                  'found %d matching records for %s.' % (
-                      rows_deleted, record_dict))
-          elif( rows_deleted == 0 ):
-            raise errors.RecordsBatchError(
-                  'No record found for :%s' % record_dict)
-
-        # ADD RECORDS
-        for record in add_records:
-
-          #Target length check
-          if( not self.db_instance.data_validation_instance.isTarget(
-              record[u'record_target']) ):
-            raise errors.InvalidInputError('Target hostname is invalid. %s' % (
-                record[u'record_target']))
-
-          view_name = record['record_view_dependency']
-          if( not record['record_view_dependency'].endswith('_dep') and record[
-                'record_view_dependency'] != u'any'):
-            view_name = '%s_dep' % record['record_view_dependency']
-          self.user_instance.Authorize('ProcessRecordsBatch',
-              record_data = {
-                  'target': record['record_target'],
-                  'zone_name': record['record_zone_name'],
-                  'view_name': view_name,
-                  'record_type': record['record_type'],
-                  'record_args_dict': record['record_arguments']},
-              current_transaction=True)
-          if( record['record_type'] == u'ptr' ):
-            if( record['record_arguments'][
-                'assignment_host'].startswith('@.') ):
-              record['record_arguments']['assignment_host'] = record[
-                  'record_arguments']['assignment_host'].lstrip('@.')
-          changed_view_dep.append((view_name, record['record_zone_name']))
-          ttl = None
-          if( 'ttl' in record ):
-            ttl = record['ttl']
-          if( ttl is None ):
-            ttl = constants.DEFAULT_TTL
-
-          records_dict = {'records_id': None,
-                          'record_target': record['record_target'],
-                          'record_type': None,
-                          'record_ttl': None,
-                          'record_zone_name': record['record_zone_name'],
-                          'record_view_dependency': view_name,
-                          'record_last_user': None}
-
-          if( record['record_type'] == 'cname' ):
-            all_records = self.db_instance.ListRow('records', records_dict)
-            if( len(all_records) > 0 ):
-              raise errors.RecordsBatchError(
-                  'Record already exists with target %s.' % (
-                  record['record_target']))
-          records_dict['record_type'] = u'cname'
-          cname_records = self.db_instance.ListRow('records', records_dict)
-          if( len(cname_records) > 0 ):
-            raise errors.RecordsBatchError('CNAME already exists with target '
-                                           '%s.' % (record['record_target']))
-
-          record_args_assignment_dict = self.db_instance.GetEmptyRowDict(
-              'record_arguments_records_assignments')
-          records_dict['record_type'] = record['record_type']
-          raw_records = self.db_instance.ListRow(
-              'records', records_dict, 'record_arguments_records_assignments',
-              record_args_assignment_dict)
-          records_dict['record_last_user'] = self.user_instance.GetUserName()
-          records_dict['record_ttl'] = ttl
-          current_records = (
-              helpers_lib.GetRecordsFromRecordRowsAndArgumentRows(
-              raw_records, record['record_arguments']))
-          for current_record in current_records:
-            for arg in record['record_arguments'].keys():
-              if( arg not in current_record ):
-                break
-              if( record['record_arguments'][arg] is None ):
-                continue
-              if( record['record_arguments'][arg] != current_record[arg] ):
-                break
-            else:
-              raise errors.RecordsBatchError('Duplicate record found: %s' %
-                                             current_record)
-
-
-          records_dict['record_type'] = record['record_type']
-          record_id = self.db_instance.MakeRow('records', records_dict)
-          for arg in record['record_arguments'].keys():
-            record_argument_assignments_dict = {
-               'record_arguments_records_assignments_record_id': record_id,
-               'record_arguments_records_assignments_type': record[
-                   'record_type'],
-               'record_arguments_records_assignments_argument_name': arg,
-               'argument_value': unicode(record['record_arguments'][arg])}
-            self.db_instance.MakeRow('record_arguments_records_assignments',
-                                     record_argument_assignments_dict)
-            log_dict['add'].append(record)
-            row_count += 1
-          if( records_dict['record_type'] in
-              constants.RECORD_TYPES_INDEXED_BY_IP ):
-            self.core_instance._AddRecordToIpIndex(
-                records_dict['record_type'], records_dict['record_zone_name'],
-                records_dict['record_view_dependency'],
-                record_id, records_dict['record_target'],
-                record['record_arguments'])
-        changed_view_dep = set(changed_view_dep)
-        for view_dep_pair in changed_view_dep:
-          self.core_instance._IncrementSoa(*view_dep_pair, missing_ok=zone_import)
-
+        row_count = self._ProcessRecordsBatch(delete_records, add_records,
+                                              log_dict, function_name,
+                                              zone_import=zone_import)
       except:
         self.db_instance.EndTransaction(rollback=True)
         raise
@@ -1277,6 +1211,212 @@ class CoreHelpers(object):
                                   current_args, success)
     return row_count
 
+  def _ProcessRecordsBatch(self, delete_records, add_records, log_dict,
+                           method, zone_import=False):
+    """Proccess batches of records in the current transaction, see
+    ProcessRecordsBatch.
+
+    Inputs:
+      delete_records: list of dictionaries of records
+      add_records: list of dictionaries of records
+      log_dict: dictionary of 'delete' and 'add' lists that processed records
+                are appended to
+      method: string of method to authorize the records with
+      zone_import: boolean of whether or not missing SOA records are allowed
+
+    Raises:
+      RecordsBatchError: No record found
+      RecordsBatchError: Record already exists
+      RecordsBatchError: CNAME already exists
+      RecordsBatchError: Duplicate record found
+
+    Outputs:
+      int: row count
+    """
+    for record in add_records:
+      self.db_instance.ValidateRecordArgsDict(record[u'record_type'],
+                                              record[u'record_arguments'])
+    row_count = 0
+    changed_view_dep = []
+
+    # The batch is run in phases, each phase handles every record with
+    # a few set statements: read, authorize, remove, check conflicts,
+    # then add.
+
+    # READ RECORDS TO DELETE
+    delete_record_dicts = []
+    for record in delete_records:
+      record_dict = self.db_instance.GetEmptyRowDict('records')
+      record_dict['records_id'] = record['records_id']
+      record_dict['record_type'] = record['record_type']
+      record_dict['record_target'] = record['record_target']
+      record_dict['record_ttl'] = record['record_ttl']
+      if( record['record_view_dependency'].endswith('_dep') or
+          record['record_view_dependency'] == u'any' ):
+        record_dict['record_view_dependency'] = record[
+            'record_view_dependency']
+      else:
+        record_dict['record_view_dependency'] = (
+            '%s_dep' % record['record_view_dependency'])
+      record_dict['record_zone_name'] = record['record_zone_name']
+      record_dict['record_last_user'] = record['record_last_user']
+      delete_record_dicts.append(record_dict)
+    delete_record_ids = [record_dict['records_id'] for record_dict in
+                         delete_record_dicts]
+    current_records = {}
+    delete_record_args_dicts = {}
+    if( delete_record_ids ):
+      for row in self.db_instance.ListRowsById('records', delete_record_ids,
+                                               lock_rows=True):
+        current_records[row['records_id']] = row
+      for row in self.db_instance.ListRowsById('flat_records',
+                                               delete_record_ids):
+        delete_record_args_dicts[row['flat_records_record_id']] = (
+            helpers_lib.GetRecordArgsFromFlatRecordRow(row))
+
+    # AUTHORIZE RECORDS
+    records_data = []
+    for record_dict in delete_record_dicts:
+      records_data.append({
+          'target': record_dict['record_target'],
+          'zone_name': record_dict['record_zone_name'],
+          'view_name': record_dict['record_view_dependency'],
+          'record_type': record_dict['record_type'],
+          'record_args_dict': delete_record_args_dicts.get(
+              record_dict['records_id'], {})})
+    add_view_names = []
+    for record in add_records:
+
+      #Target length check
+      if( not self.db_instance.data_validation_instance.isTarget(
+          record[u'record_target']) ):
+        raise errors.InvalidInputError('Target hostname is invalid. %s' % (
+            record[u'record_target']))
+
+      view_name = record['record_view_dependency']
+      if( not record['record_view_dependency'].endswith('_dep') and record[
+            'record_view_dependency'] != u'any'):
+        view_name = '%s_dep' % record['record_view_dependency']
+      add_view_names.append(view_name)
+      records_data.append({
+          'target': record['record_target'],
+          'zone_name': record['record_zone_name'],
+          'view_name': view_name,
+          'record_type': record['record_type'],
+          'record_args_dict': record['record_arguments']})
+    self.user_instance.AuthorizeRecords(method, records_data,
+                                        current_transaction=True)
+
+    # REMOVE RECORDS
+    for record, record_dict in zip(delete_records, delete_record_dicts):
+      # Popped so that a record listed twice is not found the second time.
+      current_record = current_records.pop(record_dict['records_id'],
+                                           None)
+      if( current_record is None ):
+        raise errors.RecordsBatchError(
+              'No record found for :%s' % record_dict)
+      for key, value in record_dict.iteritems():
+        if( current_record[key] != value ):
+          raise errors.RecordsBatchError(
+                'No record found for :%s' % record_dict)
+      log_dict['delete'].append(record)
+      row_count += 1
+    if( delete_record_ids ):
+      self.db_instance.RemoveRowsById('records', delete_record_ids)
+
+    # CHECK CONFLICTS
+    new_records = []
+    for record, view_name in zip(add_records, add_view_names):
+      if( record['record_type'] == u'ptr' ):
+        if( record['record_arguments'][
+            'assignment_host'].startswith('@.') ):
+          record['record_arguments']['assignment_host'] = record[
+              'record_arguments']['assignment_host'].lstrip('@.')
+      changed_view_dep.append((view_name, record['record_zone_name']))
+      new_records.append({'record_type': record['record_type'],
+                          'record_target': record['record_target'],
+                          'record_zone_name': record['record_zone_name'],
+                          'record_view_dependencies': [view_name],
+                          'record_arguments': record['record_arguments']})
+
+    # Conflicts with existing records are found in one query for the
+    # batch, conflicts between records of the batch are found here. Targets
+    # match regardless of case, as they do in the query.
+    all_conflicts = self.db_instance.ListRecordConflicts(new_records)
+    batch_records = {}
+    for record, new_record, conflicts in zip(add_records, new_records,
+                                             all_conflicts):
+      batch_key = (record['record_target'].lower(), record['record_zone_name'],
+                   new_record['record_view_dependencies'][0])
+      for batch_record in batch_records.get(batch_key, []):
+        if( record['record_type'] == u'cname' or
+            batch_record['record_type'] == u'cname' or
+            (batch_record['record_type'] == record['record_type'] and
+             helpers_lib.RecordArgsMatch(batch_record['record_arguments'],
+                                         record['record_arguments'])) ):
+          conflicts.append({'records_id': None,
+                            'record_type': batch_record['record_type'],
+                            'record_view_dependency': batch_key[2]})
+      if( conflicts ):
+        if( record['record_type'] == u'cname' ):
+          raise errors.RecordsBatchError(
+              'Record already exists with target %s.' % (
+              record['record_target']))
+        for conflict in conflicts:
+          if( conflict['record_type'] == u'cname' ):
+            raise errors.RecordsBatchError(
+                'CNAME already exists with target %s.' % (
+                record['record_target']))
+        raise errors.RecordsBatchError('Duplicate record found: %s' %
+                                       conflicts[0])
+      batch_records.setdefault(batch_key, []).append(new_record)
+
+    # ADD RECORDS
+    records_dicts = []
+    for record, view_name in zip(add_records, add_view_names):
+      ttl = None
+      if( 'ttl' in record ):
+        ttl = record['ttl']
+      if( ttl is None ):
+        ttl = constants.DEFAULT_TTL
+      records_dicts.append(
+          {'records_id': None,
+           'record_target': record['record_target'],
+           'record_type': record['record_type'],
+           'record_ttl': ttl,
+           'record_zone_name': record['record_zone_name'],
+           'record_view_dependency': view_name,
+           'record_last_user': self.user_instance.GetUserName()})
+    added_record_ids = self.db_instance.MakeRows('records', records_dicts)
+
+    record_argument_assignments_dicts = []
+    ip_index_records = []
+    for record, records_dict, record_id in zip(add_records, records_dicts,
+                                               added_record_ids):
+      for arg in record['record_arguments'].keys():
+        record_argument_assignments_dicts.append({
+           'record_arguments_records_assignments_record_id': record_id,
+           'record_arguments_records_assignments_type': record[
+               'record_type'],
+           'record_arguments_records_assignments_argument_name': arg,
+           'argument_value': unicode(record['record_arguments'][arg])})
+        log_dict['add'].append(record)
+        row_count += 1
+      if( records_dict['record_type'] in
+          constants.RECORD_TYPES_INDEXED_BY_IP ):
+        ip_index_records.append((
+            records_dict['record_type'], records_dict['record_zone_name'],
+            records_dict['record_view_dependency'], record_id,
+            records_dict['record_target'], record['record_arguments']))
+    self.db_instance.MakeRows('record_arguments_records_assignments',
+                              record_argument_assignments_dicts)
+    self.core_instance._AddRecordsToIpIndex(ip_index_records)
+    self.db_instance.RefreshFlatRecords(added_record_ids)
+    for view_dep_pair in set(changed_view_dep):
+      self.core_instance._IncrementSoa(*view_dep_pair, missing_ok=zone_import)
+
+    return row_count
+
   def ListSortedHostsByZone(self, zone_name, view_name=None):
     records_dict = self.ListRecordsByZone(zone_name, view_name=view_name)
     sorted_records = self.SortRecordsByHost(records_dict)
@@ -1295,11 +1435,10 @@ class CoreHelpers(object):
   def ListSortedHostsByCIDR(self, cidr, zone_name=None, view_name=None):
     records_dict = self.ListRecordsByCIDRBlock(cidr, zone_name=zone_name, 
       view_name=view_name)
-    ip_address_list = self.CIDRExpand(cidr)
+    ip_address_list = helpers_lib.CIDRExpand(cidr)
     
-    if ip_address_list is None:
+    if( not ip_address_list ):
       ip_address_list = []
-    if( ip_address_list == [] ):
       for view in records_dict:
         ip_address_list.extend(records_dict[view].keys())
       ip_address_list = list(set(ip_address_list))
@@ -69,10 +69,15 @@ __license__ = 'BSD'
 __version__ = '#TRUNK#'
 
 
-import Queue
+import atexit
+import copy
+import cPickle
+import datetime
+import os
+import re
+import sys
 import threading
 import time
-import uuid
 import warnings
 
 import MySQLdb
@@ -84,6 +89,935 @@ import errors
 import helpers_lib
 import codecs
 
+# Connection pools are shared by every dbAccess instance in the process that
+# connects with the same parameters. Keyed by GetConnectionPoolKey output.
+connection_pools = {}
+connection_pools_lock = threading.Lock()
+
+
+class ConnectionPool(object):
+  """Bounded, thread safe pool of MySQL connections.
+
+  A connection is checked out for the length of one transaction and checked
+  back in when the transaction ends. Connections that have sat idle are
+  tested before being handed out again.
+  """
+  def __init__(self, connect_kwargs, max_size, idle_check_seconds=1):
+    """Instantiates the ConnectionPool class.
+
+    Inputs:
+      connect_kwargs: dictionary of keyword arguments for MySQLdb.connect
+      max_size: integer of the most connections that may be open at once
+      idle_check_seconds: integer of how long a connection may sit idle
+                          before it is health checked on checkout
+    """
+    self.connect_kwargs = connect_kwargs
+    self.max_size = max_size
+    self.idle_check_seconds = idle_check_seconds
+    # List of (connection, checkin_time) tuples, most recently used last.
+    self.idle_connections = []
+    self.open_connections = 0
+    self.condition = threading.Condition(threading.Lock())
+    self.checkouts = 0
+    self.waits = 0
+    self.wait_time_total = 0.0
+    self.wait_time_max = 0.0
+    self.connections_created = 0
+    self.connections_discarded = 0
+    self.health_check_failures = 0
+
+  def CheckOut(self):
+    """Checks a connection out of the pool.
+
+    Blocks until a connection is idle or until there is room in the pool to
+    open a new one.
+
+    Outputs:
+      MySQLdb connection object
+    """
+    start_time = time.time()
+    waited = False
+    connection = None
+    checkin_time = None
+    self.condition.acquire()
+    try:
+      while( True ):
+        if( self.idle_connections ):
+          connection, checkin_time = self.idle_connections.pop()
+          break
+        if( self.open_connections < self.max_size ):
+          self.open_connections += 1
+          break
+        waited = True
+        self.condition.wait()
+      wait_time = time.time() - start_time
+      self.checkouts += 1
+      self.wait_time_total += wait_time
+      if( waited ):
+        self.waits += 1
+      if( wait_time > self.wait_time_max ):
+        self.wait_time_max = wait_time
+    finally:
+      self.condition.release()
+
+    if( connection is not None and
+        time.time() - checkin_time >= self.idle_check_seconds ):
+      if( not self.IsHealthy(connection) ):
+        self.condition.acquire()
+        self.health_check_failures += 1
+        self.connections_discarded += 1
+        self.condition.release()
+        self.CloseConnection(connection)
+        connection = None
+
+    if( connection is None ):
+      try:
+        connection = MySQLdb.connect(**self.connect_kwargs)
+      except:
+        # Give the slot back so waiters are not starved by a failed connect.
+        self.condition.acquire()
+        self.open_connections -= 1
+        self.condition.notify()
+        self.condition.release()
+        raise
+      self.condition.acquire()
+      self.connections_created += 1
+      self.condition.release()
+    return connection
+
+  def CheckIn(self, connection, discard=False):
+    """Returns a connection to the pool.
+
+    Inputs:
+      connection: MySQLdb connection object from CheckOut
+      discard: boolean of if the connection should be closed rather than
+               reused, for connections in an unknown state
+    """
+    if( discard ):
+      self.CloseConnection(connection)
+    self.condition.acquire()
+    try:
+      if( discard ):
+        self.open_connections -= 1
+        self.connections_discarded += 1
+      else:
+        self.idle_connections.append((connection, time.time()))
+      self.condition.notify()
+    finally:
+      self.condition.release()
+
+  def CloseIdle(self):
+    """Closes every idle connection in the pool.
+
+    Connections that are checked out are not touched, new connections will
+    be opened as they are needed.
+    """
+    self.condition.acquire()
+    try:
+      idle_connections = self.idle_connections
+      self.idle_connections = []
+      self.open_connections -= len(idle_connections)
+      self.condition.notifyAll()
+    finally:
+      self.condition.release()
+    for connection, checkin_time in idle_connections:
+      self.CloseConnection(connection)
+
+  def IsHealthy(self, connection):
+    """Tests a connection with a NOOP.
+
+    Inputs:
+      connection: MySQLdb connection object
+
+    Outputs:
+      bool: if the connection is usable
+    """
+    try:
+      cursor = connection.cursor()
+      try:
+        cursor.execute('DO 0')
+      finally:
+        cursor.close()
+    except (MySQLdb.OperationalError, MySQLdb.InterfaceError):
+      return False
+    return True
+
+  def CloseConnection(self, connection):
+    """Closes a connection, ignoring errors from already dead connections.
+
+    Inputs:
+      connection: MySQLdb connection object
+    """
+    try:
+      connection.close()
+    except (MySQLdb.OperationalError, MySQLdb.InterfaceError,
+            MySQLdb.ProgrammingError):
+      pass
+
+  def GetMetrics(self):
+    """Gets usage metrics of the pool.
+
+    Outputs:
+      dict: dictionary of metrics
+        example: {'max_size': 10, 'open_connections': 3,
+                  'idle_connections': 2, 'in_use': 1, 'checkouts': 500,
+                  'waits': 4, 'wait_time_total': 0.21,
+                  'wait_time_max': 0.08, 'wait_time_average': 0.00042,
+                  'connections_created': 3, 'connections_discarded': 0,
+                  'health_check_failures': 0}
+    """
+    self.condition.acquire()
+    try:
+      metrics = {'max_size': self.max_size,
+                 'open_connections': self.open_connections,
+                 'idle_connections': len(self.idle_connections),
+                 'in_use': self.open_connections - len(self.idle_connections),
+                 'checkouts': self.checkouts,
+                 'waits': self.waits,
+                 'wait_time_total': self.wait_time_total,
+                 'wait_time_max': self.wait_time_max,
+                 'wait_time_average': 0.0,
+                 'connections_created': self.connections_created,
+                 'connections_discarded': self.connections_discarded,
+                 'health_check_failures': self.health_check_failures}
+    finally:
+      self.condition.release()
+    if( metrics['checkouts'] ):
+      metrics['wait_time_average'] = (
+          metrics['wait_time_total'] / metrics['checkouts'])
+    return metrics
+
+
+def GetConnectionPool(connect_kwargs, max_size):
+  """Gets the process wide connection pool for a set of connection arguments,
+  creating it if it does not exist.
+
+  Inputs:
+    connect_kwargs: dictionary of keyword arguments for MySQLdb.connect
+    max_size: integer of the most connections that may be open at once
+
+  Outputs:
+    ConnectionPool instance
+  """
+  pool_key = []
+  for key, value in sorted(connect_kwargs.iteritems()):
+    if( isinstance(value, dict) ):
+      value = tuple(sorted(value.iteritems()))
+    pool_key.append((key, value))
+  pool_key = tuple(pool_key)
+
+  connection_pools_lock.acquire()
+  try:
+    if( pool_key not in connection_pools ):
+      connection_pools[pool_key] = ConnectionPool(connect_kwargs, max_size)
+    connection_pool = connection_pools[pool_key]
+  finally:
+    connection_pools_lock.release()
+  if( connection_pool.max_size != max_size ):
+    connection_pool.condition.acquire()
+    connection_pool.max_size = max_size
+    connection_pool.condition.notifyAll()
+    connection_pool.condition.release()
+  return connection_pool
+
+
+class StatementCache(object):
+  """Thread safe cache of generated SQL statements with hit and build time
+  counters."""
+  def __init__(self):
+    """Instantiates the StatementCache class."""
+    self.statements = {}
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.build_time_total = 0.0
+
+  def Get(self, key):
+    """Gets a cached statement and counts the hit or miss.
+
+    Inputs:
+      key: hashable signature of the statement
+
+    Outputs:
+      cached statement or None if it is not cached
+    """
+    self.lock.acquire()
+    try:
+      statement = self.statements.get(key)
+      if( statement is None ):
+        self.misses += 1
+      else:
+        self.hits += 1
+    finally:
+      self.lock.release()
+    return statement
+
+  def Set(self, key, statement, build_time):
+    """Caches a statement.
+
+    Inputs:
+      key: hashable signature of the statement
+      statement: statement to cache
+      build_time: float of seconds it took to build the statement
+    """
+    self.lock.acquire()
+    try:
+      self.statements[key] = statement
+      self.build_time_total += build_time
+    finally:
+      self.lock.release()
+
+  def Clear(self):
+    """Empties the cache and resets the counters."""
+    self.lock.acquire()
+    try:
+      self.statements = {}
+      self.hits = 0
+      self.misses = 0
+      self.build_time_total = 0.0
+    finally:
+      self.lock.release()
+
+  def GetMetrics(self):
+    """Gets usage metrics of the cache.
+
+    Outputs:
+      dict: dictionary of metrics
+        example: {'statements': 12, 'hits': 4000, 'misses': 12,
+                  'build_time_total': 0.031,
+                  'build_time_average': 0.0026}
+    """
+    self.lock.acquire()
+    try:
+      metrics = {'statements': len(self.statements),
+                 'hits': self.hits,
+                 'misses': self.misses,
+                 'build_time_total': self.build_time_total,
+                 'build_time_average': 0.0}
+    finally:
+      self.lock.release()
+    if( metrics['misses'] ):
+      metrics['build_time_average'] = (
+          metrics['build_time_total'] / metrics['misses'])
+    return metrics
+
+
+# Statements generated by dbAccess.ListRow, shared by every instance.
+list_row_statement_cache = StatementCache()
+
+
+class QueryLog(object):
+  """Buffered log of the statements run by dbAccess.
+
+  Entries are kept in memory and written out by a background thread every
+  flush_interval seconds, or as soon as max_buffered entries are waiting.
+  Formatting and file writes are done by that thread rather than by the
+  thread running the query.
+
+  Each entry is written as one tab separated line of time started, seconds
+  taken, rows returned or affected, caller, statement with its placeholders
+  and the parameters. EXPLAIN rows of slow statements follow on lines
+  starting with EXPLAIN.
+  """
+  def __init__(self, log_file_name=None, flush_interval=1, max_buffered=1000):
+    """Instantiates the QueryLog class.
+
+    Inputs:
+      log_file_name: string of file to append to, stdout is used if empty
+      flush_interval: number of seconds between writes
+      max_buffered: int of entries that will make the log write early
+    """
+    self.log_file_name = log_file_name
+    self.flush_interval = flush_interval
+    self.max_buffered = max_buffered
+    self.entries = []
+    self.condition = threading.Condition()
+    self.write_lock = threading.Lock()
+    self.flush_thread = None
+
+  def Log(self, start_time, elapsed, row_count, caller, statement, values,
+          explain_rows=None):
+    """Buffers a log entry.
+
+    Inputs:
+      start_time: float of when the statement was started
+      elapsed: float of seconds the statement took
+      row_count: int of rows returned or affected
+      caller: string of the function that ran the statement
+      statement: string of statement with placeholders
+      values: parameters of the statement
+      explain_rows: list of EXPLAIN output rows for slow statements
+    """
+    self.condition.acquire()
+    try:
+      self.entries.append((start_time, elapsed, row_count, caller, statement,
+                           values, explain_rows))
+      if( self.flush_thread is None ):
+        self.flush_thread = threading.Thread(target=self.FlushLoop)
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+      if( len(self.entries) >= self.max_buffered ):
+        self.condition.notify()
+    finally:
+      self.condition.release()
+
+  def FlushLoop(self):
+    """Writes out buffered entries until the process exits."""
+    while( True ):
+      self.condition.acquire()
+      try:
+        if( len(self.entries) < self.max_buffered ):
+          self.condition.wait(self.flush_interval)
+      finally:
+        self.condition.release()
+      self.Flush()
+
+  def Flush(self):
+    """Writes out every buffered entry."""
+    self.write_lock.acquire()
+    try:
+      self.condition.acquire()
+      try:
+        entries = self.entries
+        self.entries = []
+      finally:
+        self.condition.release()
+      if( not entries ):
+        return
+      lines = []
+      for (start_time, elapsed, row_count, caller, statement, values,
+           explain_rows) in entries:
+        lines.append(u'%s\t%.6f\t%s\t%s\t%s\t%r\n' % (
+            datetime.datetime.fromtimestamp(start_time).strftime(
+                '%Y-%m-%d %H:%M:%S.%f'),
+            elapsed, row_count, caller, statement, values))
+        for explain_row in explain_rows or []:
+          lines.append(u'EXPLAIN\t%r\n' % explain_row)
+      if( self.log_file_name ):
+        #If the statement contains a unicode character we must account
+        #for it. So we need to use the codecs package to write to a utf-8 log
+        #file, instead of ASCII like the 'normal' open() results in.
+        log_handle = codecs.open(self.log_file_name, encoding='utf-8',
+                                 mode='a')
+        try:
+          log_handle.write(u''.join(lines))
+        finally:
+          log_handle.close()
+      else:
+        sys.stdout.write(u''.join(lines).encode('utf-8'))
+    finally:
+      self.write_lock.release()
+
+
+# Query logs are shared by every dbAccess instance logging to the same file.
+query_logs = {}
+query_logs_lock = threading.Lock()
+
+
+def GetQueryLog(log_file_name):
+  """Gets the process wide query log for a file, creating it if needed.
+
+  Inputs:
+    log_file_name: string of file to append to, stdout is used if empty
+
+  Outputs:
+    QueryLog instance
+  """
+  query_log = query_logs.get(log_file_name)
+  if( query_log is None ):
+    query_logs_lock.acquire()
+    try:
+      query_log = query_logs.get(log_file_name)
+      if( query_log is None ):
+        query_log = QueryLog(log_file_name)
+        query_logs[log_file_name] = query_log
+    finally:
+      query_logs_lock.release()
+  return query_log
+
+
+def FlushQueryLogs():
+  """Writes out every query log, run when the process exits."""
+  for query_log in query_logs.values():
+    query_log.Flush()
+
+atexit.register(FlushQueryLogs)
+
+
+def GetQueryCaller():
+  """Gets the first function outside of this module on the stack.
+
+  Outputs:
+    string: file name, line number and function name
+      example: 'core.py:2734:MakeRecord'
+  """
+  this_file = sys._getframe(0).f_code.co_filename
+  frame = sys._getframe(1)
+  while( frame.f_back is not None and
+         frame.f_code.co_filename == this_file ):
+    frame = frame.f_back
+  return '%s:%s:%s' % (os.path.basename(frame.f_code.co_filename),
+                       frame.f_lineno, frame.f_code.co_name)
+
+
+FOREIGN_KEY_REGEX = re.compile(
+    r'FOREIGN\s+KEY\s*\(([^)]*)\)\s*REFERENCES\s*`?(\w+)`?\s*\(([^)]*)\)',
+    re.IGNORECASE)
+
+
+def ParseForeignKeys(schema):
+  """Reads foreign keys out of a schema of CREATE TABLE statements.
+
+  Inputs:
+    schema: string of sql schema
+
+  Outputs:
+    list: list of dicts, one per column pair, in the same form as
+          information_schema.key_column_usage rows
+      example: [{'table_name': u'credentials',
+                 'column_name': u'credential_user_name',
+                 'referenced_table_name': u'users',
+                 'referenced_column_name': u'user_name'}]
+  """
+  foreign_keys = []
+  schema_lines = [line for line in schema.split('\n') if
+                  not line.lstrip().startswith('#')]
+  for statement in '\n'.join(schema_lines).split(';'):
+    table_match = re.search(r'CREATE\s+TABLE\s+`?(\w+)`?', statement,
+                            re.IGNORECASE)
+    if( not table_match ):
+      continue
+    table_name = table_match.group(1)
+    for columns, referenced_table_name, referenced_columns in (
+        FOREIGN_KEY_REGEX.findall(statement)):
+      columns = [column.strip().strip('`') for column in columns.split(',')]
+      referenced_columns = [column.strip().strip('`') for column in
+                            referenced_columns.split(',')]
+      for column_name, referenced_column_name in zip(columns,
+                                                     referenced_columns):
+        foreign_keys.append({'table_name': table_name,
+                             'column_name': column_name,
+                             'referenced_table_name': referenced_table_name,
+                             'referenced_column_name': referenced_column_name})
+  return foreign_keys
+
+
+class ForeignKeyGraph(object):
+  """Foreign keys of the schema with memoized join predicates for every
+  combination of tables that is asked for."""
+  def __init__(self, foreign_keys):
+    """Instantiates the ForeignKeyGraph class.
+
+    Inputs:
+      foreign_keys: list of foreign key dicts, see ParseForeignKeys
+    """
+    self.foreign_keys = foreign_keys
+    self.join_predicates = {}
+    self.lock = threading.Lock()
+
+  def GetJoinPredicates(self, table_names):
+    """Gets the join predicates between a set of tables.
+
+    Inputs:
+      table_names: list of table names
+
+    Outputs:
+      list: list of join predicate strings, empty if no joins were found
+        example: ['(credentials.credential_user_name=users.user_name)']
+    """
+    tables_key = frozenset(table_names)
+    join_predicates = self.join_predicates.get(tables_key)
+    if( join_predicates is None ):
+      join_predicates = []
+      for key in self.foreign_keys:
+        if( key['table_name'] in tables_key and
+            key['referenced_table_name'] in tables_key ):
+          join_predicates.append('(%(table_name)s.%(column_name)s='
+                                 '%(referenced_table_name)s.'
+                                 '%(referenced_column_name)s)' % key)
+      self.lock.acquire()
+      try:
+        self.join_predicates[tables_key] = join_predicates
+      finally:
+        self.lock.release()
+    return join_predicates
+
+
+foreign_key_graph = None
+foreign_key_graph_lock = threading.Lock()
+
+
+def GetForeignKeyGraph():
+  """Gets the process wide foreign key graph, building it from
+  embedded_files.SCHEMA_FILE the first time it is needed.
+
+  Outputs:
+    ForeignKeyGraph instance
+  """
+  global foreign_key_graph
+  if( foreign_key_graph is None ):
+    foreign_key_graph_lock.acquire()
+    try:
+      if( foreign_key_graph is None ):
+        foreign_key_graph = ForeignKeyGraph(
+            ParseForeignKeys(embedded_files.SCHEMA_FILE))
+    finally:
+      foreign_key_graph_lock.release()
+  return foreign_key_graph
+
+
+PRIMARY_KEY_REGEX = re.compile(r'PRIMARY\s+KEY\s*\(\s*`?(\w+)`?\s*\)',
+                               re.IGNORECASE)
+
+
+def ParsePrimaryKeys(schema):
+  """Reads single column primary keys out of a schema of CREATE TABLE
+  statements.
+
+  Inputs:
+    schema: string of sql schema
+
+  Outputs:
+    dict: dictionary of primary key column names keyed by table name
+      example: {u'credentials': u'credential_id'}
+  """
+  primary_keys = {}
+  schema_lines = [line for line in schema.split('\n') if
+                  not line.lstrip().startswith('#')]
+  for statement in '\n'.join(schema_lines).split(';'):
+    table_match = re.search(r'CREATE\s+TABLE\s+`?(\w+)`?', statement,
+                            re.IGNORECASE)
+    if( not table_match ):
+      continue
+    primary_key_match = PRIMARY_KEY_REGEX.search(statement)
+    if( primary_key_match ):
+      primary_keys[table_match.group(1)] = primary_key_match.group(1)
+  return primary_keys
+
+
+primary_keys = None
+primary_keys_lock = threading.Lock()
+
+
+def GetPrimaryKeys():
+  """Gets the process wide primary key map, building it from
+  embedded_files.SCHEMA_FILE the first time it is needed.
+
+  Outputs:
+    dict: see ParsePrimaryKeys
+  """
+  global primary_keys
+  if( primary_keys is None ):
+    primary_keys_lock.acquire()
+    try:
+      if( primary_keys is None ):
+        primary_keys = ParsePrimaryKeys(embedded_files.SCHEMA_FILE)
+    finally:
+      primary_keys_lock.release()
+  return primary_keys
+
+
+class ViewDependencyGraph(object):
+  """Process wide copy of view_dependency_assignments so the views a view
+  dependency is included in can be resolved without querying.
+
+  The graph is kept with the config generation it was read at, so a change
+  committed by any process, including a restore or a replayed audit log,
+  is seen once the generation has moved on.
+  """
+  def __init__(self):
+    """Instantiates the ViewDependencyGraph class."""
+    self.views_by_dependency = None
+    self.dependencies_by_view = None
+    self.config_generation = None
+    self.lock = threading.Lock()
+
+  def Load(self, view_dependency_assignments, config_generation):
+    """Builds the graph from view_dependency_assignments rows.
+
+    Inputs:
+      view_dependency_assignments: list of view_dependency_assignments
+                                   row dicts
+      config_generation: int of the config generation the rows were read
+                         at, None if the graph should not be kept
+
+    Outputs:
+      tuple: (views_by_dependency, dependencies_by_view) dicts of sets
+    """
+    views_by_dependency = {}
+    dependencies_by_view = {}
+    for assignment in view_dependency_assignments:
+      view_name = assignment['view_dependency_assignments_view_name']
+      view_dependency = assignment[
+          'view_dependency_assignments_view_dependency']
+      views_by_dependency.setdefault(view_dependency, set()).add(view_name)
+      dependencies_by_view.setdefault(view_name, set()).add(view_dependency)
+    if( config_generation is not None ):
+      self.lock.acquire()
+      try:
+        self.views_by_dependency = views_by_dependency
+        self.dependencies_by_view = dependencies_by_view
+        self.config_generation = config_generation
+      finally:
+        self.lock.release()
+    return views_by_dependency, dependencies_by_view
+
+  def Get(self, config_generation):
+    """Gets the graph if it was read at a config generation.
+
+    Inputs:
+      config_generation: int of config generation
+
+    Outputs:
+      tuple: (views_by_dependency, dependencies_by_view) dicts of sets or
+             None if the graph is not loaded
+    """
+    self.lock.acquire()
+    try:
+      if( self.views_by_dependency is None or
+          self.config_generation != config_generation ):
+        return None
+      return self.views_by_dependency, self.dependencies_by_view
+    finally:
+      self.lock.release()
+
+  def Invalidate(self):
+    """Drops the graph so it is read out of the database again."""
+    self.lock.acquire()
+    try:
+      self.views_by_dependency = None
+      self.dependencies_by_view = None
+      self.config_generation = None
+    finally:
+      self.lock.release()
+
+
+# Shared by every dbAccess instance, see dbAccess.GetViewDependencyClosure.
+view_dependency_graph = ViewDependencyGraph()
+
+
+class ConfigSnapshot(object):
+  """Zone origins, user permissions and the maintenance flag as of one
+  config generation.
+
+  A snapshot is not changed once it is made, other than the permissions of
+  a user being kept the first time they are read.
+  """
+  def __init__(self, generation, maintenance_flag, zone_view_assignments):
+    """Instantiates the ConfigSnapshot class.
+
+    Inputs:
+      generation: int of config generation the snapshot was read at
+      maintenance_flag: bool of maintenance mode
+      zone_view_assignments: list of zone_view_assignments row dicts
+    """
+    self.generation = generation
+    self.maintenance_flag = maintenance_flag
+    self.zone_view_assignments = zone_view_assignments
+    self.user_authorization_info = {}
+    self.lock = threading.Lock()
+
+  def GetZoneOrigins(self, zone_name, view_name):
+    """Returns zone origins of zone_name, see dbAccess.GetZoneOrigins.
+
+    Inputs:
+      zone_name: string of zone_name or None
+      view_name: string of view_name or None
+
+    Outputs:
+      a dictionary keyed by zone name with values of lists of origins or
+      None if no zone origins are found
+    """
+    origins = {}
+    for row in self.zone_view_assignments:
+      if( zone_name is not None and
+          row['zone_view_assignments_zone_name'] != zone_name ):
+        continue
+      if( view_name is not None and
+          row['zone_view_assignments_view_dependency'] != view_name ):
+        continue
+      zone_origins = origins.setdefault(row['zone_view_assignments_zone_name'],
+                                        [])
+      if( row['zone_origin'] not in zone_origins ):
+        zone_origins.append(row['zone_origin'])
+    if( not origins ):
+      return None
+    return origins
+
+  def GetUserAuthorizationInfo(self, user_name):
+    """Gets the permissions of a user if they have been kept.
+
+    Inputs:
+      user_name: string of user name
+
+    Outputs:
+      dict: copy of dbAccess.GetUserAuthorizationInfo output or None
+    """
+    self.lock.acquire()
+    try:
+      if( user_name not in self.user_authorization_info ):
+        return None
+      return copy.deepcopy(self.user_authorization_info[user_name])
+    finally:
+      self.lock.release()
+
+  def SetUserAuthorizationInfo(self, user_name, user_authorization_info):
+    """Keeps the permissions of a user.
+
+    Inputs:
+      user_name: string of user name
+      user_authorization_info: dict of dbAccess.GetUserAuthorizationInfo
+                               output
+    """
+    self.lock.acquire()
+    try:
+      self.user_authorization_info[user_name] = copy.deepcopy(
+          user_authorization_info)
+    finally:
+      self.lock.release()
+
+
+class ConfigSnapshotCache(object):
+  """Holds the last ConfigSnapshot read by this process."""
+  def __init__(self):
+    """Instantiates the ConfigSnapshotCache class."""
+    self.snapshot = None
+    self.lock = threading.Lock()
+
+  def Get(self, generation):
+    """Gets the snapshot if it was read at a generation.
+
+    Inputs:
+      generation: int of config generation
+
+    Outputs:
+      ConfigSnapshot: snapshot or None
+    """
+    self.lock.acquire()
+    try:
+      if( self.snapshot is not None and
+          self.snapshot.generation == generation ):
+        return self.snapshot
+      return None
+    finally:
+      self.lock.release()
+
+  def Set(self, snapshot):
+    """Replaces the snapshot.
+
+    Inputs:
+      snapshot: ConfigSnapshot
+    """
+    self.lock.acquire()
+    try:
+      self.snapshot = snapshot
+    finally:
+      self.lock.release()
+
+  def Invalidate(self):
+    """Drops the snapshot so it is read out of the database again."""
+    self.Set(None)
+
+
+# Shared by every dbAccess instance, see dbAccess.GetConfigSnapshot.
+config_snapshot_cache = ConfigSnapshotCache()
+
+
+class LastExportCache(object):
+  """Holds the id of the newest successful ExportAllBindTrees audit log row
+  found by this process."""
+  def __init__(self):
+    """Instantiates the LastExportCache class."""
+    self.audit_log_id = None
+    self.snapshot_audit_log_id = None
+    self.lock = threading.Lock()
+
+  def Get(self):
+    """Gets the cached audit log id.
+
+    Outputs:
+      int: audit_log_id or None
+    """
+    self.lock.acquire()
+    try:
+      return self.audit_log_id
+    finally:
+      self.lock.release()
+
+  def Set(self, audit_log_id):
+    """Caches an audit log id if it is newer than the cached one.
+
+    Inputs:
+      audit_log_id: int of audit_log_id
+    """
+    self.lock.acquire()
+    try:
+      if( self.audit_log_id is None or audit_log_id > self.audit_log_id ):
+        self.audit_log_id = audit_log_id
+        self.snapshot_audit_log_id = None
+    finally:
+      self.lock.release()
+
+  def GetSnapshot(self, audit_log_id):
+    """Gets the cached snapshot audit log id of an export.
+
+    Inputs:
+      audit_log_id: int of audit_log_id of export
+
+    Outputs:
+      int: snapshot audit_log_id or None
+    """
+    self.lock.acquire()
+    try:
+      if( self.audit_log_id == audit_log_id ):
+        return self.snapshot_audit_log_id
+      return None
+    finally:
+      self.lock.release()
+
+  def SetSnapshot(self, audit_log_id, snapshot_audit_log_id):
+    """Caches the snapshot audit log id of the cached export.
+
+    Inputs:
+      audit_log_id: int of audit_log_id of export
+      snapshot_audit_log_id: int of snapshot audit_log_id of export
+    """
+    self.lock.acquire()
+    try:
+      if( self.audit_log_id == audit_log_id ):
+        self.snapshot_audit_log_id = snapshot_audit_log_id
+    finally:
+      self.lock.release()
+
+  def Invalidate(self):
+    """Drops the audit log id so it is looked up again."""
+    self.lock.acquire()
+    try:
+      self.audit_log_id = None
+      self.snapshot_audit_log_id = None
+    finally:
+      self.lock.release()
+
+
+# Shared by every dbAccess instance, see dbAccess.GetLastExportAuditLogId.
+last_export_cache = LastExportCache()
+
+
+class TransactionState(threading.local):
+  """Holds the connection and cursor of the transaction that is open in the
+  current thread."""
+  def __init__(self):
+    self.connection = None
+    self.cursor = None
+    self.transaction_init = False
+    self.locked_db = False
+    self.streaming_cursors = []
+    self.soa_increments = {}
+    self.config_changed = False
+    self.rows_changed = False
+    self.tables_changed = False
+
+
 class dbAccess(object):
   """This class provides the primary interface for connecting and interacting
    with the roster database.
@@ -92,7 +1026,8 @@ class dbAccess(object):
   def __init__(self, db_host, db_user, db_passwd, db_name, big_lock_timeout,
                big_lock_wait, thread_safe=True, ssl=False, ssl_ca=None,
                ssl_cert=None, ssl_key=None, ssl_capath=None, ssl_cipher=None,
-               db_debug=False, db_debug_log=None):
+               db_debug=False, db_debug_log=None, connection_pool_size=10,
+               db_slow_query_seconds=0):
     """Instantiates the db_access class.
 
     Inputs:
@@ -100,10 +1035,19 @@ class dbAccess(object):
       db_user: string of the user name used to connect to mysql
       db_passwd: string of password used to connect to mysql
       db_name: string of name of database in mysql server to use
-      big_lock_timeout: integer of how long the big lock should be valid for
-      big_lock_wait: integer of how long to wait for proccesses to finish
-                     before locking the database
-      thread_safe: boolean of if db_acceess should be thread safe
+      big_lock_timeout: integer of how long to wait for the big lock
+      big_lock_wait: integer, no longer used. Waiting on the big lock is
+                     event driven, this is kept so existing config files
+                     still load.
+      thread_safe: boolean of if db_acceess should be thread safe, each
+                   thread gets its own transaction and pooled connection
+      db_debug: boolean of if every statement should be logged
+      db_debug_log: string of file to log statements to, stdout if empty
+      connection_pool_size: integer of the most connections the process
+                            wide pool may hold open to this database
+      db_slow_query_seconds: float of seconds after which a statement is
+                             logged with its EXPLAIN output even if db_debug
+                             is off, 0 to turn off
     """
     # Do some better checking of these args
     self.db_host = db_host
@@ -112,61 +1056,153 @@ class dbAccess(object):
     self.db_name = db_name
     self.big_lock_timeout = big_lock_timeout
     self.big_lock_wait = big_lock_wait
+    # Named locks are server wide, so the name is scoped to the database.
+    self.big_lock_name = (u'roster_big_lock.%s' % db_name)[:64]
     self.ssl = ssl
     self.ssl_ca = ssl_ca
     self.ssl_settings = {}
     self.db_debug = db_debug
     self.db_debug_log = db_debug_log
+    self.db_slow_query_seconds = db_slow_query_seconds
     if( self.ssl ):
       if( self.ssl_ca ):
         self.ssl_settings['ca'] = ssl_ca
       else:
         raise errors.ConfigError('ssl_ca not specified in config file.')
-    self.transaction_init = False
-    self.connection = None
-    self.cursor = None
-    # This is generated only when ListRow is called and is then cached for
-    # the life of the object.
-    self.foreign_keys = []
+    self.foreign_key_graph = GetForeignKeyGraph()
     self.data_validation_instance = None
-    self.locked_db = False
+    self.auto_increment_settings = None
     self.thread_safe = thread_safe
-    self.queue = Queue.Queue()
-    self.now_serving = None
-    self.queue_update_lock = threading.Lock()
+    self.audit_log_instance = None
+    self.audit_user_name = None
+    self.transaction_state = TransactionState()
+    connect_kwargs = {'host': self.db_host, 'user': self.db_user,
+                      'passwd': self.db_passwd, 'db': self.db_name,
+                      'use_unicode': True, 'charset': 'utf8'}
+    if( self.ssl ):
+      connect_kwargs['ssl'] = self.ssl_settings
+    self.connection_pool = GetConnectionPool(connect_kwargs,
+                                             connection_pool_size)
+
+  @property
+  def connection(self):
+    """MySQLdb connection of the transaction open in this thread."""
+    return self.transaction_state.connection
+
+  @property
+  def cursor(self):
+    """MySQLdb cursor of the transaction open in this thread."""
+    return self.transaction_state.cursor
+
+  @property
+  def transaction_init(self):
+    """Boolean of if a transaction is open in this thread."""
+    return self.transaction_state.transaction_init
+
+  @property
+  def locked_db(self):
+    """Boolean of if this thread holds the database lock."""
+    return self.transaction_state.locked_db
 
   def close(self):
-    """Closes a connection that has been opened. 
+    """Closes idle pooled connections.
 
-    A new connection will be created on StartTransaction.
+    New connections will be created on StartTransaction.
     """
-    if( self.connection is not None ):
-      self.connection.close()
-    self.connection = None
+    self.connection_pool.CloseIdle()
+
+  def GetStatementCacheMetrics(self):
+    """Gets hit and build time metrics of the ListRow statement cache.
+
+    Outputs:
+      dict: dictionary of metrics, see StatementCache.GetMetrics
+    """
+    return list_row_statement_cache.GetMetrics()
+
+  def GetConnectionPoolMetrics(self):
+    """Gets usage and wait time metrics of the connection pool.
+
+    Outputs:
+      dict: dictionary of metrics, see ConnectionPool.GetMetrics
+    """
+    return self.connection_pool.GetMetrics()
 
 
-  def cursor_execute(self, execution_string, values={}):
+  def cursor_execute(self, execution_string, values={}, cursor=None,
+                     many=False):
     """This function allows for the capture of every mysql command that
        is run in this class. 
 
     Inputs:
       execution_string: mysql command string
-      values: dictionary of values for mysql command
+      values: dictionary of values for mysql command, or a list of them if
+              many is set
+      cursor: cursor to run the command on, defaults to the cursor of the
+              open transaction
+      many: boolean of if the command should be run with executemany, which
+            turns an INSERT into a single multi row INSERT
+
+    If db_debug is set every statement is written to the query log, if
+    db_slow_query_seconds is set statements that take longer are written
+    with their EXPLAIN output.
+
+    Raises:
+      TransactionError: Cannot run a query while rows from IterRow are still
+                        being read.
     """
-    if( self.db_debug ):
-      if( self.db_debug_log ):
-        #If the execution_string contains a unicode character we must account
-        #for it. So we need to use the codecs package to write to a utf-8 log
-        #file, instead of ASCII like the 'normal' open() results in.
-        debug_log_handle = codecs.open(self.db_debug_log, encoding='utf-8', 
-            mode='a')
-        debug_log_handle.write(execution_string % values)
-        debug_log_handle.write('\n')
-        debug_log_handle.close()
-      else:
-        print execution_string % values
+    buffered = cursor is None
+    if( buffered ):
+      if( self.transaction_state.streaming_cursors ):
+        raise errors.TransactionError('Cannot run a query while rows from '
+                                      'IterRow are still being read.')
+      cursor = self.cursor
+    if( not self.db_debug and not self.db_slow_query_seconds ):
+      self.RunStatement(cursor, execution_string, values, many)
+      return
+
+    succeeded = False
+    start_time = time.time()
     try:
-      self.cursor.execute(execution_string, values)
+      self.RunStatement(cursor, execution_string, values, many)
+      succeeded = True
+    finally:
+      elapsed = time.time() - start_time
+      slow = bool(self.db_slow_query_seconds and
+                  elapsed >= self.db_slow_query_seconds)
+      if( self.db_debug or slow ):
+        row_count = None
+        explain_rows = None
+        if( succeeded ):
+          row_count = cursor.rowcount
+          # Only buffered results have been read off the connection, a
+          # streaming cursor still has its rows waiting.
+          if( slow and buffered and not many ):
+            explain_rows = self.ExplainStatement(execution_string, values)
+        if( many ):
+          values = list(values)
+        elif( isinstance(values, dict) ):
+          values = dict(values)
+        GetQueryLog(self.db_debug_log).Log(
+            start_time, elapsed, row_count, GetQueryCaller(),
+            execution_string, values, explain_rows)
+
+  def RunStatement(self, cursor, execution_string, values, many):
+    """Runs a statement on a cursor, see cursor_execute.
+
+    Inputs:
+      cursor: cursor to run the statement on
+      execution_string: mysql command string
+      values: dictionary of values, or a list of them if many is set
+      many: boolean of if the statement should be run with executemany
+
+    Raises:
+      DatabaseError: MySQL error that is parsable for the user
+    """
+    try:
+      if( many ):
+        cursor.executemany(execution_string, values)
+      else:
+        cursor.execute(execution_string, values)
     except MySQLdb.ProgrammingError:
       raise
     except MySQLdb.Error, e:
@@ -174,86 +1210,79 @@ class dbAccess(object):
         raise errors.DatabaseError(e)
       else:
         raise
-    
-    
+
+  def ExplainStatement(self, execution_string, values):
+    """Gets the EXPLAIN output of a SELECT statement.
+
+    Inputs:
+      execution_string: mysql command string
+      values: dictionary of values for mysql command
+
+    Outputs:
+      list: list of EXPLAIN row dicts, None if the statement is not a SELECT
+            from a table
+    """
+    upper_statement = execution_string.lstrip().upper()
+    if( not upper_statement.startswith('SELECT') or
+        ' FROM ' not in upper_statement ):
+      return None
+    explain_cursor = self.connection.cursor(MySQLdb.cursors.DictCursor)
+    try:
+      try:
+        explain_cursor.execute('EXPLAIN %s' % execution_string, values)
+        return list(explain_cursor.fetchall())
+      except MySQLdb.Error, e:
+        return [{'error': str(e)}]
+    finally:
+      explain_cursor.close()
+
   def StartTransaction(self):
     """Starts a transaction.
 
-    Also it starts a db connection if none exists or it times out.
-    Always creates a new cursor.
-    
-    This function also serializes all requests on this object and if the 
-    big lock has been activated will wait for it to be released.
+    Checks a connection out of the connection pool for the length of the
+    transaction and creates a new cursor on it. Transactions in other
+    threads run in parallel on their own connections.
+
+    If the big lock is held by an exporter this will block until it is
+    released. The big lock is a MySQL named lock, ordinary transactions only
+    pass through it while an exporter holds it for the whole of LockDb, so
+    waiters wake as soon as UnlockDb is run. After big_lock_timeout seconds
+    the lock is considered stale and the transaction goes ahead.
 
     Raises:
       TransactionError: Cannot start new transaction last transaction not
                         committed or rolled-back.
     """
-    if( self.thread_safe ):
-      unique_id = uuid.uuid4()
-      self.queue.put(unique_id)
-
-      while_sleep = 0
-      while( unique_id != self.now_serving ):
-        time.sleep(while_sleep)
-        self.queue_update_lock.acquire()
-        if( self.now_serving is None ):
-          self.now_serving = self.queue.get()
-        self.queue_update_lock.release()
-        while_sleep = 0.005
+    state = self.transaction_state
+    if( state.transaction_init ):
+      raise errors.TransactionError('Cannot start new transaction last '
+                                    'transaction not committed or '
+                                    'rolled-back.')
 
-    else:
-      if( self.transaction_init ):
-        raise errors.TransactionError('Cannot start new transaction last '
-                                      'transaction not committed or '
-                                      'rolled-back.')
-
-    if( self.connection is not None ):
-      try:
-        self.cursor = self.connection.cursor(MySQLdb.cursors.DictCursor)
-        self.cursor_execute('DO 0') # NOOP to test connection
-      except MySQLdb.OperationalError:
-        self.connection = None
-
-    if( self.connection is None ):
-      if( self.ssl ):
-        self.connection = MySQLdb.connect(
-            host=self.db_host, user=self.db_user, passwd=self.db_passwd,
-            db=self.db_name, use_unicode=True, charset='utf8',
-            ssl=self.ssl_settings)
-      else:
-        self.connection = MySQLdb.connect(
-            host=self.db_host, user=self.db_user, passwd=self.db_passwd,
-            db=self.db_name, use_unicode=True, charset='utf8')
-      self.cursor = self.connection.cursor(MySQLdb.cursors.DictCursor)
-
-    while_sleep = 0
-    db_lock_locked = 1
-    while( db_lock_locked ):
-      time.sleep(while_sleep)
-      try:
-        self.cursor_execute('SELECT `locked`, `lock_last_updated`, '
-                            'NOW() as `now` from `locks` WHERE '
-                            '`lock_name`="db_lock_lock"')
-        rows = self.cursor.fetchall()
-      except MySQLdb.ProgrammingError:
-        break
-      if( not rows ):
-        break
-      lock_last_updated = rows[0]['lock_last_updated']
-      db_lock_locked = rows[0]['locked']
-      now = rows[0]['now']
-      if( (now - lock_last_updated).seconds > self.big_lock_timeout ):
-        break
-      while_sleep = 1
+    state.connection = self.connection_pool.CheckOut()
+    try:
+      state.cursor = state.connection.cursor(MySQLdb.cursors.DictCursor)
+      # Only takes the lock, and releases it right away, when it is not free.
+      self.cursor_execute('SELECT IS_FREE_LOCK(%(lock_name)s) OR '
+                          '(GET_LOCK(%(lock_name)s, %(timeout)s) AND '
+                          'RELEASE_LOCK(%(lock_name)s)) AS `lock_free`',
+                          {'lock_name': self.big_lock_name,
+                           'timeout': self.big_lock_timeout})
+      self.cursor.fetchall()
+    except:
+      connection = state.connection
+      state.connection = None
+      state.cursor = None
+      self.connection_pool.CheckIn(connection, discard=True)
+      raise
 
-    self.transaction_init = True
+    state.transaction_init = True
 
   def EndTransaction(self, rollback=False):
     """Ends a transaction.
 
-    Also does some simple checking to make sure a connection was open first
-    and releases itself from the current queue.
+    Also does some simple checking to make sure a transaction was open first
+    and returns its connection to the connection pool.
 
     Inputs:
       rollback: boolean of if the transaction should be rolled back
@@ -261,25 +1290,166 @@ class dbAccess(object):
     Raises:
       TransactionError: Must run StartTansaction before EndTransaction.
     """
-    if( not self.thread_safe ):
-      if( not self.transaction_init ):
+    state = self.transaction_state
+    if( not state.transaction_init ):
+      if( not self.thread_safe ):
         raise errors.TransactionError('Must run StartTansaction before '
                                       'EndTransaction.')
+      return
 
+    # A connection still holding table locks can not be handed to another
+    # transaction, closing it releases the locks.
+    discard = state.locked_db
+    logged_call = None
+    committed = False
     try:
-      self.cursor.close()
-      if( rollback ):
-        self.connection.rollback()
-      else:
-        self.connection.commit()
+      try:
+        # Closing a server side cursor reads off the rest of its rows.
+        while( state.streaming_cursors ):
+          state.streaming_cursors.pop().close()
+        if( not rollback and (state.soa_increments or state.config_changed or
+                              state.rows_changed) ):
+          try:
+            if( state.rows_changed ):
+              logged_call = self.LogAuditedCall()
+            if( state.soa_increments ):
+              self.IncrementSoaSerials()
+            if( state.config_changed ):
+              self.cursor_execute('UPDATE config_generation SET '
+                                  'config_generation=config_generation+1')
+          except:
+            state.cursor.close()
+            state.connection.rollback()
+            raise
+        state.cursor.close()
+        if( rollback ):
+          state.connection.rollback()
+        else:
+          state.connection.commit()
+          committed = True
+      except (MySQLdb.OperationalError, MySQLdb.InterfaceError):
+        discard = True
+        raise
 
     finally:
-      self.transaction_init = False
-      if( self.thread_safe ):
-        if( not self.queue.empty() ):
-          self.now_serving = self.queue.get()
-        else:
-          self.now_serving = None
+      connection = state.connection
+      state.connection = None
+      state.cursor = None
+      state.transaction_init = False
+      state.locked_db = False
+      state.streaming_cursors = []
+      state.soa_increments = {}
+      state.config_changed = False
+      state.rows_changed = False
+      state.tables_changed = False
+      # The audit log row was rolled back with the changes it logged.
+      if( logged_call is not None and not committed ):
+        logged_call['audit_log_id'] = None
+      self.connection_pool.CheckIn(connection, discard=discard)
+
+  def SetAuditLog(self, audit_log_instance, user_name):
+    """Sets the audit log that the AuditedMethod calls of a user are logged
+    to when their changes are committed, see LogAuditedCall.
+
+    Inputs:
+      audit_log_instance: instance of AuditLog class
+      user_name: string of user name
+    """
+    self.audit_log_instance = audit_log_instance
+    self.audit_user_name = user_name
+
+  def LogAuditedCall(self):
+    """Logs the AuditedMethod call running in this thread in the transaction
+    that commits its changes.
+
+    An audit log row is then in a database snapshot exactly when the changes
+    it logs are, which StartConsistentSnapshot and dnsrecover depend on. The
+    call is logged once, by the first transaction it commits changes in.
+
+    Outputs:
+      dict: dictionary of call logged, None if nothing was logged
+    """
+    if( self.audit_log_instance is None ):
+      return None
+    audited_call = helpers_lib.GetAuditedCall()
+    if( audited_call is None or audited_call['audit_log_id'] is not None ):
+      return None
+    self.audit_log_instance.LogCommittedAction(self.audit_user_name,
+                                               audited_call)
+    return audited_call
+
+  def MarkTableChanged(self, table_name):
+    """Marks the transaction as changing rows of a table.
+
+    Inputs:
+      table_name: string of table name
+    """
+    self.transaction_state.tables_changed = True
+    if( table_name in constants.CONFIG_GENERATION_TABLES ):
+      self.MarkConfigChanged()
+    # The audit log row of the call is written by the commit itself.
+    if( table_name != 'audit_log' ):
+      self.transaction_state.rows_changed = True
+
+  def MarkConfigChanged(self):
+    """Marks the transaction as changing users, permissions, zones, views or
+    locks, so that committing it moves to a new config generation.
+
+    Writes through MakeRow, RemoveRow and the like mark themselves, this is
+    for changes made other ways.
+
+    Raises:
+      TransactionError: Must run StartTansaction before marking.
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before '
+                                    'marking.')
+    self.transaction_state.config_changed = True
+
+  def GetConfigGeneration(self):
+    """Gets the config generation, it goes up by one with every committed
+    transaction marked by MarkConfigChanged.
+
+    Raises:
+      TransactionError: Must run StartTansaction before getting data.
+
+    Outputs:
+      int: config generation
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before getting '
+                                    'data.')
+    self.cursor_execute('SELECT config_generation FROM config_generation')
+    return int(self.cursor.fetchone()['config_generation'])
+
+  def GetConfigSnapshot(self):
+    """Gets zone origins, user permissions and the maintenance flag.
+
+    The snapshot is shared by the process and only read out of the database
+    again when the config generation has changed, so this is usually one
+    small query.
+
+    Raises:
+      TransactionError: Must run StartTansaction before getting data.
+
+    Outputs:
+      ConfigSnapshot: snapshot of the current config generation
+    """
+    generation = self.GetConfigGeneration()
+    # A transaction with config changes of its own reads them, they are not
+    # part of any generation until it is committed.
+    config_changed = self.transaction_state.config_changed
+    if( not config_changed ):
+      snapshot = config_snapshot_cache.Get(generation)
+      if( snapshot is not None ):
+        return snapshot
+    zone_view_assignments = self.ListRow(
+        'zone_view_assignments', self.GetEmptyRowDict('zone_view_assignments'))
+    snapshot = ConfigSnapshot(generation, self.CheckMaintenanceFlag(),
+                              zone_view_assignments)
+    if( not config_changed ):
+      config_snapshot_cache.Set(snapshot)
+    return snapshot
 
   def CheckMaintenanceFlag(self):
     """Checks the maintenance flag in the database.
@@ -294,20 +1464,33 @@ class dbAccess(object):
     """This function is to lock the whole database for consistent data
     retrevial.
 
+    Takes the big lock exclusively, which holds new transactions in
+    StartTransaction, then locks every table. LOCK TABLES itself waits for
+    transactions already writing to finish.
+
     This function expects for self.db_instance.cursor to be instantiated and
     valid.
 
     Raises: 
       TransactionError: Must unlock tables before re-locking them.
+      TransactionError: Could not get the big lock.
     """
     if( self.locked_db is True ):
       raise errors.TransactionError('Must unlock tables before re-locking them')
-    self.cursor_execute('UPDATE `locks` SET `locked`=1 WHERE '
-                        '`lock_name`="db_lock_lock"')
-    time.sleep(self.big_lock_wait)
-    self.cursor_execute(
-        'LOCK TABLES %s READ' % ' READ, '.join(self.ListTableNames()))
-    self.locked_db = True
+    self.cursor_execute('SELECT GET_LOCK(%(lock_name)s, %(timeout)s) AS '
+                        '`acquired`', {'lock_name': self.big_lock_name,
+                                       'timeout': self.big_lock_timeout})
+    if( not self.cursor.fetchone()['acquired'] ):
+      raise errors.TransactionError('Could not get the big lock within %s '
+                                    'seconds.' % self.big_lock_timeout)
+    try:
+      self.cursor_execute(
+          'LOCK TABLES %s READ' % ' READ, '.join(self.ListTableNames()))
+    except:
+      self.cursor_execute('DO RELEASE_LOCK(%(lock_name)s)',
+                          {'lock_name': self.big_lock_name})
+      raise
+    self.transaction_state.locked_db = True
 
   def UnlockDb(self):
     """This function is to unlock the whole database.
@@ -321,44 +1504,245 @@ class dbAccess(object):
     if( self.locked_db is False ):
       raise errors.TransactionError('Must lock tables before unlocking them')
     self.cursor_execute('UNLOCK TABLES')
-    self.cursor_execute('UPDATE `locks` SET `locked`=0 WHERE '
-                        '`lock_name`="db_lock_lock"')
-    self.locked_db = False
+    self.cursor_execute('DO RELEASE_LOCK(%(lock_name)s)',
+                        {'lock_name': self.big_lock_name})
+    self.transaction_state.locked_db = False
+
+  def StartConsistentSnapshot(self):
+    """Restarts the current transaction as a consistent snapshot.
+
+    Every read in the transaction sees the database as it was when this was
+    run, without taking any table locks. This needs the InnoDB REPEATABLE
+    READ isolation level, which is set for the snapshot transaction.
+
+    Audit log rows are committed with the changes they log, see
+    LogAuditedCall, but auto increment ids are handed out before commit, so
+    a row could commit after the snapshot with a lower id than one in it.
+    While the snapshot is started, a locking read on a second connection
+    waits for every audit log row being written after the last export's
+    snapshot and holds back new ones. Only audit log inserts wait, and only
+    for as long as it takes to start the snapshot. The snapshot then holds
+    every audit log row up to the id returned, and none after it.
+
+    The second connection is opened for the locking read and closed after
+    it, it is not taken from the connection pool, so a transaction that
+    already holds the last pooled connection can not wait on itself.
+    Anything read in the transaction before this is dropped, it must not
+    have changed anything.
+
+    Raises:
+      TransactionError: Must run StartTansaction before starting a snapshot.
+      TransactionError: Can not start a snapshot while tables are locked.
+      TransactionError: Can not start a snapshot after changing rows.
+
+    Outputs:
+      int: highest audit_log_id visible in the snapshot, 0 if the audit log
+           is empty
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before starting '
+                                    'a snapshot.')
+    if( self.locked_db ):
+      raise errors.TransactionError('Can not start a snapshot while tables '
+                                    'are locked.')
+    state = self.transaction_state
+    if( state.tables_changed or state.soa_increments or
+        state.config_changed ):
+      raise errors.TransactionError('Can not start a snapshot after changing '
+                                    'rows.')
+    # Every row up to the last export's snapshot was committed before it.
+    checked_audit_log_id = self.GetLastExportSnapshotAuditLogId() or 0
+
+    lock_connection = MySQLdb.connect(**self.connection_pool.connect_kwargs)
+    try:
+      lock_cursor = lock_connection.cursor(MySQLdb.cursors.DictCursor)
+      try:
+        # Next key locks, which hold back inserts after the last row, are
+        # only taken under REPEATABLE READ.
+        self.cursor_execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ',
+                            cursor=lock_cursor)
+        self.cursor_execute('SELECT audit_log_id FROM audit_log WHERE '
+                            'audit_log_id > %(audit_log_id)s FOR UPDATE',
+                            {'audit_log_id': checked_audit_log_id},
+                            cursor=lock_cursor)
+        lock_cursor.fetchall()
+
+        # The isolation level can only be changed between transactions, the
+        # transaction has only read so far.
+        self.connection.rollback()
+        self.cursor_execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        self.cursor_execute('START TRANSACTION WITH CONSISTENT SNAPSHOT')
+        self.cursor_execute('SELECT MAX(audit_log_id) AS `audit_log_id` '
+                            'FROM audit_log')
+        audit_log_id = self.cursor.fetchone()['audit_log_id']
+      finally:
+        lock_cursor.close()
+        lock_connection.rollback()
+    finally:
+      self.connection_pool.CloseConnection(lock_connection)
+    if( audit_log_id is None ):
+      return 0
+    return int(audit_log_id)
+
+  def GetLastExportAuditLogId(self):
+    """Gets the id of the newest successful ExportAllBindTrees audit log row.
+
+    The id is cached by the process and only newer rows are looked up, which
+    is a seek on the (action, success, audit_log_id) index.
+
+    Raises:
+      TransactionError: Must run StartTansaction before getting data.
+
+    Outputs:
+      int: audit_log_id of the last export, None if there has not been one
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before getting '
+                                    'data.')
+    cached_audit_log_id = last_export_cache.Get()
+    self.cursor_execute('SELECT MAX(audit_log_id) AS `audit_log_id` '
+                        'FROM audit_log WHERE action=%(action)s AND '
+                        'success=1 AND audit_log_id > %(audit_log_id)s',
+                        {'action': u'ExportAllBindTrees',
+                         'audit_log_id': cached_audit_log_id or 0})
+    audit_log_id = self.cursor.fetchone()['audit_log_id']
+    if( audit_log_id is None ):
+      return cached_audit_log_id
+    audit_log_id = int(audit_log_id)
+    last_export_cache.Set(audit_log_id)
+    return audit_log_id
+
+  def GetLastExportSnapshotAuditLogId(self):
+    """Gets the highest audit log id in the snapshot of the newest successful
+    ExportAllBindTrees, every audit log row up to it is in the backups of that
+    export. Exports that took table locks instead of a snapshot have every
+    row before them in their backups.
+
+    Raises:
+      TransactionError: Must run StartTansaction before getting data.
+
+    Outputs:
+      int: audit_log_id, None if there has not been an export
+    """
+    export_audit_log_id = self.GetLastExportAuditLogId()
+    if( export_audit_log_id is None ):
+      return None
+    snapshot_audit_log_id = last_export_cache.GetSnapshot(export_audit_log_id)
+    if( snapshot_audit_log_id is not None ):
+      return snapshot_audit_log_id
+
+    snapshot_audit_log_id = export_audit_log_id - 1
+    self.cursor_execute('SELECT data FROM audit_log WHERE '
+                        'audit_log_id=%(audit_log_id)s',
+                        {'audit_log_id': export_audit_log_id})
+    export_row = self.cursor.fetchone()
+    # The cached export may be newer than a snapshot being read.
+    if( export_row is None ):
+      return snapshot_audit_log_id
+    audit_args = cPickle.loads(str(export_row['data']))['audit_args']
+    snapshot_audit_log_id = audit_args.get('snapshot_audit_log_id',
+                                           snapshot_audit_log_id)
+    last_export_cache.SetSnapshot(export_audit_log_id, snapshot_audit_log_id)
+    return snapshot_audit_log_id
+
+  def CheckAuditLogChanges(self, audit_log_id, max_audit_log_id):
+    """Checks for audit log rows of anything but ExportAllBindTrees in a
+    range of audit log ids.
+
+    Inputs:
+      audit_log_id: int of audit_log_id to look after
+      max_audit_log_id: int of highest audit_log_id to look at
+
+    Raises:
+      TransactionError: Must run StartTansaction before getting data.
+
+    Outputs:
+      bool: if there are any changes in the range
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before getting '
+                                    'data.')
+    self.cursor_execute('SELECT audit_log_id FROM audit_log WHERE '
+                        'audit_log_id > %(audit_log_id)s AND '
+                        'audit_log_id <= %(max_audit_log_id)s AND '
+                        'action != %(action)s LIMIT 1',
+                        {'audit_log_id': audit_log_id,
+                         'max_audit_log_id': max_audit_log_id,
+                         'action': u'ExportAllBindTrees'})
+    return bool(self.cursor.fetchall())
+
+  def ListAuditLogRows(self, audit_log_id, max_audit_log_id, limit):
+    """Lists a page of audit log rows in audit_log_id order.
+
+    Inputs:
+      audit_log_id: int of audit_log_id to list after
+      max_audit_log_id: int of highest audit_log_id to list
+      limit: int of most rows to list
+
+    Raises:
+      TransactionError: Must run StartTansaction before getting data.
+
+    Outputs:
+      list: list of audit_log row dicts
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before getting '
+                                    'data.')
+    self.cursor_execute('SELECT %s FROM audit_log WHERE '
+                        'audit_log_id > %%(audit_log_id)s AND '
+                        'audit_log_id <= %%(max_audit_log_id)s '
+                        'ORDER BY audit_log_id LIMIT %%(limit)s' % (
+                            ','.join(constants.TABLES['audit_log'])),
+                        {'audit_log_id': audit_log_id,
+                         'max_audit_log_id': max_audit_log_id,
+                         'limit': int(limit)})
+    return list(self.cursor.fetchall())
+
+  def RemoveAuditLogRows(self, max_audit_log_id, limit):
+    """Removes the lowest audit log rows up to an audit log id.
+
+    Inputs:
+      max_audit_log_id: int of highest audit_log_id to remove
+      limit: int of most rows to remove
+
+    Raises:
+      TransactionError: Must run StartTansaction before deleting.
+
+    Outputs:
+      int: number of rows removed
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before deleting.')
+    self.MarkTableChanged('audit_log')
+    self.cursor_execute('DELETE FROM audit_log WHERE '
+                        'audit_log_id <= %(max_audit_log_id)s '
+                        'ORDER BY audit_log_id LIMIT %(limit)s',
+                        {'max_audit_log_id': max_audit_log_id,
+                         'limit': int(limit)})
+    return self.cursor.rowcount
 
   def InitDataValidation(self):
     """Get all reserved words and group permissions and init the
     data_validation_instance
+
+    Opens its own transaction if none is open in this thread.
     """
+    own_transaction = not self.transaction_init
+    if( own_transaction ):
+      self.StartTransaction()
     cursor = self.connection.cursor()
     try:
-      if( self.db_debug ):
-        if( self.db_debug_log ):
-          #If the execution_string contains a unicode character we must account
-          #for it. So we need to use the codecs package to write to a utf-8 log
-          #file, instead of ASCII like the 'normal' open() results in.
-          debug_log_handle = codecs.open(self.db_debug_log, encoding='utf-8',
-              mode='a')
-          debug_log_handle.write('SELECT reserved_word FROM reserved_words')
-          debug_log_handle.write('\n')
-          debug_log_handle.close()
-        else:
-          print 'SELECT reserved_word FROM reserved_words'
-      cursor.execute('SELECT reserved_word FROM reserved_words')
+      self.cursor_execute('SELECT reserved_word FROM reserved_words',
+                          cursor=cursor)
       reserved_words_rows = cursor.fetchall()
 
-      if( self.db_debug ):
-        if( self.db_debug_log ):
-          debug_log_handle = codecs.open(self.db_debug_log, encoding='utf-8',
-              mode='a')
-          debug_log_handle.write('SELECT record_type FROM record_types')
-          debug_log_handle.write('\n')
-          debug_log_handle.close()
-        else:
-          print 'SELECT record_type FROM record_types'
-      cursor.execute('SELECT record_type FROM record_types')
+      self.cursor_execute('SELECT record_type FROM record_types',
+                          cursor=cursor)
       record_types_rows = cursor.fetchall()
     finally:
       cursor.close()
+      if( own_transaction ):
+        self.EndTransaction()
 
     words = [row[0] for row in reserved_words_rows]
     record_types = [row[0] for row in record_types_rows]
@@ -385,6 +1769,7 @@ class dbAccess(object):
     if( not self.transaction_init ):
       raise errors.TransactionError('Must run StartTansaction before '
                                     'inserting.')
+    self.MarkTableChanged(table_name)
     if( self.data_validation_instance is None ):
       self.InitDataValidation()
     self.data_validation_instance.ValidateRowDict(table_name, row_dict) 
@@ -401,6 +1786,93 @@ class dbAccess(object):
     self.cursor_execute(query, row_dict)
     return self.cursor.lastrowid
 
+  def MakeRows(self, table_name, row_dicts):
+    """Creates many rows in the database with multi row INSERT statements.
+
+    Rows are inserted MAKE_ROWS_CHUNK_SIZE at a time. Ids generated by a
+    multi row INSERT are only consecutive when innodb_autoinc_lock_mode is
+    0 or 1, when the server interleaves them rows are inserted one at a time.
+    Rows are also inserted one at a time when any of them sets its primary
+    key, as the ids of the other rows would not follow the first one.
+
+    Inputs:
+      table_name: string of valid table name from constants
+      row_dicts: list of dictionaries that corespond to table_name
+
+    Raises:
+      InvalidInputError: Table name not valid
+      TransactionError: Must run StartTansaction before inserting
+
+    Outputs:
+      list: list of ints of the ids generated for the rows, in the same order
+            as row_dicts
+    """
+    if( not table_name in helpers_lib.GetValidTables() ):
+      raise errors.InvalidInputError('Table name not valid: %s' % table_name)
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before '
+                                    'inserting.')
+    self.MarkTableChanged(table_name)
+    if( not row_dicts ):
+      return []
+    if( self.data_validation_instance is None ):
+      self.InitDataValidation()
+    # Row dicts are validated against every column of the table, so they
+    # all share one statement.
+    for row_dict in row_dicts:
+      self.data_validation_instance.ValidateRowDict(table_name, row_dict)
+    column_names = row_dicts[0].keys()
+
+    column_assignments = []
+    for k in column_names:
+      column_assignments.append('%s%s%s' % ('%(', k, ')s'))
+    query = 'INSERT INTO %s (%s) VALUES (%s)' % (table_name,
+                                                 ','.join(column_names),
+                                                 ','.join(column_assignments))
+
+    primary_key = GetPrimaryKeys().get(table_name)
+    explicit_ids = False
+    if( primary_key is not None ):
+      for row_dict in row_dicts:
+        if( row_dict.get(primary_key) is not None ):
+          explicit_ids = True
+          break
+
+    lock_mode, increment = self.GetAutoIncrementSettings()
+    row_ids = []
+    if( explicit_ids or lock_mode > 1 ):
+      for row_dict in row_dicts:
+        self.cursor_execute(query, row_dict)
+        if( explicit_ids and row_dict.get(primary_key) is not None ):
+          row_ids.append(row_dict[primary_key])
+        else:
+          row_ids.append(self.cursor.lastrowid)
+      return row_ids
+
+    for index in range(0, len(row_dicts), constants.MAKE_ROWS_CHUNK_SIZE):
+      chunk = row_dicts[index:index + constants.MAKE_ROWS_CHUNK_SIZE]
+      self.cursor_execute(query, chunk, many=True)
+      # The insert id of a multi row INSERT is the id of its first row.
+      first_id = self.cursor.lastrowid
+      row_ids.extend(range(first_id, first_id + len(chunk) * increment,
+                           increment))
+    return row_ids
+
+  def GetAutoIncrementSettings(self):
+    """Gets the auto increment settings of the database server.
+
+    Outputs:
+      tuple: int of innodb_autoinc_lock_mode and int of
+             auto_increment_increment
+    """
+    if( self.auto_increment_settings is None ):
+      self.cursor_execute('SELECT @@innodb_autoinc_lock_mode AS `lock_mode`, '
+                          '@@auto_increment_increment AS `increment`')
+      settings = self.cursor.fetchone()
+      self.auto_increment_settings = (int(settings['lock_mode']),
+                                      int(settings['increment']))
+    return self.auto_increment_settings
+
   def TableRowCount(self, table_name):
     """Counts the amount of records in a table and returns it.
 
@@ -442,6 +1914,7 @@ class dbAccess(object):
       raise errors.InvalidInputError('Table name not valid: %s' % table_name)
     if( not self.transaction_init ):
       raise errors.TransactionError('Must run StartTansaction before deleting.')
+    self.MarkTableChanged(table_name)
     if( self.data_validation_instance is None ):
       self.InitDataValidation()
     self.data_validation_instance.ValidateRowDict(table_name, row_dict) 
@@ -475,6 +1948,7 @@ class dbAccess(object):
       raise errors.InvalidInputError('Table name not valid: %s' % table_name)
     if( not self.transaction_init ):
       raise errors.TransactionError('Must run StartTansaction before deleting.')
+    self.MarkTableChanged(table_name)
     if( self.data_validation_instance is None ):
       self.InitDataValidation()
     self.data_validation_instance.ValidateRowDict(table_name, search_row_dict,
@@ -500,6 +1974,155 @@ class dbAccess(object):
     self.cursor_execute(query, combined_dict)
     return self.cursor.rowcount
 
+  def RemoveRowsById(self, table_name, row_ids):
+    """Removes rows in the database by their primary key.
+
+    Rows are removed with DELETE ... WHERE id IN (...) statements of up to
+    ROWS_BY_ID_CHUNK_SIZE ids each.
+
+    Inputs:
+      table_name: string of valid table name from constants
+      row_ids: list of ints of primary key values
+
+    Raises:
+      InvalidInputError: Table name not valid
+      TransactionError: Must run StartTansaction before deleting
+      UnexpectedDataError: Invalid id
+
+    Outputs:
+      int: number of rows affected
+    """
+    if( not table_name in helpers_lib.GetValidTables() ):
+      raise errors.InvalidInputError('Table name not valid: %s' % table_name)
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before deleting.')
+    self.MarkTableChanged(table_name)
+    row_count = 0
+    for id_clause, id_dict in self.GetRowIdChunks(table_name, row_ids):
+      self.cursor_execute('DELETE FROM %s WHERE %s' % (table_name, id_clause),
+                          id_dict)
+      row_count += self.cursor.rowcount
+    return row_count
+
+  def UpdateRowsById(self, table_name, row_ids, update_row_dict):
+    """Updates rows in the database by their primary key.
+
+    Rows are updated with UPDATE ... WHERE id IN (...) statements of up to
+    ROWS_BY_ID_CHUNK_SIZE ids each.
+
+    Inputs:
+      table_name: string of valid table name from constants
+      row_ids: list of ints of primary key values
+      update_row_dict: dictionary that coresponds to table_name containing
+                       update args
+
+    Raises:
+      InvalidInputError: Table name not valid
+      TransactionError: Must run StartTansaction before updating
+      UnexpectedDataError: Invalid id
+      UnexpectedDataError: Need to fill out at least one value in dict
+
+    Outputs:
+      int: number of rows affected
+    """
+    if( not table_name in helpers_lib.GetValidTables() ):
+      raise errors.InvalidInputError('Table name not valid: %s' % table_name)
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before updating.')
+    self.MarkTableChanged(table_name)
+    if( self.data_validation_instance is None ):
+      self.InitDataValidation()
+    self.data_validation_instance.ValidateRowDict(table_name, update_row_dict,
+                                                  none_ok=True)
+
+    query_updates = []
+    update_dict = {}
+    for k, v in update_row_dict.iteritems():
+      if( v is not None ):
+        query_updates.append('%s%s%s%s' % (k, '=%(update_', k, ')s'))
+        update_dict['update_%s' % k] = v
+
+    row_count = 0
+    for id_clause, id_dict in self.GetRowIdChunks(table_name, row_ids):
+      id_dict.update(update_dict)
+      self.cursor_execute('UPDATE %s SET %s WHERE %s' % (
+          table_name, ','.join(query_updates), id_clause), id_dict)
+      row_count += self.cursor.rowcount
+    return row_count
+
+  def ListRowsById(self, table_name, row_ids, lock_rows=False):
+    """Lists rows in the database by their primary key.
+
+    Rows are listed with SELECT ... WHERE id IN (...) statements of up to
+    ROWS_BY_ID_CHUNK_SIZE ids each.
+
+    Inputs:
+      table_name: string of valid table name from constants
+      row_ids: list of ints of primary key values
+      lock_rows: boolean of if the rows should be locked
+
+    Raises:
+      InvalidInputError: Table name not valid
+      TransactionError: Must run StartTansaction before getting data
+      UnexpectedDataError: Invalid id
+
+    Outputs:
+      list: list of row dicts, ids that are not found are left out
+    """
+    if( not table_name in helpers_lib.GetValidTables() ):
+      raise errors.InvalidInputError('Table name not valid: %s' % table_name)
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before getting '
+                                    'data.')
+    rows = []
+    for id_clause, id_dict in self.GetRowIdChunks(table_name, row_ids):
+      query = 'SELECT %s FROM %s WHERE %s' % (
+          ','.join(constants.TABLES[table_name]), table_name, id_clause)
+      if( lock_rows ):
+        query = '%s FOR UPDATE' % query
+      self.cursor_execute(query, id_dict)
+      rows.extend(self.cursor.fetchall())
+    return rows
+
+  def GetRowIdChunks(self, table_name, row_ids, id_column=None):
+    """Splits ids into IN clauses on the primary key of a table.
+
+    Ids are deduplicated and sorted so that rows are always locked in the
+    same order.
+
+    Inputs:
+      table_name: string of valid table name from constants
+      row_ids: list of ints of primary key values
+      id_column: string of column to use instead of the primary key
+
+    Raises:
+      UnexpectedDataError: Invalid id
+
+    Outputs:
+      list: list of tuples of IN clause strings and dicts of the ids in them
+        example: [(u'records_id IN (%(id_0)s,%(id_1)s)',
+                   {'id_0': 4, 'id_1': 7})]
+    """
+    if( self.data_validation_instance is None ):
+      self.InitDataValidation()
+    for row_id in row_ids:
+      if( not self.data_validation_instance.isUnsignedInt(row_id) ):
+        raise errors.UnexpectedDataError('Invalid id: %s' % row_id)
+    if( id_column is None ):
+      id_column = GetPrimaryKeys()[table_name]
+    row_ids = sorted(set(row_ids))
+    id_chunks = []
+    for index in range(0, len(row_ids), constants.ROWS_BY_ID_CHUNK_SIZE):
+      id_dict = {}
+      id_keys = []
+      for id_index, row_id in enumerate(
+          row_ids[index:index + constants.ROWS_BY_ID_CHUNK_SIZE]):
+        id_dict['id_%s' % id_index] = row_id
+        id_keys.append('%%(id_%s)s' % id_index)
+      id_chunks.append(('%s IN (%s)' % (id_column, ','.join(id_keys)),
+                        id_dict))
+    return id_chunks
+
   def ListRow(self, *args, **kwargs):
     """Lists rows in the database using a dictionary of tables. Then returns 
     the rows found. Joins are auto generated on the fly based on foreign keys
@@ -534,14 +2157,102 @@ class dbAccess(object):
       InvalidInputError: Multiple tables were passed in but no joins were found
 
     Outputs:
-      tuple of row dicts consisting of all the tables that were in the input.
-      all column names in the db are unique so no colisions occour
-        example: ({'user_name': 'sharrell', 'access_level': 10, 
-                   'user_group_assignments_group_name: 'cs',
-                   'user_group_assignments_user_name: 'sharrell'},
-                  {'user_name': 'sharrell', 'access_level': 10, 
-                   'user_group_assignments_group_name: 'eas',
-                   'user_group_assignments_user_name: 'sharrell'})
+      tuple of row dicts consisting of all the tables that were in the input.
+      all column names in the db are unique so no colisions occour
+        example: ({'user_name': 'sharrell', 'access_level': 10, 
+                   'user_group_assignments_group_name: 'cs',
+                   'user_group_assignments_user_name: 'sharrell'},
+                  {'user_name': 'sharrell', 'access_level': 10, 
+                   'user_group_assignments_group_name: 'eas',
+                   'user_group_assignments_user_name: 'sharrell'})
+    """
+    query, search_dict = self.PrepareListRowQuery(args, kwargs)
+    self.cursor_execute(query, search_dict)
+    return self.cursor.fetchall()
+
+  def IterRow(self, *args, **kwargs):
+    """Lists rows in the database like ListRow, but streams them from a
+    server side cursor instead of buffering the whole result set.
+
+    Arguments are checked and the statement is built when IterRow is called,
+    the query itself is run when iteration starts. Rows are fetched from the
+    server chunk_size at a time. No other query can be run in the
+    transaction until the iterator is exhausted or closed, EndTransaction
+    closes any iterator that is still open.
+
+    Inputs:
+      args: pairs of string of table name and dict of rows
+      kwargs: chunk_size: number of rows fetched from the server at a time
+              all other kwargs are the same as ListRow
+
+      example usage: for row in IterRow('records', records_dict,
+                                         'record_arguments_records_assignments',
+                                         assignments_dict):
+
+    Raises:
+      InvalidInputError: chunk_size must be a positive integer
+      See ListRow for the other errors raised.
+
+    Outputs:
+      generator of row dicts, see ListRow
+    """
+    chunk_size = kwargs.pop('chunk_size', constants.ITER_ROW_CHUNK_SIZE)
+    if( not isinstance(chunk_size, (int, long)) or chunk_size < 1 ):
+      raise errors.InvalidInputError('chunk_size must be a positive integer: '
+                                     '%s' % chunk_size)
+    query, search_dict = self.PrepareListRowQuery(args, kwargs)
+    return self.StreamQuery(query, search_dict, chunk_size)
+
+  def StreamQuery(self, query, values, chunk_size,
+                  cursor_class=MySQLdb.cursors.SSDictCursor):
+    """Runs a query on a server side cursor and yields its rows.
+
+    The query is run when iteration starts, see IterRow.
+
+    Inputs:
+      query: mysql command string
+      values: dictionary of values for mysql command
+      chunk_size: number of rows fetched from the server at a time
+      cursor_class: server side cursor class, rows are dicts by default
+
+    Raises:
+      TransactionError: Must run StartTansaction before getting data.
+
+    Outputs:
+      generator of rows
+    """
+    state = self.transaction_state
+    if( not state.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before getting '
+                                    'data.')
+    cursor = state.connection.cursor(cursor_class)
+    state.streaming_cursors.append(cursor)
+    try:
+      self.cursor_execute(query, values, cursor=cursor)
+      while( True ):
+        rows = cursor.fetchmany(chunk_size)
+        if( not rows ):
+          break
+        for row in rows:
+          yield row
+    finally:
+      if( cursor in state.streaming_cursors ):
+        state.streaming_cursors.remove(cursor)
+        cursor.close()
+
+  def PrepareListRowQuery(self, args, kwargs):
+    """Checks the arguments of ListRow and IterRow and gets the statement
+    and values to search with.
+
+    Inputs:
+      args: tuple of pairs of string of table name and dict of rows
+      kwargs: dictionary of keyword arguments, see ListRow
+
+    Raises:
+      See ListRow.
+
+    Outputs:
+      tuple: string of query and dictionary of values to search with
     """
     if( not self.transaction_init ):
       raise errors.TransactionError('Must run StartTansaction before getting '
@@ -595,12 +2306,44 @@ class dbAccess(object):
           raise errors.InvalidInputError('Table name not valid: %s' % arg)
         current_table_name = arg
       else:
+        tables[current_table_name] = arg
+        table_names.append(current_table_name)
+
+    # The generated statement only depends on the tables, which columns are
+    # searched on, the range column and row locking. A row dict with the
+    # same keys as a cached one has already had its keys validated, so only
+    # the searched values are type checked.
+    row_signatures = []
+    for table_name in table_names:
+      row_dict = tables[table_name]
+      if( not isinstance(row_dict, dict) ):
+        row_signatures = None
+        break
+      row_signatures.append((
+          frozenset(row_dict),
+          frozenset([key for key, value in row_dict.iteritems()
+                     if value is not None])))
+    statement = None
+    if( row_signatures is not None ):
+      statement_key = (self.db_name, tuple(table_names),
+                       tuple(row_signatures), column, bool(lock_rows))
+      statement = list_row_statement_cache.Get(statement_key)
+
+    if( statement is None ):
+      build_start = time.time()
+      for table_name in table_names:
         # do checking in validate row dict to check if it is a dict
-        self.data_validation_instance.ValidateRowDict(current_table_name, arg,
+        self.data_validation_instance.ValidateRowDict(table_name,
+                                                      tables[table_name],
                                                       none_ok=True,
                                                       all_none_ok=True)
-        tables[current_table_name] = arg
-        table_names.append(current_table_name)
+    else:
+      for table_name, key, data_type in statement['validators']:
+        value = tables[table_name][key]
+        if( not getattr(self.data_validation_instance, 'is%s' % data_type)(
+            value) ):
+          raise errors.UnexpectedDataError('Invalid data type %s for %s: %s' % (
+              data_type, key, value))
 
     if( range_values ):
       if( column not in args[1] ):
@@ -621,38 +2364,60 @@ class dbAccess(object):
           if( not self.data_validation_instance.isUnsignedInt(value) ):
             raise errors.InvalidInputError('Range must be int if is_date '
                                            'is not set')
+
+    if( statement is None ):
+      statement = self.BuildListRowStatement(tables, table_names, column,
+                                             lock_rows)
+      if( row_signatures is not None ):
+        list_row_statement_cache.Set(statement_key, statement,
+                                     time.time() - build_start)
+
+    search_dict = {}
+    for table_name, key, data_type in statement['validators']:
+      search_dict[key] = tables[table_name][key]
+    if( range_values ):
+      search_dict['start'] = range_values[0]
+      search_dict['end'] = range_values[1]
+
+    return (statement['query'], search_dict)
+
+  def BuildListRowStatement(self, tables, table_names, column, lock_rows):
+    """Builds the SELECT statement used by ListRow.
+
+    Inputs:
+      tables: dictionary of row dicts keyed by table name
+      table_names: list of table names in the order they were given
+      column: string of column to search a range on or None
+      lock_rows: boolean of if rows should be locked for update
+
+    Raises:
+      InvalidInputError: Multiple tables were passed in but no joins were found
+
+    Outputs:
+      dict: dictionary with the query string and a list of validators,
+            tuples of (table name, column name, data type) for every column
+            that is searched on
+        example: {'query': u'SELECT users.user_name,users.access_level '
+                           u'FROM users WHERE user_name=%(user_name)s',
+                  'validators': [('users', 'user_name', 'UnicodeString')]}
+    """
     query_where = []
     if( len(tables) > 1 ):
-      if( not self.foreign_keys ):
-        self.cursor_execute('SELECT table_name, column_name, '
-                            'referenced_table_name, referenced_column_name '
-                            'FROM information_schema.key_column_usage WHERE '
-                            'referenced_table_name IS NOT NULL AND '
-                            'referenced_table_schema="%s"' % self.db_name)
-        self.foreign_keys = self.cursor.fetchall()
-
-      for key in self.foreign_keys:
-        if( key['table_name'] in table_names and
-            key['referenced_table_name'] in table_names ):
-          
-          query_where.append('(%(table_name)s.%(column_name)s='
-                             '%(referenced_table_name)s.'
-                             '%(referenced_column_name)s)' % key)
+      query_where.extend(self.foreign_key_graph.GetJoinPredicates(table_names))
       if( not query_where ):
         raise errors.InvalidInputError('Multiple tables were passed in but no '
                                        'joins were found')
     column_names = []
-    search_dict = {}
+    validators = []
     for table_name, row_dict in tables.iteritems():
       for key, value in row_dict.iteritems():
         column_names.append('%s.%s' % (table_name, key))
         if( value is not None ):
-          search_dict[key] = value
+          validators.append((table_name, key,
+                             constants.TABLES[table_name][key]))
           query_where.append('%s%s%s%s' % (key, '=%(', key, ')s'))
 
-    if( range_values ):
-      search_dict['start'] = range_values[0]
-      search_dict['end'] = range_values[1]
+    if( column ):
       query_where.append('%s%s%s%s' % (column, '>=%(start)s AND ',
                                        column, '<=%(end)s'))
 
@@ -665,9 +2430,7 @@ class dbAccess(object):
     query = 'SELECT %s FROM %s %s' % (','.join(column_names),
                                       ','.join(table_names),
                                       query_end)
-
-    self.cursor_execute(query, search_dict)
-    return self.cursor.fetchall()
+    return {'query': query, 'validators': validators}
 
   def GetEmptyRowDict(self, table_name):
     """Gives a dict that has all the members needed to interact with the
@@ -793,6 +2556,642 @@ class dbAccess(object):
         raise errors.UnexpectedDataError('Invalid data type %s: %s' % (
                                          record_type_dict[record_arg_name],
                                          record_args_dict[record_arg_name]))
+
+  def BuildMatchingRecordsQuery(self, records_dict, record_args_dict):
+    """Builds a query for the ids of records that match a records row dict
+    and record argument values.
+
+    Every argument that is not None is joined as its own copy of
+    record_arguments_records_assignments on the argument name and value, so
+    the database only returns records that have all of them.
+
+    Inputs:
+      records_dict: dictionary that coresponds to the records table, None
+                    values are not searched on
+      record_args_dict: dictionary of argument values keyed by argument name,
+                        None values are not searched on
+
+    Raises:
+      UnexpectedDataError: Invalid data type (from ValidateRowDict)
+
+    Outputs:
+      tuple: string of query selecting records_id and dictionary of values
+        example: ('SELECT records.records_id FROM records JOIN '
+                  'record_arguments_records_assignments AS argument_0 ON '
+                  '(argument_0.record_arguments_records_assignments_record_id='
+                  'records.records_id AND argument_0.'
+                  'record_arguments_records_assignments_argument_name='
+                  '%(argument_name_0)s AND argument_0.argument_value='
+                  '%(argument_value_0)s) WHERE record_type=%(record_type)s',
+                  {'record_type': u'a', 'argument_name_0': u'assignment_ip',
+                   'argument_value_0': u'192.168.0.1'})
+    """
+    if( self.data_validation_instance is None ):
+      self.InitDataValidation()
+    self.data_validation_instance.ValidateRowDict('records', records_dict,
+                                                  none_ok=True,
+                                                  all_none_ok=True)
+    query_joins = []
+    query_where = []
+    values = {}
+    for key, value in records_dict.iteritems():
+      if( value is not None ):
+        query_where.append('records.%s%s%s%s' % (key, '=%(', key, ')s'))
+        values[key] = value
+    argument_index = 0
+    for argument_name, argument_value in sorted(record_args_dict.items()):
+      if( argument_value is None ):
+        continue
+      query_joins.append(
+          'JOIN record_arguments_records_assignments AS argument_%(index)s ON '
+          '(argument_%(index)s.record_arguments_records_assignments_record_id='
+          'records.records_id AND argument_%(index)s.'
+          'record_arguments_records_assignments_argument_name='
+          '%%(argument_name_%(index)s)s AND argument_%(index)s.argument_value='
+          '%%(argument_value_%(index)s)s)' % {'index': argument_index})
+      values['argument_name_%s' % argument_index] = argument_name
+      values['argument_value_%s' % argument_index] = unicode(argument_value)
+      argument_index += 1
+
+    query = 'SELECT records.records_id FROM records'
+    if( query_joins ):
+      query = '%s %s' % (query, ' '.join(query_joins))
+    if( query_where ):
+      query = '%s WHERE %s' % (query, ' AND '.join(query_where))
+    return (query, values)
+
+  def ListMatchingRecordIds(self, records_dict, record_args_dict,
+                            lock_rows=False):
+    """Lists the ids of records that match a records row dict and record
+    argument values in one query, see BuildMatchingRecordsQuery.
+
+    Inputs:
+      records_dict: dictionary that coresponds to the records table
+      record_args_dict: dictionary of argument values keyed by argument name
+      lock_rows: boolean of if the matching records should be locked
+
+    Raises:
+      TransactionError: Must run StartTansaction before getting data.
+
+    Outputs:
+      list: list of ints of record ids
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before getting '
+                                    'data.')
+    query, values = self.BuildMatchingRecordsQuery(records_dict,
+                                                   record_args_dict)
+    if( lock_rows ):
+      query = '%s FOR UPDATE' % query
+    self.cursor_execute(query, values)
+    return [row['records_id'] for row in self.cursor.fetchall()]
+
+  def BuildRecordConflictsQuery(self, record_index, record,
+                                cname_checks_all_views=False):
+    """Builds a query for the records that a new record conflicts with.
+
+    A new CNAME conflicts with every record that has its target. Any other
+    new record conflicts with CNAMEs that have its target and with records
+    of its type that have its target and every one of its argument values
+    that is not None. Targets are matched in the column's case insensitive
+    collation, as host names are, argument values are matched exactly.
+
+    Inputs:
+      record_index: int of the index of the new record, selected as
+                    record_index
+      record: dictionary of the new record
+        example: {'record_type': u'a', 'record_target': u'host1',
+                  'record_zone_name': u'forward_zone',
+                  'record_view_dependencies': [u'any', u'test_view_dep'],
+                  'record_arguments': {u'assignment_ip': u'192.168.0.1'}}
+      cname_checks_all_views: boolean of if a new CNAME conflicts with
+                              records in views other than
+                              record_view_dependencies
+
+    Raises:
+      UnexpectedDataError: Invalid data type (from ValidateRowDict)
+
+    Outputs:
+      tuple: string of query selecting record_index, records_id, record_type
+             and record_view_dependency and dictionary of values, or None if
+             the new record can not conflict with anything
+    """
+    if( self.data_validation_instance is None ):
+      self.InitDataValidation()
+    records_dict = self.GetEmptyRowDict('records')
+    records_dict['record_type'] = record['record_type']
+    records_dict['record_target'] = record['record_target']
+    records_dict['record_zone_name'] = record['record_zone_name']
+    self.data_validation_instance.ValidateRowDict('records', records_dict,
+                                                  none_ok=True)
+    values = {'record_index_%s' % record_index: record_index,
+              'record_type_%s' % record_index: record['record_type'],
+              'record_target_%s' % record_index: record['record_target'],
+              'record_zone_name_%s' % record_index: record['record_zone_name']}
+    query_where = [
+        'records.record_target=%%(record_target_%s)s' % record_index,
+        'records.record_zone_name=%%(record_zone_name_%s)s' % record_index]
+
+    if( not (record['record_type'] == u'cname' and
+             cname_checks_all_views) ):
+      if( not record['record_view_dependencies'] ):
+        return None
+      view_dependency_keys = []
+      for view_index, view_dependency in enumerate(
+          sorted(record['record_view_dependencies'])):
+        key = 'view_dependency_%s_%s' % (record_index, view_index)
+        view_dependency_keys.append('%%(%s)s' % key)
+        values[key] = view_dependency
+      query_where.append('records.record_view_dependency IN (%s)' % (
+          ','.join(view_dependency_keys)))
+
+    if( record['record_type'] != u'cname' ):
+      argument_matches = []
+      for argument_index, (argument_name, argument_value) in enumerate(
+          sorted(record['record_arguments'].items())):
+        if( argument_value is None ):
+          continue
+        name_key = 'argument_name_%s_%s' % (record_index, argument_index)
+        value_key = 'argument_value_%s_%s' % (record_index, argument_index)
+        # BINARY is put on the value rather than the column so the index on
+        # argument_value is still used.
+        argument_matches.append(
+            '(record_arguments_records_assignments_argument_name=%%(%s)s AND '
+            'argument_value=BINARY %%(%s)s)' % (name_key, value_key))
+        values[name_key] = argument_name
+        values[value_key] = unicode(argument_value)
+      duplicate_where = 'records.record_type=%%(record_type_%s)s' % (
+          record_index)
+      if( argument_matches ):
+        # Argument names are unique per record, so a record has every value
+        # when all of them are counted.
+        duplicate_where = (
+            '%s AND (SELECT COUNT(*) FROM record_arguments_records_assignments '
+            'WHERE record_arguments_records_assignments_record_id='
+            'records.records_id AND (%s))=%s' % (
+                duplicate_where, ' OR '.join(argument_matches),
+                len(argument_matches)))
+      query_where.append("(records.record_type='cname' OR (%s))" % (
+          duplicate_where))
+
+    query = ('SELECT %%(record_index_%s)s AS record_index, records.records_id, '
+             'records.record_type, records.record_view_dependency FROM records '
+             'WHERE %s' % (record_index, ' AND '.join(query_where)))
+    return (query, values)
+
+  def ListRecordConflicts(self, records, cname_checks_all_views=False):
+    """Lists the records that new records conflict with, see
+    BuildRecordConflictsQuery.
+
+    The queries of RECORD_CONFLICTS_CHUNK_SIZE new records are run as one
+    statement.
+
+    Inputs:
+      records: list of dictionaries of new records, see
+               BuildRecordConflictsQuery
+      cname_checks_all_views: boolean of if a new CNAME conflicts with
+                              records in every view
+
+    Raises:
+      TransactionError: Must run StartTansaction before getting data.
+
+    Outputs:
+      list: list of lists of conflicting records rows, in the order of
+            records
+        example: [[],
+                  [{'records_id': 12, 'record_type': u'cname',
+                    'record_view_dependency': u'any'}]]
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before getting '
+                                    'data.')
+    conflicts = [[] for record in records]
+    for index in range(0, len(records),
+                       constants.RECORD_CONFLICTS_CHUNK_SIZE):
+      queries = []
+      values = {}
+      for record_index in range(
+          index, min(index + constants.RECORD_CONFLICTS_CHUNK_SIZE,
+                     len(records))):
+        record_query = self.BuildRecordConflictsQuery(
+            record_index, records[record_index],
+            cname_checks_all_views=cname_checks_all_views)
+        if( record_query is None ):
+          continue
+        queries.append(record_query[0])
+        values.update(record_query[1])
+      if( not queries ):
+        continue
+      self.cursor_execute(' UNION ALL '.join(queries), values)
+      for row in self.cursor.fetchall():
+        conflicts[int(row.pop('record_index'))].append(row)
+    return conflicts
+
+  def IterIndexedAddresses(self, first_address, last_address, ip_version,
+                           view_dependency=None, zone_name=None,
+                           lock_rows=False):
+    """Iterates over the addresses in ipv4_index or ipv6_index in order.
+
+    Addresses are read ITER_ROW_CHUNK_SIZE at a time, each chunk starts
+    after the last address of the one before it, so stopping early does not
+    read the rest of the range.
+
+    Inputs:
+      first_address: int of the first address of the range
+      last_address: int of the last address of the range
+      ip_version: int of 4 or 6
+      view_dependency: string of view dependency of the records, None for
+                       all
+      zone_name: string of zone name of the records, None for all
+      lock_rows: boolean of if the index rows read should be locked, this
+                 also keeps new addresses from being indexed in the ranges
+                 read until the transaction ends
+
+    Raises:
+      TransactionError: Must run StartTansaction before getting data.
+
+    Outputs:
+      generator of ints of addresses, each address is only yielded once
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before getting '
+                                    'data.')
+    if( ip_version == 4 ):
+      address_columns = 'ipv4_index.ipv4_dec_address AS address'
+      order_columns = 'ipv4_index.ipv4_dec_address'
+      query_where = ['ipv4_index.ipv4_dec_address BETWEEN %(first_address)s '
+                     'AND %(last_address)s']
+      query_from = ('ipv4_index JOIN records ON '
+                    '(records.records_id=ipv4_index.ipv4_index_record_id)')
+    else:
+      address_columns = ('ipv6_index.ipv6_dec_upper AS upper, '
+                         'ipv6_index.ipv6_dec_lower AS lower')
+      order_columns = 'ipv6_index.ipv6_dec_upper, ipv6_index.ipv6_dec_lower'
+      query_where = [
+          'ipv6_index.ipv6_dec_upper BETWEEN %(first_upper)s AND '
+          '%(last_upper)s',
+          '(ipv6_index.ipv6_dec_upper>%(first_upper)s OR '
+          'ipv6_index.ipv6_dec_lower>=%(first_lower)s)',
+          '(ipv6_index.ipv6_dec_upper<%(last_upper)s OR '
+          'ipv6_index.ipv6_dec_lower<=%(last_lower)s)']
+      query_from = ('ipv6_index JOIN records ON '
+                    '(records.records_id=ipv6_index.ipv6_index_record_id)')
+    values = {}
+    if( view_dependency is not None ):
+      query_where.append('records.record_view_dependency=%(view_dependency)s')
+      values['view_dependency'] = view_dependency
+    if( zone_name is not None ):
+      query_where.append('records.record_zone_name=%(zone_name)s')
+      values['zone_name'] = zone_name
+    query = 'SELECT DISTINCT %s FROM %s WHERE %s ORDER BY %s LIMIT %s' % (
+        address_columns, query_from, ' AND '.join(query_where),
+        order_columns, constants.ITER_ROW_CHUNK_SIZE)
+    if( lock_rows ):
+      query = '%s FOR UPDATE' % query
+
+    while( first_address <= last_address ):
+      values.update({'first_address': first_address,
+                     'last_address': last_address,
+                     'first_upper': first_address >> 64,
+                     'first_lower': first_address & 0xffffffffffffffff,
+                     'last_upper': last_address >> 64,
+                     'last_lower': last_address & 0xffffffffffffffff})
+      self.cursor_execute(query, values)
+      rows = self.cursor.fetchall()
+      for row in rows:
+        if( ip_version == 4 ):
+          address = int(row['address'])
+        else:
+          address = (int(row['upper']) << 64) | int(row['lower'])
+        yield address
+      if( len(rows) < constants.ITER_ROW_CHUNK_SIZE ):
+        break
+      first_address = address + 1
+
+  def LockIpAllocation(self, cidr_block, first_address):
+    """Locks the ip_allocations row of a cidr block until the transaction
+    ends, making the row if the block has none.
+
+    Inputs:
+      cidr_block: string of cidr block
+      first_address: int of the first address of the block, allocation in
+                     a new block starts from it
+
+    Raises:
+      TransactionError: Must run StartTansaction before locking.
+
+    Outputs:
+      int: int of the next address to allocate in the block
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before locking.')
+    self.MarkTableChanged('ip_allocations')
+    values = {'cidr_block': cidr_block,
+              'next_upper': first_address >> 64,
+              'next_lower': first_address & 0xffffffffffffffff}
+    # The row is locked for update by the insert itself, a shared lock taken
+    # by INSERT IGNORE on an existing row would deadlock with another
+    # transaction upgrading the same lock. A block made by another
+    # transaction at the same time is waited on and then left as it is.
+    self.cursor_execute(
+        'INSERT INTO ip_allocations (ip_allocation_cidr_block, '
+        'ip_allocation_next_upper, ip_allocation_next_lower) VALUES '
+        '(%(cidr_block)s, %(next_upper)s, %(next_lower)s) ON DUPLICATE KEY '
+        'UPDATE ip_allocation_cidr_block=ip_allocation_cidr_block', values)
+    self.cursor_execute(
+        'SELECT ip_allocation_next_upper, ip_allocation_next_lower FROM '
+        'ip_allocations WHERE ip_allocation_cidr_block=%(cidr_block)s '
+        'FOR UPDATE', values)
+    row = self.cursor.fetchone()
+    return ((int(row['ip_allocation_next_upper']) << 64) |
+            int(row['ip_allocation_next_lower']))
+
+  def SetIpAllocation(self, cidr_block, next_address):
+    """Sets the next address to allocate in a cidr block locked with
+    LockIpAllocation.
+
+    Inputs:
+      cidr_block: string of cidr block
+      next_address: int of the next address to allocate in the block
+
+    Raises:
+      TransactionError: Must run StartTansaction before updating.
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before '
+                                    'updating.')
+    self.MarkTableChanged('ip_allocations')
+    self.cursor_execute(
+        'UPDATE ip_allocations SET ip_allocation_next_upper=%(next_upper)s, '
+        'ip_allocation_next_lower=%(next_lower)s WHERE '
+        'ip_allocation_cidr_block=%(cidr_block)s',
+        {'cidr_block': cidr_block,
+         'next_upper': next_address >> 64,
+         'next_lower': next_address & 0xffffffffffffffff})
+
+  def RefreshFlatRecords(self, record_ids):
+    """Rewrites the flat_records rows of records from their
+    record_arguments_records_assignments rows.
+
+    This has to be run in the same transaction as any change to the
+    arguments of a record. Removed records are taken out of flat_records by
+    their foreign key. Argument values are copied as they are stored.
+
+    Inputs:
+      record_ids: list of ints of record ids
+
+    Raises:
+      TransactionError: Must run StartTansaction before inserting.
+      UnexpectedDataError: Invalid id
+      UnexpectedDataError: No flat_records column for record argument
+
+    Outputs:
+      int: number of records rewritten
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before '
+                                    'inserting.')
+    flat_record_columns = constants.TABLES['flat_records']
+    column_names = sorted(flat_record_columns.keys())
+    query = 'REPLACE INTO flat_records (%s) VALUES (%s)' % (
+        ','.join(column_names),
+        ','.join(['%%(%s)s' % column_name for column_name in column_names]))
+    record_count = 0
+    for id_clause, id_dict in self.GetRowIdChunks(
+        'flat_records', record_ids,
+        id_column='record_arguments_records_assignments_record_id'):
+      self.cursor_execute(
+          'SELECT record_arguments_records_assignments_record_id,'
+          'record_arguments_records_assignments_type,'
+          'record_arguments_records_assignments_argument_name,'
+          'argument_value FROM record_arguments_records_assignments '
+          'WHERE %s' % id_clause, id_dict)
+      flat_records = {}
+      for argument_row in self.cursor.fetchall():
+        record_id = argument_row[
+            'record_arguments_records_assignments_record_id']
+        if( record_id not in flat_records ):
+          flat_records[record_id] = self.GetEmptyRowDict('flat_records')
+          flat_records[record_id]['flat_records_record_id'] = record_id
+          flat_records[record_id]['flat_records_type'] = argument_row[
+              'record_arguments_records_assignments_type']
+        argument_name = argument_row[
+            'record_arguments_records_assignments_argument_name']
+        if( argument_name not in flat_record_columns or
+            argument_name.startswith('flat_records_') ):
+          raise errors.UnexpectedDataError(
+              'No flat_records column for record argument: %s' % (
+                  argument_name))
+        argument_value = argument_row['argument_value']
+        if( flat_record_columns[argument_name] == 'UnsignedInt' ):
+          argument_value = int(argument_value)
+        flat_records[record_id][argument_name] = argument_value
+      if( not flat_records ):
+        continue
+      # The values were validated when their argument rows were made, they
+      # are not checked again so that values with words reserved since
+      # still copy.
+      self.cursor_execute(query, flat_records.values(), many=True)
+      record_count += len(flat_records)
+    return record_count
+
+  def QueueSoaIncrement(self, zone_name, view_dependency, missing_ok=False):
+    """Queues an increment of the SOA serial numbers of a zone for when the
+    transaction is committed.
+
+    Increments are coalesced, each zone and view dependency is only
+    incremented once per transaction however many changes were made to it.
+    Changes in the any view are queued apart from changes in the views of
+    the zone, so an SOA record changed through both is incremented twice.
+
+    Inputs:
+      zone_name: string of zone name
+      view_dependency: string of view dependency, u'any' increments the SOA
+                       records of every view of the zone
+      missing_ok: boolean of whether or not missing SOA records are allowed
+
+    Raises:
+      TransactionError: Must run StartTansaction before queueing.
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before '
+                                    'queueing.')
+    soa_increments = self.transaction_state.soa_increments
+    soa_increments[(zone_name, view_dependency)] = (
+        soa_increments.get((zone_name, view_dependency), True) and missing_ok)
+
+  def IncrementSoaSerials(self):
+    """Increments the SOA serial numbers queued by QueueSoaIncrement with
+    one UPDATE per zone and view dependency. This is run by EndTransaction
+    before committing.
+
+    Serial numbers wrap around to 1 after constants.MAX_SOA_SERIAL.
+
+    Raises:
+      TransactionError: Must run StartTansaction before updating.
+      InvalidInputError: Multiple SOA records found.
+      RecordError: No SOA record found for zone.
+      DbAccessError: Could not increment the SOA serial number of a zone.
+
+    Outputs:
+      int: number of SOA records incremented
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before '
+                                    'updating.')
+    soa_increments = []
+    for (zone_name, view_dependency), missing_ok in (
+        self.transaction_state.soa_increments.iteritems()):
+      if( view_dependency == u'any' ):
+        zone_view_assignments_dict = self.GetEmptyRowDict(
+            'zone_view_assignments')
+        zone_view_assignments_dict['zone_view_assignments_zone_name'] = (
+            zone_name)
+        view_dependencies = [
+            row['zone_view_assignments_view_dependency'] for row in
+            self.ListRow('zone_view_assignments', zone_view_assignments_dict)]
+      else:
+        view_dependencies = [view_dependency]
+      for view_dependency in view_dependencies:
+        if( view_dependency == u'any' ):
+          continue
+        soa_increments.append((zone_name, view_dependency, missing_ok))
+    self.transaction_state.soa_increments = {}
+
+    row_count = 0
+    # Sorted so that concurrent transactions lock SOA records in the same
+    # order.
+    for zone_name, view_dependency, missing_ok in sorted(soa_increments):
+      try:
+        soa_count = self.IncrementSoaSerial(zone_name, view_dependency)
+      except MySQLdb.Error, e:
+        raise errors.DbAccessError(
+            'Could not increment the SOA serial number of zone "%s" view '
+            '"%s": %s' % (zone_name, view_dependency, e))
+      if( soa_count > 1 ):
+        raise errors.InvalidInputError(
+            'Multiple SOA records found for zone "%s" view "%s".' % (
+                zone_name, view_dependency))
+      if( soa_count == 0 and not missing_ok ):
+        raise errors.RecordError(
+            'No SOA record found for zone "%s" view "%s".' % (
+            zone_name, view_dependency))
+      row_count += soa_count
+    return row_count
+
+  def IncrementSoaSerial(self, zone_name, view_dependency):
+    """Increments the SOA serial number of a zone and view dependency, see
+    IncrementSoaSerials.
+
+    Inputs:
+      zone_name: string of zone name
+      view_dependency: string of view dependency
+
+    Outputs:
+      int: number of SOA records incremented
+    """
+    soa_dict = {'zone_name': zone_name, 'view_dependency': view_dependency,
+                'max_soa_serial': constants.MAX_SOA_SERIAL}
+    self.cursor_execute(
+        'UPDATE record_arguments_records_assignments JOIN records ON '
+        '(records.records_id=record_arguments_records_assignments.'
+        'record_arguments_records_assignments_record_id) SET '
+        'record_arguments_records_assignments.argument_value=IF('
+        'CAST(record_arguments_records_assignments.argument_value AS '
+        'UNSIGNED) >= %(max_soa_serial)s, 1, CAST('
+        'record_arguments_records_assignments.argument_value AS UNSIGNED) '
+        '+ 1) WHERE records.record_type=\'soa\' AND '
+        'records.record_zone_name=%(zone_name)s AND '
+        'records.record_view_dependency=%(view_dependency)s AND '
+        'record_arguments_records_assignments.'
+        'record_arguments_records_assignments_argument_name='
+        '\'serial_number\'', soa_dict)
+    soa_count = self.cursor.rowcount
+    if( soa_count ):
+      self.cursor_execute(
+          'UPDATE flat_records JOIN records ON (records.records_id='
+          'flat_records.flat_records_record_id) SET '
+          'flat_records.serial_number=IF(flat_records.serial_number >= '
+          '%(max_soa_serial)s, 1, flat_records.serial_number + 1) WHERE '
+          'records.record_type=\'soa\' AND '
+          'records.record_zone_name=%(zone_name)s AND '
+          'records.record_view_dependency=%(view_dependency)s', soa_dict)
+    return soa_count
+
+  def InvalidateViewDependencyGraph(self):
+    """Drops the process wide view dependency graph.
+
+    Run in any transaction that changes views, view_dependencies or
+    view_dependency_assignments. The transaction moves to a new config
+    generation when it is committed, which every process reads the graph
+    again for.
+    """
+    view_dependency_graph.Invalidate()
+    if( self.transaction_init ):
+      self.MarkConfigChanged()
+
+  def GetViewDependencyClosure(self, view_dependency):
+    """Gets the views a view dependency is included in and every view
+    dependency included in those views.
+
+    The graph is read out of view_dependency_assignments the first time it
+    is needed and kept until the config generation changes. A transaction
+    with config changes of its own reads the graph with them and does not
+    keep it.
+
+    Inputs:
+      view_dependency: string of view dependency
+        example: u'internal_dep'
+
+    Raises:
+      TransactionError: Must run StartTansaction before listing
+
+    Outputs:
+      tuple: (views, view_dependencies) sets of view names and view
+             dependencies
+        example: (set([u'internal']),
+                  set([u'internal_dep', u'any']))
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before '
+                                    'listing.')
+    config_generation = None
+    graph = None
+    if( not self.transaction_state.config_changed ):
+      config_generation = self.GetConfigGeneration()
+      graph = view_dependency_graph.Get(config_generation)
+    if( graph is None ):
+      graph = view_dependency_graph.Load(
+          self.ListRow('view_dependency_assignments',
+                       {'view_dependency_assignments_view_name': None,
+                        'view_dependency_assignments_view_dependency': None}),
+          config_generation)
+    views_by_dependency, dependencies_by_view = graph
+    views = set(views_by_dependency.get(view_dependency, ()))
+    view_dependencies = set()
+    for view_name in views:
+      view_dependencies.update(dependencies_by_view[view_name])
+    return views, view_dependencies
+
+  def RebuildFlatRecords(self):
+    """Rebuilds every row of flat_records from
+    record_arguments_records_assignments.
+
+    Raises:
+      TransactionError: Must run StartTansaction before inserting.
+
+    Outputs:
+      int: number of records rebuilt
+    """
+    if( not self.transaction_init ):
+      raise errors.TransactionError('Must run StartTansaction before '
+                                    'inserting.')
+    self.MarkTableChanged('flat_records')
+    self.cursor_execute('DELETE FROM flat_records')
+    self.cursor_execute('SELECT records_id FROM records')
+    return self.RefreshFlatRecords(
+        [row['records_id'] for row in self.cursor.fetchall()])
+
   def ListTableNames(self):
     """Lists all tables in the database.
 
@@ -831,6 +3230,26 @@ class dbAccess(object):
     Inputs:
       schema: string of sql schema
     """
+    warnings.filterwarnings('ignore', 'Unknown table.*')
+    for line in self.GetSchemaStatements(schema):
+      self.StartTransaction()
+      try:
+        self.cursor_execute(line)
+      finally:
+        self.EndTransaction()
+    view_dependency_graph.Invalidate()
+    config_snapshot_cache.Invalidate()
+    last_export_cache.Invalidate()
+
+  def GetSchemaStatements(self, schema=None):
+    """Splits a schema into its statements, leaving out comments.
+
+    Inputs:
+      schema: string of sql schema
+
+    Outputs:
+      list: list of strings of sql statements
+    """
     if( schema is None ):
       schema = embedded_files.SCHEMA_FILE
     schema_lines = schema.split('\n')
@@ -845,58 +3264,155 @@ class dbAccess(object):
         continued_line = []
       else:
         continued_line.append(line)
-      
-    warnings.filterwarnings('ignore', 'Unknown table.*')
-    for line in execute_lines:
+    return execute_lines
+
+  def UpgradeRosterDatabase(self, schema=None):
+    """Brings the table structure of an existing database up to a schema
+    without touching the data in it.
+
+    Tables of the schema that are missing are created along with the rows
+    the schema inserts into them, and indexes of the schema that are missing
+    from existing tables are added. A flat_records table that is created is
+    filled from the records in the database. Columns of existing tables are
+    not changed.
+
+    Inputs:
+      schema: string of sql schema
+
+    Outputs:
+      dict: dictionary of lists of tables and indexes that were added
+        ex: {'tables': [u'flat_records'],
+             'indexes': [u'audit_log.audit_log_timestamp_1']}
+    """
+    create_statements = []
+    insert_statements = {}
+    for statement in self.GetSchemaStatements(schema):
+      statement = statement.strip()
+      table_match = re.match(r'CREATE TABLE `(\w+)`', statement)
+      if( table_match ):
+        create_statements.append((table_match.group(1), statement))
+        continue
+      insert_match = re.match(r'INSERT INTO `?(\w+)`?', statement)
+      if( insert_match ):
+        insert_statements.setdefault(insert_match.group(1), []).append(
+            statement)
+
+    self.StartTransaction()
+    try:
+      table_names = set(self.ListTableNames())
+    finally:
+      self.EndTransaction()
+
+    added = {'tables': [], 'indexes': []}
+    for table_name, statement in create_statements:
+      if( table_name in table_names ):
+        continue
       self.StartTransaction()
       try:
-        self.cursor_execute(line)
+        self.cursor_execute(statement)
+        for insert_statement in insert_statements.get(table_name, []):
+          self.cursor_execute(insert_statement)
+      except:
+        self.EndTransaction(rollback=True)
+        raise
+      self.EndTransaction()
+      added['tables'].append(table_name)
+
+    for table_name, statement in create_statements:
+      if( table_name in added['tables'] ):
+        continue
+      self.StartTransaction()
+      try:
+        self.cursor_execute('SHOW INDEX FROM %s' % table_name)
+        index_names = set([row['Key_name'] for row in self.cursor.fetchall()])
       finally:
         self.EndTransaction()
+      # Column lists can hold prefix lengths, such as `argument_value`(15).
+      for index_type, index_name, index_columns in re.findall(
+          r'\n\s*(INDEX|UNIQUE KEY) `(\w+)`\s*(\((?:[^()]|\([^()]*\))*\))',
+          statement):
+        if( index_name in index_names ):
+          continue
+        self.StartTransaction()
+        try:
+          self.cursor_execute('ALTER TABLE %s ADD %s `%s` %s' % (
+              table_name, index_type, index_name,
+              ' '.join(index_columns.split())))
+        finally:
+          self.EndTransaction()
+        added['indexes'].append(u'%s.%s' % (table_name, index_name))
+
+    if( 'flat_records' in added['tables'] ):
+      self.StartTransaction()
+      try:
+        self.RebuildFlatRecords()
+      except:
+        self.EndTransaction(rollback=True)
+        raise
+      self.EndTransaction()
+    if( added['tables'] ):
+      config_snapshot_cache.Invalidate()
+    return added
 
   def DumpDatabase(self):
     """This will dump the entire database to memory.
 
     This would be done by mysqldump but it needs to be done in the same lock
-    as other processes. So this is a simple mysqldump function.
+    as other processes. So this is a simple mysqldump function. To write a
+    dump without holding it in memory use IterDumpTables.
 
     Outputs:
       Dictionary: Dictionary with keys of table name and schema/data for each
                   table as values.
     """
     table_data = {}
-    self.cursor_execute('SHOW TABLES')
-    table_names = self.cursor.fetchall()
-    self.cursor_execute('SET OPTION SQL_QUOTE_SHOW_CREATE=1')
-    for table_name in table_names:
-      table_name = table_name.values()[0]
-      table_data[table_name] = {}
-      self.cursor_execute('SHOW CREATE TABLE %s' % table_name)
-      table_data[table_name]['schema'] = self.cursor.fetchone()['Create Table']
-      self.cursor_execute('DESCRIBE %s' % table_name)
-      table_data[table_name]['columns'] = []
-      table_descriptions = self.cursor.fetchall()
-      for table_description in table_descriptions:
-        table_data[table_name]['columns'].append(table_description['Field'])
-      self.cursor_execute('SELECT %s FROM %s' % 
-                          (','.join(table_data[table_name]['columns']),
-                           table_name))
-      table_rows = self.cursor.fetchall()
-      table_data[table_name]['rows'] = []
-      for row in table_rows:
+    for table_name, schema, columns, rows in self.IterDumpTables():
+      table_data[table_name] = {'schema': schema, 'columns': columns,
+                                'rows': []}
+      for row in rows:
         row_dict = {}
-        for key, value in row.iteritems():
-          row_dict[key] = self.connection.literal(value)
-          if( isinstance(row_dict[key], str) ):
-            row_dict[key] = unicode(row_dict[key], 'utf-8')
-            
+        for column, value in zip(columns, row):
+          if( isinstance(value, str) ):
+            value = unicode(value, 'utf-8')
+          row_dict[column] = value
 
         table_data[table_name]['rows'].append(row_dict)
 
     return table_data
 
+  def IterDumpTables(self):
+    """Streams the entire database table by table.
+
+    Rows are read off a server side cursor, the rows of a table must be read
+    before the next table is taken.
+
+    Outputs:
+      generator of tuples of table name, string of CREATE TABLE statement,
+      list of column names and a generator of lists of the row's values
+      quoted for mysql, as utf-8 strings, in column order
+        example: (u'users', u'CREATE TABLE `users` (...',
+                  [u'users_id', u'user_name', u'access_level'],
+                  <generator of ['1', "'tree_export_user'", '0'], ...>)
+    """
+    self.cursor_execute('SHOW TABLES')
+    table_names = [row.values()[0] for row in self.cursor.fetchall()]
+    self.cursor_execute('SET OPTION SQL_QUOTE_SHOW_CREATE=1')
+    for table_name in table_names:
+      self.cursor_execute('SHOW CREATE TABLE %s' % table_name)
+      schema = self.cursor.fetchone()['Create Table']
+      self.cursor_execute('DESCRIBE %s' % table_name)
+      columns = [table_description['Field'] for table_description in
+                 self.cursor.fetchall()]
+      rows = self.StreamQuery('SELECT %s FROM %s' % (','.join(columns),
+                                                     table_name),
+                              {}, constants.ITER_ROW_CHUNK_SIZE,
+                              cursor_class=MySQLdb.cursors.SSCursor)
+      yield (table_name, schema, columns,
+             ([self.connection.literal(value) for value in row] for
+              row in rows))
+
   ### These functions are for the user class
-  def GetUserAuthorizationInfo(self, user):
+  def GetUserAuthorizationInfo(self, user, current_transaction=False):
     """Grabs authorization data from the db and returns a dict.
 
     This function does two selects on the db, one for forward and one for
@@ -904,6 +3420,8 @@ class dbAccess(object):
 
     Inputs:
       user: string of username
+      current_transaction: bool of if this function is run from inside a
+                           transaction
 
     Raises:
       UnexpectedDataError: Row did not contain
@@ -952,7 +3470,8 @@ class dbAccess(object):
     auth_info_dict['forward_zones'] = []
     auth_info_dict['reverse_ranges'] = []
 
-    self.StartTransaction()
+    if( not current_transaction ):
+      self.StartTransaction()
     try:
       db_data.extend(self.ListRow('users', users_dict,
                                   'groups', groups_dict,
@@ -982,7 +3501,8 @@ class dbAccess(object):
         else:
           return {}
     finally:
-      self.EndTransaction()
+      if( not current_transaction ):
+        self.EndTransaction()
 
 
     auth_info_dict['user_access_level'] = db_data[0]['access_level']
@@ -124,6 +124,8 @@ SCHEMA_FILE = """# Copyright (c) 2009, Purdue University
 
 ########### These are commands prepare the database for our tables ###########
 
+DROP TABLE IF EXISTS `ip_allocations`;
+DROP TABLE IF EXISTS `flat_records`;
 DROP TABLE IF EXISTS `ipv6_index`;
 DROP TABLE IF EXISTS `ipv4_index`;
 DROP TABLE IF EXISTS `audit_log`;
@@ -157,6 +159,7 @@ DROP TABLE IF EXISTS `record_arguments`;
 DROP TABLE IF EXISTS `data_types`;
 DROP TABLE IF EXISTS `record_types`;
 DROP TABLE IF EXISTS `locks`;
+DROP TABLE IF EXISTS `config_generation`;
 
 ########## Below is the database schema ##########
 
@@ -172,6 +175,17 @@ CREATE TABLE `locks` (
 
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
+# A single row counting changes to users, permissions, zones, views and
+# locks, see dbAccess.GetConfigSnapshot.
+CREATE TABLE `config_generation` (
+
+  `config_generation_id` tinyint unsigned NOT NULL auto_increment,
+  `config_generation` bigint unsigned NOT NULL,
+
+  PRIMARY KEY (`config_generation_id`)
+
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
 CREATE TABLE `record_types` (
 
   `record_types_id` smallint unsigned NOT NULL auto_increment,
@@ -708,6 +722,8 @@ CREATE TABLE `audit_log` (
   `audit_log_timestamp` timestamp NOT NULL default CURRENT_TIMESTAMP,
 
   PRIMARY KEY (`audit_log_id`),
+  INDEX `audit_log_timestamp_1` (`audit_log_timestamp`),
+  INDEX `action_success_1` (`action`, `success`, `audit_log_id`),
 
   CONSTRAINT `user_name_3` FOREIGN KEY (`audit_log_user_name`)
     REFERENCES `users` (`user_name`) ON UPDATE CASCADE
@@ -741,12 +757,61 @@ CREATE TABLE `ipv6_index` (
 
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
+# One row per record with a column per record argument, kept up to date with
+# record_arguments_records_assignments so records can be read without
+# pivoting their arguments. Arguments a record type does not have are NULL.
+CREATE TABLE `flat_records` (
+  `flat_records_record_id` mediumint unsigned NOT NULL,
+  `flat_records_type` varchar(8) NOT NULL,
+  `assignment_ip` varchar(39) default NULL,
+  `assignment_host` varchar(255) default NULL,
+  `hardware` varchar(255) default NULL,
+  `os` varchar(255) default NULL,
+  `quoted_text` varchar(255) default NULL,
+  `name_server` varchar(255) default NULL,
+  `admin_email` varchar(255) default NULL,
+  `serial_number` int unsigned default NULL,
+  `refresh_seconds` int unsigned default NULL,
+  `retry_seconds` int unsigned default NULL,
+  `expiry_seconds` int unsigned default NULL,
+  `minimum_seconds` int unsigned default NULL,
+  `priority` int unsigned default NULL,
+  `weight` int unsigned default NULL,
+  `port` int unsigned default NULL,
+  `mail_server` varchar(255) default NULL,
+
+  PRIMARY KEY (`flat_records_record_id`),
+  INDEX `flat_records_assignment_ip_1` (`assignment_ip`),
+  INDEX `flat_records_assignment_host_1` (`assignment_host`(15)),
+
+  CONSTRAINT `flat_records_record_id_1` FOREIGN KEY (`flat_records_record_id`,
+    `flat_records_type`) REFERENCES `records` (`records_id`, `record_type`)
+    ON DELETE CASCADE ON UPDATE CASCADE
+
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+# The next address to allocate in each cidr block. A block's row is locked
+# while its addresses are allocated so allocations in a block run one at a
+# time, and continue from where the last one stopped.
+CREATE TABLE `ip_allocations` (
+  `ip_allocation_cidr_block` varchar(43) NOT NULL,
+  `ip_allocation_next_upper` bigint unsigned NOT NULL,
+  `ip_allocation_next_lower` bigint unsigned NOT NULL,
+
+  PRIMARY KEY (`ip_allocation_cidr_block`)
+
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
 ##########
 # Things that are expected in the db that are not schema.
 ##########
 
 INSERT INTO locks (lock_name) VALUES ('db_lock_lock');
 INSERT INTO locks (lock_name) VALUES ('maintenance');
+# Starts from the time the database is made so a database that is made
+# again does not repeat the generations of the last one.
+INSERT INTO config_generation (config_generation) VALUES
+    (UNIX_TIMESTAMP() * 1000000);
 
 INSERT INTO view_dependencies (view_dependency) VALUES ('any');
 INSERT INTO zone_types (zone_type) VALUES ('master'),('slave'),('forward'),
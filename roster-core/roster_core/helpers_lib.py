@@ -35,9 +35,12 @@ __license__ = 'BSD'
 __version__ = '#TRUNK#'
 
 
+import functools
 import inspect
 import IPy
 import math
+import sys
+import threading
 import dns.zone
 
 import constants
@@ -45,9 +48,108 @@ import copy
 import errors
 
 
+# Stack of the AuditedMethod calls running in each thread, see
+# CallAuditedMethod.
+audited_calls = threading.local()
+
+
+def AuditedMethod(function):
+  """Decorates a method that calls GetFunctionNameAndArgs, so that its name
+  and arguments are kept when it is called instead of being looked up on
+  the stack.
+
+  The argument names of the method are read once, here. The method is
+  wrapped in a function made with the same arguments and defaults, so
+  inspect.getargspec, which the XML-RPC server dispatches calls with, gives
+  the same answer for both.
+
+  Inputs:
+    function: function of method to decorate
+
+  Outputs:
+    function: wrapped method
+  """
+  arg_names, varargs, keywords, defaults = inspect.getargspec(function)
+  default_values = iter(['=_defaults[%s]' % index for index in
+                         range(len(defaults or ()))])
+  signature = inspect.formatargspec(
+      arg_names, varargs, keywords, defaults,
+      formatvalue=lambda value: default_values.next())
+  call_args = inspect.formatargspec(arg_names, varargs, keywords)[1:-1]
+  audit_arg_names = [arg for arg in arg_names if arg != 'self']
+  # Names the wrapper uses start with an underscore so that they can not
+  # be hidden by argument names.
+  namespace = {'_defaults': defaults, '_call': CallAuditedMethod,
+               '_function': function, '_code': function.func_code,
+               '_function_name': unicode(function.__name__),
+               '_audit_arg_names': audit_arg_names}
+  exec ('def %s%s:\n'
+        '  return _call(_function, _code, _function_name, _audit_arg_names,\n'
+        '               [%s], %s)\n' % (
+            function.__name__, signature, ', '.join(audit_arg_names),
+            call_args)) in namespace
+  return functools.update_wrapper(namespace[function.__name__], function)
+
+
+def CallAuditedMethod(function, code, function_name, audit_arg_names,
+                      replay_args, *args, **kwargs):
+  """Calls a method decorated by AuditedMethod with its name and arguments
+  kept for GetFunctionNameAndArgs.
+
+  Inputs:
+    function: function of method
+    code: code object of method
+    function_name: unicode string of method name
+    audit_arg_names: list of argument names other than self
+    replay_args: list of values of audit_arg_names
+    args: arguments of call
+    kwargs: keyword arguments of call
+
+  Outputs:
+    return value of the method
+  """
+  current_args = {'audit_args': dict(zip(audit_arg_names, replay_args)),
+                  'replay_args': replay_args}
+  if( not hasattr(audited_calls, 'stack') ):
+    audited_calls.stack = []
+  audited_calls.stack.append({'code': code, 'function_name': function_name,
+                              'audit_arg_names': audit_arg_names,
+                              'current_args': current_args,
+                              'audit_log_id': None})
+  try:
+    return function(*args, **kwargs)
+  finally:
+    audited_calls.stack.pop()
+
+
+def GetAuditedCall(current_args=None):
+  """Gets the innermost AuditedMethod call running in this thread.
+
+  Inputs:
+    current_args: current args of the call to get, from
+                  GetFunctionNameAndArgs, None gets the innermost call
+
+  Outputs:
+    dict: dictionary of call, None if there is none
+      ex: {'code': code object of method, 'function_name': u'MakeUser',
+           'audit_arg_names': ['user_name', 'access_level'],
+           'current_args': {'replay_args': [...], 'audit_args': {...}},
+           'audit_log_id': int of audit log id once it is logged or None}
+  """
+  for audited_call in reversed(getattr(audited_calls, 'stack', [])):
+    if( current_args is None or audited_call['current_args'] is current_args ):
+      return audited_call
+  return None
+
+
 def GetFunctionNameAndArgs():
-  """Grabs the current frame and adjacent frames then finds the calling
-  function name and arguments and returns them.
+  """Finds the calling function name and arguments and returns them.
+
+  Methods decorated with AuditedMethod have their name and argument names
+  kept from when they were called, the frame of anything else is looked at.
+  Argument values are read from the frame in both cases, so arguments the
+  method set before calling this, such as a None default replaced with a
+  list, are logged as set.
 
   Outputs:
     tuple: function name and current args
@@ -55,20 +157,24 @@ def GetFunctionNameAndArgs():
                         'audit_args': {'access_level': 64,
                                        'user_name': u'ahoward'}}
   """
-  current_frame = inspect.currentframe()
+  calling_frame = sys._getframe(1)
   try:
-    outer_frames = inspect.getouterframes(current_frame)
-    try:
-      function_name = unicode(outer_frames[1][3])
-      calling_frame = outer_frames[1][0]
-      try:
-        arg_values = inspect.getargvalues(calling_frame)
-      finally:
-        del calling_frame
-    finally:
-      del outer_frames
+    stack = getattr(audited_calls, 'stack', None)
+    if( stack and stack[-1]['code'] is calling_frame.f_code ):
+      audited_call = stack[-1]
+      frame_locals = calling_frame.f_locals
+      current_args = audited_call['current_args']
+      # The kept args are updated in place, GetAuditedCall finds the call
+      # by them.
+      current_args['replay_args'][:] = [
+          frame_locals[arg] for arg in audited_call['audit_arg_names']]
+      current_args['audit_args'].update(zip(audited_call['audit_arg_names'],
+                                            current_args['replay_args']))
+      return audited_call['function_name'], current_args
+    function_name = unicode(calling_frame.f_code.co_name)
+    arg_values = inspect.getargvalues(calling_frame)
   finally:
-    del current_frame
+    del calling_frame
   replay_args = []
   audit_args = {}
   for arg in arg_values[0]:
@@ -192,7 +298,7 @@ def UnReverseIP(ip_address):
 
 
 def CIDRExpand(cidr_block, begin=None, end=None):
-  """Expands a cidr block to a list of ip addreses
+  """Expands a cidr block to a range of ip addreses
      from begin (integer) to end (integer).
 
   Inputs:
@@ -204,28 +310,162 @@ def CIDRExpand(cidr_block, begin=None, end=None):
     InvalidInputError: Not a valid CIDR block.
 
   Outputs:
-    list: list of ip addresses in strings
+    IPAddressRange: range of ip addresses, addresses are made into strings
+                    as they are read
   """
   try:
     cidr_block = IPy.IP(cidr_block)
   except ValueError:
     raise errors.InvalidInputError('%s is not a valid cidr block' % cidr_block)
-  ip_address_list = []
-  end_count = -1
-  length = cidr_block.len()
-  count = 0
-  start_ip = cidr_block.int()
-  if( begin ):
-    start_ip = cidr_block.int() + begin
-  if( begin and end ):
-    end_count = end - begin
-  elif( end ):
-    end_count = end
-  while( count != end_count and count != length and IPy.IP(start_ip + count) in cidr_block ):
-    ip_address_list.append(unicode(IPy.IP(start_ip + count).strFullsize()))
-    count += 1
-
-  return ip_address_list
+  ip_address_range = IPAddressRange(cidr_block.int(), cidr_block.len(),
+                                    cidr_block.version())
+  return ip_address_range[begin or None:end or None]
+
+
+def FormatIPAddress(address, ip_version):
+  """Formats an integer address the way IPy.IP.strFullsize does, without
+  making an IPy.IP.
+
+  Inputs:
+    address: int of ip address
+    ip_version: int of 4 or 6
+
+  Outputs:
+    unicode: string of ip address
+      example: u'192.168.0.1' or
+               u'4321:0000:0001:0002:0003:0004:0567:89ab'
+  """
+  if( ip_version == 4 ):
+    return u'%d.%d.%d.%d' % (address >> 24 & 255, address >> 16 & 255,
+                             address >> 8 & 255, address & 255)
+  return u':'.join([u'%04x' % (address >> shift & 0xffff) for shift in
+                    range(112, -1, -16)])
+
+
+class IPAddressRange(object):
+  """A range of ip addresses kept as integers. It can be sliced, indexed and
+  iterated like a list of ip address strings, each address is only made
+  into a string when it is read.
+
+  len() does not take ranges longer than the largest int, such as large
+  ipv6 blocks, the length attribute holds the length of any range and
+  truth testing works for any range."""
+  def __init__(self, first_address, length, ip_version, step=1):
+    """Sets up the range.
+
+    Inputs:
+      first_address: int of the first address of the range
+      length: int of the number of addresses in the range
+      ip_version: int of 4 or 6
+      step: int of the difference between addresses in the range
+    """
+    self.first_address = first_address
+    self.length = length
+    self.ip_version = ip_version
+    self.step = step
+
+  def __len__(self):
+    return self.length
+
+  def __nonzero__(self):
+    return self.length > 0
+
+  def __iter__(self):
+    # xrange does not take ipv6 sized ints.
+    count = 0
+    while( count < self.length ):
+      yield FormatIPAddress(self.first_address + count * self.step,
+                            self.ip_version)
+      count += 1
+
+  def __getitem__(self, index):
+    """Gets an address or a slice of the range.
+
+    Inputs:
+      index: int of index or slice object
+
+    Raises:
+      IndexError: Index out of range.
+      ValueError: Slice step cannot be zero.
+
+    Outputs:
+      unicode: string of ip address for an index
+      IPAddressRange: range of ip addresses for a slice
+    """
+    if( isinstance(index, slice) ):
+      step = index.step
+      if( step is None ):
+        step = 1
+      if( step == 0 ):
+        raise ValueError('Slice step cannot be zero.')
+      # Worked out like slice.indices, which does not take ipv6 sized ints.
+      if( step > 0 ):
+        lowest, highest = 0, self.length
+        defaults = (lowest, highest)
+      else:
+        lowest, highest = -1, self.length - 1
+        defaults = (highest, lowest)
+      bounds = []
+      for bound, default in zip((index.start, index.stop), defaults):
+        if( bound is None ):
+          bound = default
+        elif( bound < 0 ):
+          bound = max(bound + self.length, lowest)
+        else:
+          bound = min(bound, highest)
+        bounds.append(bound)
+      start, stop = bounds
+      if( step > 0 ):
+        length = max(0, (stop - start + step - 1) // step)
+      else:
+        length = max(0, (start - stop - step - 1) // -step)
+      return IPAddressRange(self.first_address + start * self.step, length,
+                            self.ip_version, self.step * step)
+    if( index < 0 ):
+      index += self.length
+    if( not 0 <= index < self.length ):
+      raise IndexError('Index out of range.')
+    return FormatIPAddress(self.first_address + index * self.step,
+                           self.ip_version)
+
+  def __eq__(self, other):
+    if( isinstance(other, (IPAddressRange, list, tuple)) ):
+      return list(self) == list(other)
+    return NotImplemented
+
+  def __ne__(self, other):
+    equal = self.__eq__(other)
+    if( equal is NotImplemented ):
+      return equal
+    return not equal
+
+  def __repr__(self):
+    return 'IPAddressRange(%s, %s, %s, step=%s)' % (
+        self.first_address, self.length, self.ip_version, self.step)
+
+
+def IterFreeAddressRanges(first_address, last_address, taken_addresses):
+  """Merges sorted taken addresses with a range of addresses to find the
+  ranges in between that are free.
+
+  Inputs:
+    first_address: int of the first address of the range
+    last_address: int of the last address of the range
+    taken_addresses: iterable of sorted unique ints of taken addresses in
+                     the range
+
+  Outputs:
+    generator of tuples of ints of the first and last address of each free
+    range
+      example: (3232235521, 3232235530)
+  """
+  next_free = first_address
+  for taken_address in taken_addresses:
+    if( taken_address > next_free ):
+      yield (next_free, taken_address - 1)
+    next_free = taken_address + 1
+  if( next_free <= last_address ):
+    yield (next_free, last_address)
 
 
 def ExpandIPV6(ip_address):
@@ -500,6 +740,171 @@ def GetRecordsFromRecordRowsAndArgumentRows(record_data, record_args_dict):
 
   return full_record_dicts.values()
 
+def GetRecordArgsFromFlatRecordRow(flat_record_row):
+  """Takes the record arguments out of a flat_records row.
+
+  Values are typed the same way as GetRecordsFromRecordRowsAndArgumentRows
+  types them, so that digit only strings are ints.
+
+  Inputs:
+    flat_record_row: row dict including the columns of flat_records
+
+  Outputs:
+    dict: dictionary of the record arguments the record has
+      example: {u'priority': 10, u'mail_server': u'smtp-01.university.edu.'}
+  """
+  record_args_dict = {}
+  for column_name in constants.TABLES['flat_records']:
+    if( column_name.startswith('flat_records_') ):
+      continue
+    argument_value = flat_record_row[column_name]
+    if( argument_value is None ):
+      continue
+    if( isinstance(argument_value, (int, long)) or argument_value.isdigit() ):
+      argument_value = int(argument_value)
+    record_args_dict[column_name] = argument_value
+  return record_args_dict
+
+def RecordArgsMatch(record_args_dict, search_args_dict):
+  """Checks if a record has every argument value that is searched on.
+
+  Values are compared as unicode strings, the same way they are stored.
+
+  Inputs:
+    record_args_dict: dictionary of the record arguments of a record
+    search_args_dict: dictionary of argument values keyed by argument name,
+                      None values are not searched on
+
+  Outputs:
+    bool: if the record has every argument value
+  """
+  for argument_name, argument_value in search_args_dict.iteritems():
+    if( argument_value is None ):
+      continue
+    if( argument_name not in record_args_dict or
+        unicode(record_args_dict[argument_name]) != unicode(argument_value) ):
+      return False
+  return True
+
+def GetRecordsFromFlatRecordRows(record_data, record_args_dict):
+  """Takes data from joined records and flat_records and creates record
+  dictionaries.
+
+  Inputs:
+    record_data: iterable of rows from ListRow or IterRow with records and
+                 flat_records joined.
+    record_args_dict: dictionary of record arguments, records that have a
+                      different value for an argument that is not None are
+                      left out.
+
+  Outputs:
+    list of record dictionaries
+      see GetRecordsFromRecordRowsAndArgumentRows
+  """
+  full_record_dicts = {}
+  for record in record_data:
+    record_dict = GetRecordArgsFromFlatRecordRow(record)
+    for argument_name, argument_value in record_args_dict.iteritems():
+      if( argument_value is not None and
+          unicode(argument_value) != unicode(record[argument_name]) ):
+        break
+    else:
+      record_dict['record_type'] = record['record_type']
+      record_dict['zone_name'] = record['record_zone_name']
+      if( record['record_view_dependency'].endswith('_dep') ):
+        record_dict['view_name'] = record['record_view_dependency'][:-4:]
+      else:
+        record_dict['view_name'] = record['record_view_dependency']
+      record_dict['target'] = record['record_target']
+      record_dict['ttl'] = record['record_ttl']
+      record_dict['last_user'] = record['record_last_user']
+      full_record_dicts[record['records_id']] = record_dict
+
+  return full_record_dicts.values()
+
+def GetRecordsByIPFromRecordRows(record_rows):
+  """Takes rows from ListRow or IterRow of records joined with an ip index,
+  zones, zone_view_assignments and flat_records and
+  groups them by view and IP address.
+
+  Inputs:
+    record_rows: iterable of joined row dicts
+
+  Raises:
+    IPIndexError: Record type not indexable by IP
+    IPIndexError: Record type unknown. Missing ipv4 or ipv6 dec index
+
+  Outputs:
+    dict: A dictionary keyed by view, keyed by IP, listed by record.
+          see CoreHelpers.ListRecordsByCIDRBlock
+  """
+  parsed_record_dict = {}
+  for record_entry in record_rows:
+    if( record_entry[u'record_type'] not in
+        constants.RECORD_TYPES_INDEXED_BY_IP ):
+      raise errors.IPIndexError('Record type not indexable by '
+                                'IP: %s' % record_entry)
+    if( record_entry[u'record_view_dependency'].endswith('_dep') ):
+      record_view = record_entry[u'record_view_dependency'][:-4]
+    else:
+      record_view = record_entry[u'record_view_dependency']
+    if( record_view not in parsed_record_dict ):
+      parsed_record_dict[record_view] = {}
+    if( u'ipv4_dec_address' in record_entry ):
+      record_ip = u'%s' % (
+          IPy.IP(record_entry[u'ipv4_dec_address']).strNormal(1))
+      if( record_ip not in parsed_record_dict[record_view] ):
+        parsed_record_dict[record_view][record_ip] = []
+    elif( u'ipv6_dec_upper' in record_entry ):
+      decimal_ip = (
+          (record_entry[u'ipv6_dec_upper'] << 64) +
+          (record_entry[u'ipv6_dec_lower']) )
+      record_ip = u'%s' % IPy.IP(decimal_ip).strFullsize(0)
+      if( record_ip not in parsed_record_dict[record_view] ):
+        parsed_record_dict[record_view][record_ip] = []
+    else:
+      raise errors.IPIndexError(
+          'Record type unknown. Missing ipv4 or ipv6 dec index: %s' % (
+          record_entry))
+    record_item = {}
+    record_item['records_id'] = record_entry['records_id']
+    record_item['record_type'] = record_entry['record_type']
+    record_item['record_target'] = record_entry['record_target']
+    record_item['record_ttl'] = record_entry['record_ttl']
+    record_item['record_zone_name'] = record_entry['record_zone_name']
+    record_item[u'zone_origin'] = record_entry[u'zone_origin']
+    record_item['record_view_dependency'] = record_entry[
+        'record_view_dependency']
+    #record_item['record_last_updated'] = record_entry['record_last_updated']
+    record_item['record_last_user'] = record_entry['record_last_user']
+    if record_entry[u'record_view_dependency'].endswith('_dep'):
+      record_item[u'view_name'] = record_entry[u'record_view_dependency'][:-4]
+    else:
+      record_item[u'view_name'] = record_entry[u'record_view_dependency']
+    if( record_entry[u'record_type'] == u'a' or
+        record_entry[u'record_type'] == u'aaaa' ):
+      record_item[u'forward'] = True
+      record_item[u'host'] = '%s.%s' % (
+          record_entry[u'record_target'],
+          record_entry[u'zone_origin'][:-1])
+      record_item[u'zone_origin'] = record_entry['zone_origin']
+      record_item[u'record_target'] = record_entry['record_target']
+      record_item[u'record_args_dict'] = {
+          'assignment_ip': record_entry['assignment_ip']}
+      parsed_record_dict[record_view][record_ip].append( record_item )
+    elif( record_entry[u'record_type'] == u'ptr' ):
+      record_item[u'zone_origin'] = record_entry['zone_origin']
+      record_item[u'record_target'] = record_entry['record_target']
+      record_item[u'forward'] = False
+      record_item[u'host'] = record_entry[u'assignment_host'][:-1]
+      assignment_ip = UnReverseIP(
+          '%s.%s' % (
+              record_entry['record_target'],record_entry['zone_origin']))
+      record_item[u'record_args_dict'] = {'assignment_ip': assignment_ip}
+      parsed_record_dict[record_view][record_ip].insert(0, record_item )
+
+  return parsed_record_dict
+
 def UnicodeString(string):
   """Returns unicode string if object is a string
 
@@ -39,12 +39,81 @@ __license__ = 'BSD'
 __version__ = '#TRUNK#'
 
 
+import bisect
 import IPy
 
 import constants
 import errors
 import helpers_lib
 
+
+class ReverseRangeIndex(object):
+  """Reverse range permissions indexed by address.
+
+  Each range is kept in a dictionary keyed by its prefix length and network
+  address, so the ranges containing an address are found with one lookup
+  per prefix length in use. First addresses of the ranges are also kept
+  sorted so ranges inside a block are found with a bisection.
+  """
+  def __init__(self, reverse_ranges):
+    """Builds the index.
+
+    Inputs:
+      reverse_ranges: list of dictionaries of cidr_block and group_permission
+                      see User.GetPermissions
+    """
+    self.group_permissions = {4: {}, 6: {}}
+    self.first_addresses = {4: [], 6: []}
+    for reverse_range in reverse_ranges:
+      cidr_block = IPy.IP(reverse_range['cidr_block'])
+      version = cidr_block.version()
+      prefix_length = cidr_block.prefixlen()
+      networks = self.group_permissions[version].setdefault(prefix_length, {})
+      network = cidr_block.int() >> (cidr_block.len().bit_length() - 1)
+      networks.setdefault(network, []).append(
+          reverse_range['group_permission'])
+      self.first_addresses[version].append(cidr_block.int())
+    for version in self.first_addresses:
+      self.first_addresses[version].sort()
+
+  def ListGroupPermissions(self, ip_address):
+    """Lists the group permissions of the ranges containing an address.
+
+    Inputs:
+      ip_address: IPy.IP of ip address or cidr block
+
+    Outputs:
+      list: list of group permissions
+    """
+    group_permissions = []
+    version = ip_address.version()
+    host_bits = ip_address.len().bit_length() - 1
+    for prefix_length, networks in self.group_permissions[version].iteritems():
+      if( prefix_length > ip_address.prefixlen() ):
+        continue
+      network = ip_address.int() >> (host_bits + ip_address.prefixlen() -
+                                     prefix_length)
+      group_permissions.extend(networks.get(network, []))
+    return group_permissions
+
+  def Overlaps(self, ip_address):
+    """Checks if any range overlaps an address, the way IPy.IP.overlaps
+    does.
+
+    Inputs:
+      ip_address: IPy.IP of ip address or cidr block
+
+    Outputs:
+      bool: if a range overlaps the address
+    """
+    first_addresses = self.first_addresses[ip_address.version()]
+    index = bisect.bisect_left(first_addresses, ip_address.int())
+    if( index < len(first_addresses) and first_addresses[index] <
+        ip_address.int() + ip_address.len() ):
+      return True
+    return bool(self.ListGroupPermissions(ip_address))
+
+
 class User(object):
   """Representation of a user, with basic manipulation methods.
   Note that is it not necessary to authenticate a user to construct this
@@ -64,9 +133,20 @@ class User(object):
     self.db_instance = db_instance
     self.log_instance = log_instance
     self.zone_origin_cache = {}
+    # Zone names keyed by origin, for each origin in zone_origin_cache.
+    self.origin_zones = {}
 
-    # pull a pile of authentication info from the database here
-    self.user_perms = self.db_instance.GetUserAuthorizationInfo(user_name)
+    # pull a pile of authentication info from the config snapshot here
+    self.db_instance.StartTransaction()
+    try:
+      config_snapshot = self.db_instance.GetConfigSnapshot()
+      self.user_perms = config_snapshot.GetUserAuthorizationInfo(user_name)
+      if( self.user_perms is None ):
+        self.user_perms = self.db_instance.GetUserAuthorizationInfo(
+            user_name, current_transaction=True)
+        config_snapshot.SetUserAuthorizationInfo(user_name, self.user_perms)
+    finally:
+      self.db_instance.EndTransaction()
     if( not self.user_perms.has_key('user_name') ):
       raise errors.InvalidInputError("No such user: %s" % user_name)
 
@@ -76,16 +156,20 @@ class User(object):
     self.reverse_ranges = self.user_perms['reverse_ranges']
     self.user_access_level = ual = self.user_perms['user_access_level']
 
+    # Permissions are indexed once here so records are authorized without
+    # walking every forward zone and reverse range.
+    self.forward_zone_permissions = {}
+    for zone in self.forward_zones:
+      self.forward_zone_permissions.setdefault(zone['zone_name'], []).append(
+          zone['group_permission'])
+    self.reverse_range_index = ReverseRangeIndex(self.reverse_ranges)
+
     # Pull zone origins for cache
-    self.db_instance.StartTransaction()
-    try:
-      all_zone_origins = self.db_instance.GetZoneOrigins(None, None)
-      for zone in self.forward_zones:
-        if( zone['zone_name'] in all_zone_origins ):
-          self.zone_origin_cache[
-              zone['zone_name']] = all_zone_origins[zone['zone_name']]
-    finally:
-      self.db_instance.EndTransaction()
+    all_zone_origins = config_snapshot.GetZoneOrigins(None, None)
+    for zone in self.forward_zones:
+      if( zone['zone_name'] in all_zone_origins ):
+        self._CacheZoneOrigins(zone['zone_name'],
+                               all_zone_origins[zone['zone_name']])
 
     # Build a hash of methods, using the supported_method hash
     self.abilities = {}
@@ -93,6 +177,7 @@ class User(object):
       if( constants.SUPPORTED_METHODS[method]['access_level'] <= ual ):
         self.abilities[method] = constants.SUPPORTED_METHODS[method]
 
+  @helpers_lib.AuditedMethod
   def Authorize(self, method, record_data=None, current_transaction=False):
     """Check to see if the user is authorized to run the given operation.
 
@@ -121,28 +206,128 @@ class User(object):
     if( not current_transaction ):
       self.db_instance.StartTransaction()
     try:
-      maintenance_mode = self.db_instance.CheckMaintenanceFlag()
-      if( record_data and record_data.has_key('zone_name') ):
-        if( record_data['zone_name'] ):
-          pulled_origin = self.db_instance.GetZoneOrigins(
-              record_data['zone_name'], record_data['view_name'])
-
-          #Making sure we pulled something that exists
-          if( pulled_origin is not None ):
-            self.zone_origin_cache[record_data['zone_name']] = pulled_origin[
-                record_data['zone_name']]
-          else:
-            view_name = record_data['view_name']
-            if( view_name.endswith('_dep') ):
-              view_name = view_name[:-4] #Strip off '_dep'
+      config_snapshot = self.db_instance.GetConfigSnapshot()
+    finally:
+      if( not current_transaction ):
+        self.db_instance.EndTransaction()
+    maintenance_mode = config_snapshot.maintenance_flag
+    if( record_data and record_data.has_key('zone_name') ):
+      if( record_data['zone_name'] ):
+        self._CacheZoneOrigins(record_data['zone_name'],
+                               self._GetZoneOrigins(
+                                   config_snapshot, record_data['zone_name'],
+                                   record_data['view_name']))
+
+    self._CheckAuthorization(method, record_data, maintenance_mode,
+                             function_name, current_args, current_transaction)
+
+  def AuthorizeRecords(self, method, records_data, current_transaction=False):
+    """Check to see if the user is authorized to run the given operation on
+    many records.
 
-            raise errors.UnexpectedDataError('Specified zone-view assignment '
-                'does not exist for zone %s view %s' % (
-                    record_data['zone_name'], view_name))
+    The config snapshot is read once, then every record is checked the
+    same way Authorize checks one.
+
+    Inputs:
+      method:	what the user's trying to do
+      records_data: list of record_data dictionaries, see Authorize
+      current_transaction: bool of if this function is run from inside a
+                           transaction in the db_access class
+
+    Raises:
+      MaintenanceError: Roster is currently under maintenance.
+      MissingDataTypeError: Incomplete record data provided for access method.
+      AuthorizationError: Authorization failure.
+    """
+    if( not current_transaction ):
+      self.db_instance.StartTransaction()
+    try:
+      config_snapshot = self.db_instance.GetConfigSnapshot()
     finally:
       if( not current_transaction ):
         self.db_instance.EndTransaction()
+    maintenance_mode = config_snapshot.maintenance_flag
+    zone_origins = {}
+    for record_data in records_data:
+      zone_view = (record_data.get('zone_name'), record_data.get('view_name'))
+      if( zone_view[0] and zone_view not in zone_origins ):
+        zone_origins[zone_view] = self._GetZoneOrigins(config_snapshot,
+                                                       *zone_view)
+
+    for record_data in records_data:
+      zone_view = (record_data.get('zone_name'), record_data.get('view_name'))
+      if( zone_view in zone_origins ):
+        self._CacheZoneOrigins(zone_view[0], zone_origins[zone_view])
+      # Failures are logged the same way as a call to Authorize.
+      current_args = {'audit_args': {'method': method,
+                                     'record_data': record_data,
+                                     'current_transaction':
+                                         current_transaction},
+                      'replay_args': [method, record_data,
+                                      current_transaction]}
+      self._CheckAuthorization(method, record_data, maintenance_mode,
+                               u'Authorize', current_args,
+                               current_transaction)
+
+  def _GetZoneOrigins(self, config_snapshot, zone_name, view_name):
+    """Gets the origins of a zone in a view.
+
+    Inputs:
+      config_snapshot: ConfigSnapshot from dbAccess.GetConfigSnapshot
+      zone_name: string of zone name
+      view_name: string of view dependency
+
+    Raises:
+      UnexpectedDataError: Specified zone-view assignment does not exist.
+
+    Outputs:
+      list: list of zone origin strings
+    """
+    pulled_origin = config_snapshot.GetZoneOrigins(zone_name, view_name)
+
+    #Making sure we pulled something that exists
+    if( pulled_origin is None ):
+      if( view_name.endswith('_dep') ):
+        view_name = view_name[:-4] #Strip off '_dep'
+
+      raise errors.UnexpectedDataError('Specified zone-view assignment '
+          'does not exist for zone %s view %s' % (zone_name, view_name))
+    return pulled_origin[zone_name]
 
+  def _CacheZoneOrigins(self, zone_name, zone_origins):
+    """Puts the origins of a zone in the zone origin cache.
+
+    Inputs:
+      zone_name: string of zone name
+      zone_origins: list of zone origin strings
+    """
+    for origin in self.zone_origin_cache.get(zone_name, []):
+      self.origin_zones[origin].discard(zone_name)
+      if( not self.origin_zones[origin] ):
+        del self.origin_zones[origin]
+    self.zone_origin_cache[zone_name] = zone_origins
+    for origin in zone_origins:
+      self.origin_zones.setdefault(origin, set()).add(zone_name)
+
+  def _CheckAuthorization(self, method, record_data, maintenance_mode,
+                          function_name, current_args, current_transaction):
+    """Checks a record against the permissions of the user, zone origins
+    have to be in the zone origin cache already.
+
+    Inputs:
+      method: what the user's trying to do
+      record_data: dictionary of record data, see Authorize
+      maintenance_mode: bool of if roster is under maintenance
+      function_name: string of function name to log failures with
+      current_args: dictionary of args to log failures with
+      current_transaction: bool of if this function is run from inside a
+                           transaction in the db_access class
+
+    Raises:
+      MaintenanceError: Roster is currently under maintenance.
+      MissingDataTypeError: Incomplete record data provided for access method.
+      AuthorizationError: Authorization failure.
+    """
     if( maintenance_mode and self.user_perms['user_access_level']
         != constants.ACCESS_LEVELS['dns_admin'] ):
       raise errors.MaintenanceError('Roster is currently under maintenance.')
@@ -167,18 +352,17 @@ class User(object):
                 origin))
 
           #Looking for permissions in the forward zones
-          for zone in self.user_perms['forward_zones']:
-            if( zone['zone_name'] == record_data['zone_name'] ):
-              user_group_perms[origin].append(zone['group_permission'])
+          user_group_perms[origin].extend(self.forward_zone_permissions.get(
+              record_data['zone_name'], []))
 
           #If we haven't found any, look in the reverse ranges
           if( user_group_perms[origin] == [] ):
             validation_instance = self.db_instance.data_validation_instance
             if( validation_instance.isIPv4IPAddress(ip_address) or
                 validation_instance.isIPv6IPAddress(ip_address) ):
-              for cidr in self.user_perms['reverse_ranges']:
-                if( IPy.IP(cidr['cidr_block']).overlaps(ip_address) ):
-                  user_group_perms[origin].append(cidr['group_permission'])
+              user_group_perms[origin].extend(
+                  self.reverse_range_index.ListGroupPermissions(
+                      IPy.IP(ip_address)))
     else:
       target_string = ''
     auth_fail_string = ('User %s is not allowed to use %s%s' %
@@ -227,10 +411,7 @@ class User(object):
           # if a or aaaa
           if( record_data['record_args_dict'].has_key(u'assignment_ip') ):
             ip = IPy.IP(record_data['record_args_dict'][u'assignment_ip'])
-            for reverse_range in self.reverse_ranges:
-              if( IPy.IP(reverse_range['cidr_block']).overlaps(ip) ):
-                break
-            else:
+            if( not self.reverse_range_index.Overlaps(ip) ):
               raise errors.AuthorizationError(auth_fail_string)
 
           # if cname, mx, ns, or ptr
@@ -246,46 +427,32 @@ class User(object):
               hostname = record_data['record_args_dict'][u'name_server']
             smallest_zone = hostname
 
-            found = False
-            while( smallest_zone ):
-              for domain in self.zone_origin_cache:
-                for origin in self.zone_origin_cache[domain]:
-                  if( smallest_zone == origin ):
-                    found = True
-              if( not found ):
-                try:
-                  smallest_zone = smallest_zone.split('.', 1)[1]
-                except IndexError:
-                  break
-              else:
+            # Labels are taken off the front of the hostname until it is a
+            # cached origin.
+            while( smallest_zone and smallest_zone not in self.origin_zones ):
+              try:
+                smallest_zone = smallest_zone.split('.', 1)[1]
+              except IndexError:
                 break
-            if( not found ):
+            if( smallest_zone not in self.origin_zones ):
               raise errors.AuthorizationError(auth_fail_string)
 
-            for zone in self.forward_zones:
-              if( self.zone_origin_cache.has_key(zone['zone_name']) ):
-                found = False
-                for origin in self.zone_origin_cache[zone['zone_name']]:
-                  if( smallest_zone == origin ):
-                    found = True
-                    break
-                if( found ):
-                  break
+            for zone_name in self.origin_zones[smallest_zone]:
+              if( zone_name in self.forward_zone_permissions ):
+                break
             else:
               raise errors.AuthorizationError(auth_fail_string)
 
-        for forward_zone in self.forward_zones:
-          if( record_data['zone_name'] == forward_zone['zone_name'] ):
-            return
+        if( record_data['zone_name'] in self.forward_zone_permissions ):
+          return
 
         # Can't find it in forward zones, maybe it's a reverse
         try:
           ip = IPy.IP(ip_address)
 
           # Good, we have an IP.  See if we hit any delegated ranges.
-          for reverse_range in self.reverse_ranges:
-            if( IPy.IP(reverse_range['cidr_block']).overlaps(ip) ):
-              return
+          if( self.reverse_range_index.Overlaps(ip) ):
+            return
 
           # fail to find a matching IP range with appropriate perms
           self.log_instance.LogAction(self.user_name, function_name,
@@ -65,6 +65,7 @@ setup(name='RosterCore',
                    'Operating System :: Unix',
                    'Programming Language :: Python :: 2.5',
                    'Topic :: Internet :: Name Service (DNS)'],
-      scripts = ['scripts/roster_database_bootstrap'],
+      scripts = ['scripts/roster_database_bootstrap',
+                 'scripts/roster_database_upgrade'],
       install_requires = ['IPy>=0.62', 'MySQL-python>=1.2.2', 'iscpy>=1.05']
      )
@@ -43,11 +43,17 @@ __version__ = '#TRUNK#'
 import cPickle
 import datetime
 import os
+import shutil
 import time
 import unicodedata
 import unittest
 
+import MySQLdb
+
 from roster_core import audit_log
+from roster_core import constants
+from roster_core import errors
+from roster_core import helpers_lib
 
 import roster_core
 
@@ -56,6 +62,7 @@ CONFIG_FILE = 'test_data/roster.conf' # Example in test_data
 SCHEMA_FILE = '../roster-core/data/database_schema.sql'
 DATA_FILE = 'test_data/test_data.sql'
 TEMP_LOG = 'temp_log'
+ARCHIVE_DIR = 'temp_audit_log_archive'
 # Change SYSLOG according to your distribution and specific version
 SYSLOG = ['/var/log/messages', '/var/log/syslog']
 
@@ -164,6 +171,168 @@ class TestAuditLog(unittest.TestCase):
         self.db_instance.EndTransaction()
 
 
+  def testLogActionDurability(self):
+    self.assertRaises(errors.ConfigError, audit_log.AuditLog,
+                      db_instance=self.db_instance, durability='never')
+    data = {'audit_args': {'user_name': u'ahoward', 'access_level': 64},
+            'replay_args': [u'ahoward', 64]}
+
+    group_commit_log = audit_log.AuditLog(log_to_db=True,
+                                          db_instance=self.db_instance,
+                                          durability='group_commit')
+    self.assertEqual(group_commit_log.LogAction(u'sharrell', u'MakeUser',
+                                                data, True), 1)
+    self.assertEqual(group_commit_log.LogAction(u'sharrell', u'MakeUser',
+                                                data, False), 2)
+
+    async_log = audit_log.AuditLog(log_to_db=True,
+                                   db_instance=self.db_instance,
+                                   durability='async')
+    for index in range(10):
+      self.assertEqual(async_log.LogAction(u'sharrell', u'MakeUser', data,
+                                           True), None)
+    audit_log.GetAuditLogWriter(self.db_instance, False, False, None).Flush()
+    self.db_instance.StartTransaction()
+    try:
+      self.assertEqual(async_log.LogAction(u'sharrell', u'MakeUser', data,
+                                           True, current_transaction=True),
+                       13)
+    finally:
+      self.db_instance.EndTransaction(rollback=True)
+
+    audit_log_dict = self.db_instance.GetEmptyRowDict('audit_log')
+    self.db_instance.StartTransaction()
+    try:
+      audit_rows = self.db_instance.ListRow('audit_log', audit_log_dict)
+    finally:
+      self.db_instance.EndTransaction()
+    self.assertEqual([row['audit_log_id'] for row in audit_rows],
+                     range(1, 13))
+    self.assertEqual([row['success'] for row in audit_rows[:2]], [1, 0])
+    for audit_row in audit_rows:
+      self.assertEqual(cPickle.loads(str(audit_row['data'])), data)
+
+  def testLogCommittedAction(self):
+    log_instance = audit_log.AuditLog(log_to_db=True,
+                                      db_instance=self.db_instance)
+    self.db_instance.SetAuditLog(log_instance, u'sharrell')
+
+    def MakeUser(user_name, access_level):
+      function_name, current_args = helpers_lib.GetFunctionNameAndArgs()
+      self.db_instance.StartTransaction()
+      try:
+        self.db_instance.MakeRow('users', {'user_name': user_name,
+                                           'access_level': access_level})
+      except:
+        self.db_instance.EndTransaction(rollback=True)
+        raise
+      self.db_instance.EndTransaction()
+      return log_instance.LogAction(u'sharrell', function_name, current_args,
+                                    True)
+    make_user = helpers_lib.AuditedMethod(MakeUser)
+
+    # The row is written by the commit, LogAction does not write it again.
+    self.assertEqual(make_user(u'new_user', 64), 1)
+    self.assertRaises(MySQLdb.IntegrityError, make_user, u'new_user', 64)
+
+    audit_log_dict = self.db_instance.GetEmptyRowDict('audit_log')
+    self.db_instance.StartTransaction()
+    try:
+      audit_rows = self.db_instance.ListRow('audit_log', audit_log_dict)
+    finally:
+      self.db_instance.EndTransaction()
+    self.assertEqual(len(audit_rows), 1)
+    self.assertEqual(audit_rows[0]['action'], u'MakeUser')
+    self.assertEqual(audit_rows[0]['success'], 1)
+    self.assertEqual(cPickle.loads(str(audit_rows[0]['data'])),
+                     {'replay_args': [u'new_user', 64],
+                      'audit_args': {'user_name': u'new_user',
+                                     'access_level': 64}})
+
+  def testAuditLogArchive(self):
+    data = {'audit_args': {'user_name': u'ahoward', 'access_level': 64},
+            'replay_args': [u'ahoward', 64]}
+    for day in [1, 1, 2, 3]:
+      self.audit_log_instance._LogToDatabase(
+          u'sharrell', u'MakeUser', data, True,
+          datetime.datetime(2009, 4, day, 10, 46, 50), False)
+    export_data = {'audit_args': {'force': False, 'snapshot_audit_log_id': 3},
+                   'replay_args': [False]}
+    self.audit_log_instance._LogToDatabase(
+        u'tree_export_user', u'ExportAllBindTrees', export_data, True,
+        datetime.datetime(2009, 4, 3, 11, 0, 0), False)
+
+    self.db_instance.StartTransaction()
+    try:
+      self.assertEqual(self.db_instance.GetLastExportAuditLogId(), 5)
+      self.assertEqual(
+          self.db_instance.GetLastExportSnapshotAuditLogId(), 3)
+      self.assertFalse(self.db_instance.CheckAuditLogChanges(5, 5))
+      self.assertTrue(self.db_instance.CheckAuditLogChanges(3, 5))
+    finally:
+      self.db_instance.EndTransaction()
+
+    archive = audit_log.AuditLogArchive(ARCHIVE_DIR)
+    try:
+      self.assertEqual(archive.ArchiveAuditLog(self.db_instance), 3)
+      self.assertEqual(archive.ArchiveAuditLog(self.db_instance), 0)
+      self.assertEqual(sorted(os.listdir(ARCHIVE_DIR)),
+                       ['audit_log-2009-04-01-1-2.bz2',
+                        'audit_log-2009-04-02-3-3.bz2'])
+
+      audit_log_dict = self.db_instance.GetEmptyRowDict('audit_log')
+      self.db_instance.StartTransaction()
+      try:
+        audit_rows = self.db_instance.ListRow('audit_log', audit_log_dict)
+      finally:
+        self.db_instance.EndTransaction()
+      self.assertEqual([row['audit_log_id'] for row in audit_rows], [4, 5])
+
+      archived_rows = archive.ListRows()
+      self.assertEqual([row['audit_log_id'] for row in archived_rows],
+                       [1, 2, 3])
+      self.assertEqual(cPickle.loads(str(archived_rows[0]['data'])), data)
+      self.assertEqual(archived_rows[2]['audit_log_timestamp'],
+                       datetime.datetime(2009, 4, 2, 10, 46, 50))
+      self.assertEqual([row['audit_log_id'] for row in archive.ListRows(
+          begin_timestamp=datetime.datetime(2009, 4, 1, 12, 0, 0),
+          end_timestamp=datetime.datetime(2009, 4, 5, 0, 0, 0))], [3])
+      self.assertEqual([row['audit_log_id'] for row in archive.ListRows(
+          begin_audit_log_id=2, end_audit_log_id=2)], [2])
+      audit_log_dict['audit_log_user_name'] = u'ahoward'
+      self.assertEqual(archive.ListRows(audit_log_dict), [])
+
+      # Rows written to the archive again are only kept once.
+      archive.WriteRows(datetime.date(2009, 4, 1), archived_rows[:1])
+      self.assertEqual([row['audit_log_id'] for row in archive.ListRows()],
+                       [1, 2, 3])
+
+      # Rows that come after their day was closed, across small chunks, go
+      # into the existing day files.
+      for day in [4, 1, 4]:
+        self.audit_log_instance._LogToDatabase(
+            u'sharrell', u'MakeUser', data, True,
+            datetime.datetime(2009, 4, day, 10, 46, 50), False)
+      export_data['audit_args']['snapshot_audit_log_id'] = 8
+      self.audit_log_instance._LogToDatabase(
+          u'tree_export_user', u'ExportAllBindTrees', export_data, True,
+          datetime.datetime(2009, 4, 4, 11, 0, 0), False)
+      chunk_size = constants.AUDIT_LOG_ARCHIVE_CHUNK_SIZE
+      constants.AUDIT_LOG_ARCHIVE_CHUNK_SIZE = 2
+      try:
+        self.assertEqual(archive.ArchiveAuditLog(self.db_instance), 5)
+      finally:
+        constants.AUDIT_LOG_ARCHIVE_CHUNK_SIZE = chunk_size
+      self.assertEqual(sorted(os.listdir(ARCHIVE_DIR)),
+                       ['audit_log-2009-04-01-1-7.bz2',
+                        'audit_log-2009-04-02-3-3.bz2',
+                        'audit_log-2009-04-03-4-5.bz2',
+                        'audit_log-2009-04-04-6-8.bz2'])
+      self.assertEqual([row['audit_log_id'] for row in archive.ListRows()],
+                       range(1, 9))
+    finally:
+      shutil.rmtree(ARCHIVE_DIR, ignore_errors=True)
+
   def testLogToFile(self):
     current_time = time.time()
     unittest_string = 'unittest %s' % current_time
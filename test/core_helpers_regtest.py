@@ -1275,6 +1275,11 @@ class TestCoreHelpers(unittest.TestCase):
     self.assertEqual(self.core_helper_instance.ListAvailableIpsInCIDR(
         '192.168.0.0/29', num_ips=4), ['192.168.0.0','192.168.0.2', 
                                        '192.168.0.3','192.168.0.4'])
+    self.assertEqual(self.core_helper_instance.ListAvailableIpsInCIDR(
+        '192.168.0.0/29', num_ips=2, offset=1), ['192.168.0.2',
+                                                 '192.168.0.3'])
+    self.assertEqual(self.core_helper_instance.ListAvailableIpsInCIDR(
+        '192.168.0.0/29', num_ips=0), [])
     self.assertRaises(errors.CoreError,
          self.core_helper_instance.ListAvailableIpsInCIDR,
         '240.0.0.0/24', num_ips=10)
@@ -1306,6 +1311,59 @@ class TestCoreHelpers(unittest.TestCase):
          '2001:0400:0000:0000:0000:0000:0000:0008',
          '2001:0400:0000:0000:0000:0000:0000:0009'])
 
+  def testAllocateHosts(self):
+    self.core_instance.MakeReverseRangeZoneAssignment(u'reverse_zone',
+                                                      u'192.168.1.0/24')
+    # 192.168.1.8, 192.168.1.10 and 192.168.1.11 are taken in setUp, and
+    # 192.168.1.8 and 192.168.1.15 are the network and broadcast addresses.
+    self.assertEqual(self.core_helper_instance.AllocateHosts(
+        u'192.168.1.8/29', [u'alloc1', u'alloc2', u'alloc3'], u'test_view',
+        u'forward_zone'), [u'192.168.1.9', u'192.168.1.12', u'192.168.1.13'])
+    a_records = self.core_instance.ListRecords(record_type=u'a',
+                                               target=u'alloc2')
+    self.assertEqual(len(a_records), 1)
+    self.assertEqual(a_records[0]['assignment_ip'], u'192.168.1.12')
+    ptr_records = self.core_instance.ListRecords(record_type=u'ptr',
+                                                 target=u'9',
+                                                 zone_name=u'reverse_zone')
+    self.assertEqual(len(ptr_records), 1)
+    self.assertEqual(ptr_records[0]['assignment_host'],
+                     u'alloc1.university.lcl.')
+    self.assertRaises(errors.InvalidInputError,
+                      self.core_helper_instance.AllocateHosts,
+                      u'192.168.1.8/29', [u'alloc4', u'alloc5'], u'test_view',
+                      u'forward_zone')
+    self.assertEqual(self.core_instance.ListRecords(target=u'alloc4'), [])
+    # An overlapping block skips the addresses allocated in the first one,
+    # 192.168.1.5 and 192.168.1.7 are also taken in setUp.
+    self.assertEqual(self.core_helper_instance.AllocateHosts(
+        u'192.168.1.0/28', [u'alloc4', u'alloc5', u'alloc6', u'alloc7',
+                            u'alloc8', u'alloc9'],
+        u'test_view', u'forward_zone'),
+        [u'192.168.1.1', u'192.168.1.2', u'192.168.1.3', u'192.168.1.4',
+         u'192.168.1.6', u'192.168.1.14'])
+    self.assertRaises(errors.InvalidInputError,
+                      self.core_helper_instance.AllocateHosts,
+                      u'192.168.1.8/29', [u'alloc10'], u'test_view',
+                      u'forward_zone')
+    self.assertRaises(errors.InvalidInputError,
+                      self.core_helper_instance.AllocateHosts,
+                      u'10.0.0.0/30', [u'alloc4'], u'test_view',
+                      u'forward_zone')
+
+  def testCIDRExpand(self):
+    self.assertEqual(self.core_helper_instance.CIDRExpand(u'192.168.0.0/31'),
+                     [u'192.168.0.0', u'192.168.0.1'])
+    ip_addresses = self.core_helper_instance.CIDRExpand(u'10.0.0.0/16')
+    self.assertEqual(len(ip_addresses), 65536)
+    self.assertEqual(ip_addresses[-1], u'10.0.255.255')
+    self.assertEqual(self.core_helper_instance.CIDRExpand(
+        u'10.0.0.0/16', begin=1000, end=1002), [u'10.0.3.232', u'10.0.3.233'])
+    self.assertEqual(self.core_helper_instance.CIDRExpand(
+        u'10.0.0.0/16', begin=65535, end=66535), [u'10.0.255.255'])
+    self.assertEqual(self.core_helper_instance.CIDRExpand(
+        u'10.0.0.0/16', begin=65536, end=66536), [])
+
   def testUnReverseIP(self):
     self.assertEqual(self.core_helper_instance.UnReverseIP(
         'b.a.9.8.7.6.5.0.4.0.0.0.3.0.0.0.2.0.0.0.1.0.0.0.0.0.0.0.1.2.3.4.'
@@ -1706,6 +1764,88 @@ class TestCoreHelpers(unittest.TestCase):
              'record_zone_name': u'forward_zone',
              u'record_view_dependency': u'test_view', 'record_arguments':
                  {u'assignment_host': u'hostname.'}}])
+    # Records of the same batch conflict with each other.
+    self.assertRaises(errors.RecordsBatchError,
+        self.core_helper_instance.ProcessRecordsBatch, add_records=[
+            {'record_type': u'a', 'record_target': u'batch_host',
+             'record_zone_name': u'forward_zone',
+             'record_arguments': {u'assignment_ip': u'192.168.1.90'},
+             'record_view_dependency': u'test_view'},
+            {'record_type': u'a', 'record_target': u'batch_host',
+             'record_zone_name': u'forward_zone',
+             'record_arguments': {u'assignment_ip': u'192.168.1.90'},
+             'record_view_dependency': u'test_view'}])
+    self.assertRaises(errors.RecordsBatchError,
+        self.core_helper_instance.ProcessRecordsBatch, add_records=[
+            {'record_type': u'a', 'record_target': u'batch_host',
+             'record_zone_name': u'forward_zone',
+             'record_arguments': {u'assignment_ip': u'192.168.1.90'},
+             'record_view_dependency': u'test_view'},
+            {'record_type': u'cname', 'record_target': u'batch_host',
+             'record_zone_name': u'forward_zone',
+             'record_arguments': {u'assignment_host': u'hostname.'},
+             'record_view_dependency': u'test_view'}])
+    self.assertEqual(self.core_instance.ListRecords(target=u'batch_host'), [])
+    self.assertEqual(
+        self.core_helper_instance.ProcessRecordsBatch(add_records=[
+            {'record_type': u'a', 'record_target': u'batch_host',
+             'record_zone_name': u'forward_zone',
+             'record_arguments': {u'assignment_ip': u'192.168.1.90'},
+             'record_view_dependency': u'test_view'},
+            {'record_type': u'a', 'record_target': u'batch_host',
+             'record_zone_name': u'forward_zone',
+             'record_arguments': {u'assignment_ip': u'192.168.1.91'},
+             'record_view_dependency': u'test_view'}]), 2)
+
+  def testProcessRecordsBatchArgumentCase(self):
+    txt_record = {'record_type': u'txt', 'record_target': u'case_txt',
+                  'record_zone_name': u'forward_zone',
+                  'record_arguments': {u'quoted_text': u'"Some text"'},
+                  'record_view_dependency': u'test_view'}
+    self.assertEqual(self.core_helper_instance.ProcessRecordsBatch(
+        add_records=[txt_record]), 1)
+    # Argument values that only differ in case are not duplicates.
+    txt_record['record_arguments'] = {u'quoted_text': u'"some text"'}
+    self.assertEqual(self.core_helper_instance.ProcessRecordsBatch(
+        add_records=[txt_record]), 1)
+    txt_record['record_arguments'] = {u'quoted_text': u'"Some text"'}
+    self.assertRaises(errors.RecordsBatchError,
+                      self.core_helper_instance.ProcessRecordsBatch,
+                      add_records=[txt_record])
+    self.assertEqual(len(self.core_instance.ListRecords(target=u'case_txt')),
+                     2)
+
+  def testProcessRecordsBatchSoaIncrements(self):
+    def GetSerials():
+      return dict([(record['view_name'], record['serial_number']) for record in
+                   self.core_instance.ListRecords(record_type=u'soa',
+                                                  zone_name=u'forward_zone')])
+    serials = GetSerials()
+    # Each zone and view dependency is incremented once per batch however
+    # many of its records change.
+    self.core_helper_instance.ProcessRecordsBatch(add_records=[
+        {'record_type': u'a', 'record_target': u'soa_host%s' % index,
+         'record_zone_name': u'forward_zone',
+         'record_arguments': {
+             u'assignment_ip': u'192.168.1.%s' % (100 + index)},
+         'record_view_dependency': u'test_view'} for index in range(3)])
+    self.assertEqual(GetSerials(), {u'test_view': serials[u'test_view'] + 1,
+                                    u'test_view3': serials[u'test_view3']})
+    self.core_helper_instance.ProcessRecordsBatch(add_records=[
+        {'record_type': u'a', 'record_target': u'soa_host3',
+         'record_zone_name': u'forward_zone',
+         'record_arguments': {u'assignment_ip': u'192.168.1.103'},
+         'record_view_dependency': u'test_view'},
+        {'record_type': u'a', 'record_target': u'soa_host3',
+         'record_zone_name': u'forward_zone',
+         'record_arguments': {u'assignment_ip': u'192.168.1.103'},
+         'record_view_dependency': u'test_view3'},
+        {'record_type': u'a', 'record_target': u'soa_host4',
+         'record_zone_name': u'forward_zone',
+         'record_arguments': {u'assignment_ip': u'192.168.1.104'},
+         'record_view_dependency': u'test_view3'}])
+    self.assertEqual(GetSerials(), {u'test_view': serials[u'test_view'] + 2,
+                                    u'test_view3': serials[u'test_view3'] + 1})
 
   def testListSortedHostsByZone(self):
     self.assertEqual( 
@@ -434,6 +434,76 @@ class TestCore(unittest.TestCase):
     self.assertFalse(self.core_instance.RemoveViewAssignment(
         u'test_view', u'second_test_view'))
 
+  def testViewDependencyClosure(self):
+    db_instance = self.core_instance.db_instance
+    self.core_instance.MakeView(u'test_view')
+    self.core_instance.MakeView(u'second_test_view')
+    db_instance.StartTransaction()
+    try:
+      self.assertEqual(
+          db_instance.GetViewDependencyClosure(u'second_test_view_dep'),
+          (set([u'second_test_view']),
+           set([u'any', u'second_test_view_dep'])))
+    finally:
+      db_instance.EndTransaction()
+
+    self.core_instance.MakeViewAssignment(u'test_view', u'second_test_view')
+    db_instance.StartTransaction()
+    try:
+      self.assertEqual(
+          db_instance.GetViewDependencyClosure(u'second_test_view_dep'),
+          (set([u'test_view', u'second_test_view']),
+           set([u'any', u'test_view_dep', u'second_test_view_dep'])))
+      self.assertEqual(
+          db_instance.GetViewDependencyClosure(u'any')[0],
+          set([u'test_view', u'second_test_view']))
+    finally:
+      db_instance.EndTransaction()
+
+    self.core_instance.RemoveViewAssignment(u'test_view', u'second_test_view')
+    self.core_instance.RemoveView(u'test_view')
+    db_instance.StartTransaction()
+    try:
+      self.assertEqual(
+          db_instance.GetViewDependencyClosure(u'second_test_view_dep'),
+          (set([u'second_test_view']),
+           set([u'any', u'second_test_view_dep'])))
+      self.assertEqual(
+          db_instance.GetViewDependencyClosure(u'test_view_dep'),
+          (set(), set()))
+    finally:
+      db_instance.EndTransaction()
+
+    # Changes committed by another process only move the config generation,
+    # the graph kept by this one is not dropped.
+    self.core_instance.MakeView(u'test_view')
+    db_instance.StartTransaction()
+    try:
+      self.assertEqual(
+          db_instance.GetViewDependencyClosure(u'test_view_dep'),
+          (set([u'test_view']), set([u'any', u'test_view_dep'])))
+    finally:
+      db_instance.EndTransaction()
+    db_instance.StartTransaction()
+    try:
+      db_instance.cursor.execute(
+          'INSERT INTO view_dependency_assignments '
+          '(view_dependency_assignments_view_name, '
+          'view_dependency_assignments_view_dependency) VALUES '
+          '(\'second_test_view\', \'test_view_dep\')')
+      db_instance.cursor.execute('UPDATE config_generation SET '
+                                 'config_generation=config_generation+1')
+    finally:
+      db_instance.EndTransaction()
+    db_instance.StartTransaction()
+    try:
+      self.assertEqual(
+          db_instance.GetViewDependencyClosure(u'test_view_dep'),
+          (set([u'test_view', u'second_test_view']),
+           set([u'any', u'test_view_dep', u'second_test_view_dep'])))
+    finally:
+      db_instance.EndTransaction()
+
   def testViewToACLAssignmentsMakeRemoveList(self):
     self.assertFalse(self.core_instance.ListViewToACLAssignments())
     self.core_instance.MakeView(u'test_view')
@@ -823,6 +893,21 @@ class TestCore(unittest.TestCase):
           'view_name': u'any', 'last_user': u'sharrell',
           'zone_name': u'university.edu',
           'mail_server': u'smtp.university.edu.'}])
+    args_dict['mail_server'] = u'smtp-2.university.edu.'
+    self.assertEqual(self.core_instance.ListRecords(
+        record_type=u'mx', record_args_dict=args_dict), [])
+    args_dict['priority'] = None
+    self.assertEqual(self.core_instance.ListRecords(
+        record_type=u'mx', target=u'university_edu',
+        record_args_dict=args_dict),
+        [{'target': u'university_edu',
+          'ttl': 10, u'priority': 20, 'record_type': u'mx',
+          'view_name': u'any', 'last_user': u'sharrell',
+          'zone_name': u'university.edu',
+          u'mail_server': u'smtp-2.university.edu.'}])
+    self.assertEqual(self.core_instance.ListRecords(
+        record_type=u'mx', target=u'newtarget_edu',
+        record_args_dict=args_dict), [])
     self.core_instance.RemoveRecord(u'mx', u'university_edu',
                                     u'university.edu',
                                     {u'priority': 20,
@@ -1113,6 +1198,102 @@ class TestCore(unittest.TestCase):
                        'record_type': u'soa', 'view_name': u'test_view',
                        'last_user': u'sharrell', 'zone_name': u'university.edu',
                        u'admin_email': u'test.', u'expiry_seconds': 4}])
+    # Increments are made once per zone and view dependency when committing.
+    self.core_instance.db_instance.StartTransaction()
+    self.core_instance._IncrementSoa(u'test_view', u'university.edu')
+    self.core_instance._IncrementSoa(u'test_view', u'university.edu')
+    self.core_instance._IncrementSoa(u'test_view_dep', u'university.edu')
+    self.core_instance.db_instance.EndTransaction()
+    self.assertEqual(self.core_instance.ListRecords()[0]['serial_number'], 3)
+    # The any view is its own view dependency.
+    self.core_instance.db_instance.StartTransaction()
+    self.core_instance._IncrementSoa(u'any', u'university.edu')
+    self.core_instance._IncrementSoa(u'test_view', u'university.edu')
+    self.core_instance.db_instance.EndTransaction()
+    self.assertEqual(self.core_instance.ListRecords()[0]['serial_number'], 5)
+    self.core_instance.db_instance.StartTransaction()
+    self.core_instance._IncrementSoa(u'test_view', u'university.edu')
+    self.core_instance.db_instance.EndTransaction(rollback=True)
+    self.assertEqual(self.core_instance.ListRecords()[0]['serial_number'], 5)
+    self.core_instance.db_instance.StartTransaction()
+    self.core_instance._IncrementSoa(u'test_view', u'no_zone')
+    self.assertRaises(errors.RecordError,
+                      self.core_instance.db_instance.EndTransaction)
+    self.assertEqual(self.core_instance.ListRecords()[0]['serial_number'], 5)
+
+  def testUpdateRecordSharedArgument(self):
+    self.core_instance.MakeZone(u'university.edu', u'master',
+                                u'university.edu.')
+    for mail_server in [u'smtp-1.university.edu.', u'smtp-2.university.edu.']:
+      self.core_instance.MakeRecord(u'mx', u'university_edu',
+                                    u'university.edu',
+                                    {u'priority': 10,
+                                     u'mail_server': mail_server}, ttl=10)
+    self.assertRaises(errors.InvalidInputError, self.core_instance.UpdateRecord,
+                      u'mx', u'university_edu', u'university.edu',
+                      {u'priority': 10, u'mail_server': None},
+                      update_record_args_dict={u'priority': 20,
+                                               u'mail_server': None})
+    self.core_instance.UpdateRecord(u'mx', u'university_edu', u'university.edu',
+                                    {u'priority': 10, u'mail_server':
+                                         u'smtp-1.university.edu.'},
+                                    update_record_args_dict={
+                                        u'priority': 20, u'mail_server': None})
+    self.assertEqual(
+        sorted([(record['mail_server'], record['priority']) for record in
+                self.core_instance.ListRecords(record_type=u'mx')]),
+        [(u'smtp-1.university.edu.', 20), (u'smtp-2.university.edu.', 10)])
+    self.core_instance.RemoveRecord(u'mx', u'university_edu', u'university.edu',
+                                    {u'priority': 10, u'mail_server':
+                                         u'smtp-2.university.edu.'}, u'any')
+    self.assertRaises(errors.InvalidInputError, self.core_instance.RemoveRecord,
+                      u'mx', u'university_edu', u'university.edu',
+                      {u'priority': 10, u'mail_server':
+                           u'smtp-2.university.edu.'}, u'any')
+    self.assertEqual(len(self.core_instance.ListRecords(record_type=u'mx')), 1)
+
+  def testRebuildFlatRecords(self):
+    self.core_instance.MakeZone(u'university.edu', u'master',
+                                u'university.edu.')
+    self.core_instance.MakeRecord(u'mx', u'university_edu',
+                                  u'university.edu',
+                                  {u'priority': 10,
+                                   u'mail_server': u'smtp.university.edu.'},
+                                  ttl=10)
+    self.core_instance.MakeRecord(u'txt', u'university_edu',
+                                  u'university.edu',
+                                  {u'quoted_text': u'"Some text"'}, ttl=10)
+    records = self.core_instance.ListRecords()
+    self.assertEqual(len(records), 2)
+
+    db_instance = self.core_instance.db_instance
+    db_instance.StartTransaction()
+    try:
+      db_instance.cursor.execute('DELETE FROM flat_records')
+    finally:
+      db_instance.EndTransaction()
+    self.assertEqual(self.core_instance.ListRecords(), [])
+    self.assertRaises(errors.TransactionError, db_instance.RebuildFlatRecords)
+    db_instance.StartTransaction()
+    try:
+      self.assertEqual(db_instance.RebuildFlatRecords(), 2)
+    finally:
+      db_instance.EndTransaction()
+    self.assertEqual(self.core_instance.ListRecords(), records)
+    self.assertEqual(self.core_instance.ListRecords(
+        record_type=u'mx', record_args_dict={u'priority': 10,
+                                             u'mail_server': None}),
+        [record for record in records if record['record_type'] == u'mx'])
+
+    # Argument values with a word reserved after they were made still copy.
+    self.core_instance.MakeReservedWord(u'text')
+    db_instance.InitDataValidation()
+    db_instance.StartTransaction()
+    try:
+      self.assertEqual(db_instance.RebuildFlatRecords(), 2)
+    finally:
+      db_instance.EndTransaction()
+    self.assertEqual(self.core_instance.ListRecords(), records)
 
   def testListRecordArgumentDefinitions(self):
     self.assertEqual(self.core_instance.ListRecordArgumentDefinitions(),
@@ -140,6 +140,20 @@ class DbAccessThread(threading.Thread):
         'views',self.db_instance.GetEmptyRowDict('views')), ())
     self.db_instance.EndTransaction()
 
+class HoldTransactionThread(threading.Thread):
+  def __init__(self, db_instance, started_event, release_event):
+    self.db_instance = db_instance
+    self.started_event = started_event
+    self.release_event = release_event
+    threading.Thread.__init__(self)
+  def run(self):
+    self.db_instance.StartTransaction()
+    try:
+      self.started_event.set()
+      self.release_event.wait(10)
+    finally:
+      self.db_instance.EndTransaction()
+
 class DbLockThread(threading.Thread):
   def __init__(self, db_instance):
     self.db_instance = db_instance
@@ -182,6 +196,60 @@ class TestdbAccess(unittest.TestCase):
         thread.start()
         thread.join()
 
+  def testConnectionPool(self):
+    self.db_instance.close()
+    metrics = self.db_instance.GetConnectionPoolMetrics()
+    self.assertEqual(metrics['in_use'], 0)
+    self.assertEqual(metrics['idle_connections'], 0)
+    self.assertEqual(
+        metrics['max_size'],
+        self.config_instance.config_file['database']['connection_pool_size'])
+
+    # A transaction held open in one thread does not block another thread.
+    started_event = threading.Event()
+    release_event = threading.Event()
+    hold_thread = HoldTransactionThread(self.db_instance, started_event,
+                                        release_event)
+    hold_thread.start()
+    started_event.wait(10)
+    self.assertTrue(started_event.isSet())
+    self.db_instance.StartTransaction()
+    self.assertEqual(self.db_instance.GetConnectionPoolMetrics()['in_use'], 2)
+    self.db_instance.EndTransaction()
+    release_event.set()
+    hold_thread.join()
+
+    metrics = self.db_instance.GetConnectionPoolMetrics()
+    self.assertEqual(metrics['in_use'], 0)
+    self.assertEqual(metrics['idle_connections'], 2)
+
+    # Connections are shared between instances with the same settings.
+    new_db_instance = self.config_instance.GetDb()
+    self.assertTrue(new_db_instance.connection_pool is
+                    self.db_instance.connection_pool)
+    new_db_instance.StartTransaction()
+    new_db_instance.EndTransaction()
+    self.assertEqual(
+        self.db_instance.GetConnectionPoolMetrics()['connections_created'],
+        metrics['connections_created'])
+
+    # A bounded pool makes waiters block until a connection is checked in.
+    pool = db_access.ConnectionPool(
+        self.db_instance.connection_pool.connect_kwargs, 1)
+    connection = pool.CheckOut()
+    checkout_thread = threading.Thread(target=pool.CheckOut)
+    checkout_thread.start()
+    time.sleep(0.5)
+    self.assertTrue(checkout_thread.isAlive())
+    pool.CheckIn(connection)
+    checkout_thread.join(10)
+    self.assertFalse(checkout_thread.isAlive())
+    metrics = pool.GetMetrics()
+    self.assertEqual(metrics['checkouts'], 2)
+    self.assertEqual(metrics['waits'], 1)
+    self.assertEqual(metrics['connections_created'], 1)
+    self.assertTrue(metrics['wait_time_max'] >= 0.5)
+
   def testTransactions(self):
     self.db_instance.thread_safe = False
     self.assertRaises(errors.TransactionError, self.db_instance.EndTransaction)
@@ -190,6 +258,41 @@ class TestdbAccess(unittest.TestCase):
                       self.db_instance.StartTransaction)
     self.db_instance.EndTransaction()
 
+  def testBigLock(self):
+    started_event = threading.Event()
+    release_event = threading.Event()
+    lock_thread = threading.Thread(target=self.HoldBigLock,
+                                   args=(started_event, release_event))
+    lock_thread.start()
+    started_event.wait(10)
+    self.assertTrue(started_event.isSet())
+
+    transaction_thread = threading.Thread(
+        target=self.db_instance.GetRecordArgsDict, args=(u'mx',))
+    transaction_thread.start()
+    time.sleep(0.5)
+    # Held by the big lock until it is released.
+    self.assertTrue(transaction_thread.isAlive())
+    release_time = time.time()
+    release_event.set()
+    transaction_thread.join(10)
+    self.assertFalse(transaction_thread.isAlive())
+    self.assertTrue(time.time() - release_time < 1)
+    lock_thread.join()
+
+  def HoldBigLock(self, started_event, release_event):
+    db_instance = self.config_instance.GetDb()
+    db_instance.StartTransaction()
+    try:
+      db_instance.LockDb()
+      try:
+        started_event.set()
+        release_event.wait(10)
+      finally:
+        db_instance.UnlockDb()
+    finally:
+      db_instance.EndTransaction()
+
   def testDbLocking(self):
     self.db_instance.StartTransaction()
     self.assertRaises(errors.TransactionError, self.db_instance.UnlockDb)
@@ -204,6 +307,84 @@ class TestdbAccess(unittest.TestCase):
     self.db_instance.MakeRow('users', users_dict)
     self.db_instance.EndTransaction()
 
+  def testStartConsistentSnapshot(self):
+    self.assertRaises(errors.TransactionError,
+                      self.db_instance.StartConsistentSnapshot)
+    audit_log_dict = {'audit_log_id': None,
+                      'audit_log_user_name': u'sharrell',
+                      'action': u'DoThis',
+                      'data': cPickle.dumps('I did it'),
+                      'success': 1,
+                      'audit_log_timestamp': datetime.datetime(2001, 1, 1, 1)}
+    self.db_instance.StartTransaction()
+    audit_log_id = self.db_instance.MakeRow('audit_log', audit_log_dict)
+    self.db_instance.EndTransaction()
+
+    self.db_instance.StartTransaction()
+    try:
+      self.assertEqual(self.db_instance.StartConsistentSnapshot(),
+                       audit_log_id)
+      # Rows written by other transactions after the snapshot started are not
+      # seen and the writer is not blocked.
+      new_db_instance = self.config_instance.GetDb()
+      write_thread = threading.Thread(target=self.MakeAuditLogRow,
+                                      args=(new_db_instance, audit_log_dict))
+      write_thread.start()
+      write_thread.join(10)
+      self.assertFalse(write_thread.isAlive())
+      self.assertEqual(len(self.db_instance.ListRow(
+          'audit_log', self.db_instance.GetEmptyRowDict('audit_log'))), 1)
+    finally:
+      self.db_instance.EndTransaction()
+
+    self.db_instance.StartTransaction()
+    try:
+      self.assertEqual(len(self.db_instance.ListRow(
+          'audit_log', self.db_instance.GetEmptyRowDict('audit_log'))), 2)
+    finally:
+      self.db_instance.EndTransaction()
+
+    # Changes made in the transaction are not committed by the snapshot.
+    self.db_instance.StartTransaction()
+    try:
+      self.db_instance.MakeRow('audit_log', audit_log_dict)
+      self.assertRaises(errors.TransactionError,
+                        self.db_instance.StartConsistentSnapshot)
+    finally:
+      self.db_instance.EndTransaction(rollback=True)
+
+    # The locking read does not wait on the pool the transaction is using.
+    connection_pool = self.db_instance.connection_pool
+    max_size = connection_pool.max_size
+    connection_pool.max_size = 1
+    try:
+      while( connection_pool.idle_connections ):
+        connection_pool.CloseConnection(
+            connection_pool.idle_connections.pop()[0])
+      connection_pool.open_connections = 0
+      snapshot_audit_log_ids = []
+      def StartSnapshot():
+        self.db_instance.StartTransaction()
+        try:
+          snapshot_audit_log_ids.append(
+              self.db_instance.StartConsistentSnapshot())
+        finally:
+          self.db_instance.EndTransaction()
+      snapshot_thread = threading.Thread(target=StartSnapshot)
+      snapshot_thread.start()
+      snapshot_thread.join(10)
+      self.assertFalse(snapshot_thread.isAlive())
+      self.assertEqual(len(snapshot_audit_log_ids), 1)
+    finally:
+      connection_pool.max_size = max_size
+
+  def MakeAuditLogRow(self, db_instance, audit_log_dict):
+    db_instance.StartTransaction()
+    try:
+      db_instance.MakeRow('audit_log', audit_log_dict)
+    finally:
+      db_instance.EndTransaction()
+
   def testInitDataValidation(self):
     self.db_instance.InitDataValidation()
     self.assertEqual(self.db_instance.data_validation_instance.reserved_words,
@@ -493,6 +674,178 @@ class TestdbAccess(unittest.TestCase):
                  'forward_zone_permissions_zone_name': u'eas.university.edu'}])) 
     self.db_instance.EndTransaction()
 
+  def testListRowStatementCache(self):
+    db_access.list_row_statement_cache.Clear()
+    users_dict = self.db_instance.GetEmptyRowDict('users')
+    users_dict['user_name'] = u'sharrell'
+    self.db_instance.StartTransaction()
+    try:
+      first_rows = self.db_instance.ListRow('users', users_dict)
+      self.assertEqual(self.db_instance.GetStatementCacheMetrics()['misses'],
+                       1)
+      self.assertEqual(self.db_instance.ListRow('users', users_dict),
+                       first_rows)
+      users_dict['user_name'] = u'shuey'
+      self.assertEqual(len(self.db_instance.ListRow('users', users_dict)), 1)
+      metrics = self.db_instance.GetStatementCacheMetrics()
+      self.assertEqual(metrics['statements'], 1)
+      self.assertEqual(metrics['hits'], 2)
+      self.assertEqual(metrics['misses'], 1)
+
+      # Values are still type checked when the statement is cached.
+      users_dict['access_level'] = u'not_an_int'
+      self.db_instance.ListRow('users', self.db_instance.GetEmptyRowDict(
+          'users'))
+      self.assertRaises(errors.UnexpectedDataError, self.db_instance.ListRow,
+                        'users', users_dict)
+      users_dict['access_level'] = 32
+      self.db_instance.ListRow('users', users_dict)
+      users_dict['access_level'] = u'not_an_int'
+      self.assertRaises(errors.UnexpectedDataError, self.db_instance.ListRow,
+                        'users', users_dict)
+
+      # A different set of searched columns is a different statement.
+      self.db_instance.ListRow('users', self.db_instance.GetEmptyRowDict(
+          'users'), lock_rows=True)
+      self.assertEqual(
+          self.db_instance.GetStatementCacheMetrics()['statements'], 4)
+    finally:
+      self.db_instance.EndTransaction()
+
+  def testIterRow(self):
+    users_dict = self.db_instance.GetEmptyRowDict('users')
+    self.db_instance.StartTransaction()
+    try:
+      user_rows = self.db_instance.ListRow('users', users_dict)
+      self.assertEqual(
+          list(self.db_instance.IterRow('users', users_dict, chunk_size=1)),
+          list(user_rows))
+      self.assertEqual(
+          list(self.db_instance.IterRow('users', users_dict,
+                                        column='access_level',
+                                        range_values=(0, 32))),
+          [row for row in user_rows if row['access_level'] <= 32])
+
+      # Arguments are checked before any rows are read.
+      self.assertRaises(errors.InvalidInputError, self.db_instance.IterRow,
+                        'not_a_table', users_dict)
+      self.assertRaises(errors.InvalidInputError, self.db_instance.IterRow,
+                        'users', users_dict, chunk_size=0)
+
+      # No other query can run until the rows have been read off.
+      user_iterator = self.db_instance.IterRow('users', users_dict)
+      user_iterator.next()
+      self.assertRaises(errors.TransactionError, self.db_instance.ListRow,
+                        'users', users_dict)
+      user_iterator.close()
+      self.assertEqual(self.db_instance.ListRow('users', users_dict),
+                       user_rows)
+
+      # EndTransaction closes iterators that were not finished.
+      user_iterator = self.db_instance.IterRow('users', users_dict,
+                                               chunk_size=1)
+      user_iterator.next()
+    finally:
+      self.db_instance.EndTransaction()
+    self.db_instance.StartTransaction()
+    try:
+      self.assertEqual(self.db_instance.ListRow('users', users_dict),
+                       user_rows)
+    finally:
+      self.db_instance.EndTransaction()
+
+  def testMakeRows(self):
+    self.assertRaises(errors.InvalidInputError, self.db_instance.MakeRows,
+                      'notinlist', [])
+    self.assertRaises(errors.TransactionError, self.db_instance.MakeRows,
+                      'acls', [])
+    audit_log_dicts = []
+    for hour in range(3):
+      audit_log_dicts.append(
+          {'audit_log_id': None,
+           'audit_log_user_name': u'sharrell',
+           'action': u'DoThis%s' % hour,
+           'data': cPickle.dumps('I did it'),
+           'success': 1,
+           'audit_log_timestamp': datetime.datetime(2001, 1, 1, hour)})
+    self.db_instance.StartTransaction()
+    try:
+      self.assertEqual(self.db_instance.MakeRows('audit_log', []), [])
+      audit_log_ids = self.db_instance.MakeRows('audit_log', audit_log_dicts)
+      self.assertEqual(len(audit_log_ids), 3)
+      for audit_log_id, audit_log_dict in zip(audit_log_ids, audit_log_dicts):
+        search_dict = self.db_instance.GetEmptyRowDict('audit_log')
+        search_dict['audit_log_id'] = audit_log_id
+        self.assertEqual(self.db_instance.ListRow('audit_log', search_dict)[0][
+            'action'], audit_log_dict['action'])
+
+      # Rows that set their ids are inserted one at a time, so the rows
+      # after them still get the ids they were given.
+      explicit_id = max(audit_log_ids) + 10
+      audit_log_dicts[1]['audit_log_id'] = explicit_id
+      explicit_audit_log_ids = self.db_instance.MakeRows('audit_log',
+                                                         audit_log_dicts)
+      self.assertEqual(explicit_audit_log_ids[1], explicit_id)
+      self.assertEqual(len(set(explicit_audit_log_ids)), 3)
+      for audit_log_id, audit_log_dict in zip(explicit_audit_log_ids,
+                                              audit_log_dicts):
+        search_dict = self.db_instance.GetEmptyRowDict('audit_log')
+        search_dict['audit_log_id'] = audit_log_id
+        self.assertEqual(self.db_instance.ListRow('audit_log', search_dict)[0][
+            'action'], audit_log_dict['action'])
+
+      del audit_log_dicts[1]['audit_log_id']
+      self.assertRaises(errors.UnexpectedDataError, self.db_instance.MakeRows,
+                        'audit_log', audit_log_dicts)
+    finally:
+      self.db_instance.EndTransaction(rollback=True)
+
+  def testRowsById(self):
+    self.assertRaises(errors.InvalidInputError,
+                      self.db_instance.RemoveRowsById, 'notinlist', [])
+    self.assertRaises(errors.TransactionError,
+                      self.db_instance.RemoveRowsById, 'acls', [])
+    self.assertRaises(errors.TransactionError,
+                      self.db_instance.UpdateRowsById, 'acls', [], {})
+    audit_log_dicts = []
+    for hour in range(5):
+      audit_log_dicts.append(
+          {'audit_log_id': None,
+           'audit_log_user_name': u'sharrell',
+           'action': u'DoThis',
+           'data': cPickle.dumps('I did it'),
+           'success': 1,
+           'audit_log_timestamp': datetime.datetime(2001, 1, 1, hour)})
+    self.db_instance.StartTransaction()
+    try:
+      audit_log_ids = self.db_instance.MakeRows('audit_log', audit_log_dicts)
+      self.assertRaises(errors.UnexpectedDataError,
+                        self.db_instance.RemoveRowsById, 'audit_log',
+                        [u'not_an_id'])
+      update_dict = self.db_instance.GetEmptyRowDict('audit_log')
+      self.assertRaises(errors.UnexpectedDataError,
+                        self.db_instance.UpdateRowsById, 'audit_log',
+                        audit_log_ids, update_dict)
+      update_dict['action'] = u'DoThat'
+      self.assertEqual(self.db_instance.UpdateRowsById(
+          'audit_log', audit_log_ids[:3] + audit_log_ids[:1], update_dict), 3)
+      search_dict = self.db_instance.GetEmptyRowDict('audit_log')
+      search_dict['action'] = u'DoThat'
+      self.assertEqual(
+          sorted([row['audit_log_id'] for row in
+                  self.db_instance.ListRow('audit_log', search_dict)]),
+          sorted(audit_log_ids[:3]))
+
+      self.assertEqual(self.db_instance.RemoveRowsById('audit_log', []), 0)
+      self.assertEqual(self.db_instance.RemoveRowsById(
+          'audit_log', audit_log_ids[1:] + [audit_log_ids[-1] + 1000]), 4)
+      self.assertEqual(
+          [row['audit_log_id'] for row in self.db_instance.ListRow(
+              'audit_log', self.db_instance.GetEmptyRowDict('audit_log'))
+           if row['audit_log_id'] in audit_log_ids], audit_log_ids[:1])
+    finally:
+      self.db_instance.EndTransaction(rollback=True)
+
   def testGetZoneOrigins(self):
     # Add zones and views
     zones_dict1 = self.db_instance.GetEmptyRowDict('zones')
@@ -595,17 +948,52 @@ class TestdbAccess(unittest.TestCase):
     self.db_instance.db_debug_log = 'test_data/db_access_unittest_logfile.txt'
     self.db_instance.GetRecordArgsDict(u'mx')
     self.db_instance.db_debug = False
+    db_access.GetQueryLog(self.db_instance.db_debug_log).Flush()
 
     log_file_handle = open('test_data/db_access_unittest_logfile.txt', 'r')
     log_file_read = log_file_handle.read()
     log_file_handle.close()
     os.system('rm -f test_data/db_access_unittest_logfile.txt')
-    self.assertEquals(log_file_read,
-        'DO 0\n'
-        'SELECT `locked`, `lock_last_updated`, NOW() as `now` from `locks` WHERE `lock_name`="db_lock_lock"\n'
-        'SELECT reserved_word FROM reserved_words\n'
-        'SELECT record_type FROM record_types\n'
-        'SELECT record_arguments.record_arguments_type,record_arguments.argument_name,record_arguments.argument_data_type,record_arguments.argument_order FROM record_arguments WHERE record_arguments_type=mx\n')
+    log_lines = [line.split('\t') for line in log_file_read.splitlines()]
+    self.assertEquals([line[4] for line in log_lines],
+        ['SELECT IS_FREE_LOCK(%(lock_name)s) OR (GET_LOCK(%(lock_name)s, %(timeout)s) AND RELEASE_LOCK(%(lock_name)s)) AS `lock_free`',
+         'SELECT reserved_word FROM reserved_words',
+         'SELECT record_type FROM record_types',
+         'SELECT record_arguments.record_arguments_type,record_arguments.argument_name,record_arguments.argument_data_type,record_arguments.argument_order FROM record_arguments WHERE record_arguments_type=%(record_arguments_type)s'])
+    self.assertEquals(log_lines[0][5], repr(
+        {'lock_name': self.db_instance.big_lock_name,
+         'timeout': self.db_instance.big_lock_timeout}))
+    self.assertEquals(log_lines[3][5], repr({'record_arguments_type': u'mx'}))
+    for line in log_lines:
+      self.assertEqual(len(line), 6)
+      self.assertTrue(float(line[1]) >= 0)
+      self.assertTrue(line[3].endswith(':testDebugLogFile'))
+    self.assertEqual(int(log_lines[1][2]), len(
+        self.db_instance.data_validation_instance.reserved_words))
+
+  def testSlowQueryLog(self):
+    self.db_instance.db_slow_query_seconds = 0.000001
+    self.db_instance.db_debug_log = 'test_data/db_access_unittest_logfile.txt'
+    try:
+      self.db_instance.StartTransaction()
+      try:
+        self.db_instance.ListRow('users', self.db_instance.GetEmptyRowDict(
+            'users'))
+      finally:
+        self.db_instance.EndTransaction()
+    finally:
+      self.db_instance.db_slow_query_seconds = 0
+    db_access.GetQueryLog(self.db_instance.db_debug_log).Flush()
+
+    log_file_handle = open('test_data/db_access_unittest_logfile.txt', 'r')
+    log_file_read = log_file_handle.read()
+    log_file_handle.close()
+    os.system('rm -f test_data/db_access_unittest_logfile.txt')
+    log_lines = log_file_read.splitlines()
+    users_index = [index for index, line in enumerate(log_lines) if
+                   '\tSELECT users.' in line][0]
+    self.assertTrue(log_lines[users_index + 1].startswith('EXPLAIN\t'))
+    self.assertTrue('users' in log_lines[users_index + 1])
      
   def testValidateRecordArgsDict(self):
     record_args_dict = self.db_instance.GetEmptyRecordArgsDict(u'mx')
@@ -647,6 +1035,53 @@ class TestdbAccess(unittest.TestCase):
 
     self.db_instance.EndTransaction()
 
+  def testForeignKeyGraphDatabaseConsistency(self):
+    self.db_instance.StartTransaction()
+    try:
+      self.db_instance.cursor.execute(
+          'SELECT table_name, column_name, referenced_table_name, '
+          'referenced_column_name FROM information_schema.key_column_usage '
+          'WHERE referenced_table_name IS NOT NULL AND '
+          'referenced_table_schema=%s', (self.db_instance.db_name,))
+      db_foreign_keys = self.db_instance.cursor.fetchall()
+    finally:
+      self.db_instance.EndTransaction()
+    db_key_set = set()
+    for key in db_foreign_keys:
+      db_key_set.add((key['table_name'], key['column_name'],
+                      key['referenced_table_name'],
+                      key['referenced_column_name']))
+    graph_key_set = set()
+    for key in self.db_instance.foreign_key_graph.foreign_keys:
+      graph_key_set.add((key['table_name'], key['column_name'],
+                         key['referenced_table_name'],
+                         key['referenced_column_name']))
+    self.assertEqual(graph_key_set, db_key_set)
+
+    self.assertTrue(self.db_instance.foreign_key_graph is
+                    self.config_instance.GetDb().foreign_key_graph)
+    self.assertEqual(sorted(self.db_instance.foreign_key_graph.GetJoinPredicates(
+        ['credentials', 'users'])),
+        ['(credentials.credential_user_name=users.user_name)'])
+    self.assertEqual(self.db_instance.foreign_key_graph.GetJoinPredicates(
+        ['acls', 'users']), [])
+
+  def testPrimaryKeysDatabaseConsistency(self):
+    self.db_instance.StartTransaction()
+    try:
+      self.db_instance.cursor.execute(
+          'SELECT table_name, column_name FROM '
+          'information_schema.key_column_usage WHERE '
+          'constraint_name=%s AND table_schema=%s',
+          ('PRIMARY', self.db_instance.db_name))
+      db_primary_keys = self.db_instance.cursor.fetchall()
+    finally:
+      self.db_instance.EndTransaction()
+    db_key_dict = {}
+    for key in db_primary_keys:
+      db_key_dict[key['table_name']] = key['column_name']
+    self.assertEqual(db_access.GetPrimaryKeys(), db_key_dict)
+
   def testDataTypeValidation(self):
     self.db_instance.StartTransaction()
     search_data_type_dict = self.db_instance.GetEmptyRowDict('data_types')
@@ -667,10 +1102,12 @@ class TestdbAccess(unittest.TestCase):
     self.db_instance.StartTransaction()
     self.assertEqual(
       self.db_instance.ListTableNames(),
-      [u'acl_ranges', u'acls', u'audit_log', u'credentials', u'data_types', 
+      [u'acl_ranges', u'acls', u'audit_log', u'config_generation',
+       u'credentials', u'data_types', 
        u'dns_server_set_assignments', u'dns_server_set_view_assignments', 
-       u'dns_server_sets', u'dns_servers', u'forward_zone_permissions', 
-       u'group_forward_permissions', u'group_reverse_permissions', u'groups', 
+       u'dns_server_sets', u'dns_servers', u'flat_records',
+       u'forward_zone_permissions', u'group_forward_permissions',
+       u'group_reverse_permissions', u'groups', u'ip_allocations',
        u'ipv4_index', u'ipv6_index', u'locks', u'named_conf_global_options', 
        u'record_arguments', u'record_arguments_records_assignments', 
        u'record_types', u'records', u'reserved_words', 
@@ -700,6 +1137,36 @@ class TestdbAccess(unittest.TestCase):
     finally:
       self.db_instance.EndTransaction()
 
+  def testGetConfigSnapshot(self):
+    self.db_instance.StartTransaction()
+    try:
+      generation = self.db_instance.GetConfigGeneration()
+      config_snapshot = self.db_instance.GetConfigSnapshot()
+      self.assertEqual(config_snapshot.generation, generation)
+      self.assertFalse(config_snapshot.maintenance_flag)
+      self.assertTrue(self.db_instance.GetConfigSnapshot() is config_snapshot)
+    finally:
+      self.db_instance.EndTransaction()
+
+    self.db_instance.StartTransaction()
+    try:
+      self.db_instance.UpdateRow('locks',
+                                 {'lock_name': u'maintenance', 'locked': None},
+                                 {'lock_name': u'maintenance', 'locked': 1})
+      self.assertTrue(self.db_instance.GetConfigSnapshot().maintenance_flag)
+      self.assertFalse(config_snapshot.maintenance_flag)
+    finally:
+      self.db_instance.EndTransaction()
+
+    self.db_instance.StartTransaction()
+    try:
+      self.assertEqual(self.db_instance.GetConfigGeneration(), generation + 1)
+      new_config_snapshot = self.db_instance.GetConfigSnapshot()
+      self.assertFalse(new_config_snapshot is config_snapshot)
+      self.assertTrue(new_config_snapshot.maintenance_flag)
+    finally:
+      self.db_instance.EndTransaction()
+
   def testGetCurrentTime(self):
     self.db_instance.StartTransaction()
     time = self.db_instance.GetCurrentTime()
@@ -722,6 +1189,40 @@ class TestdbAccess(unittest.TestCase):
  
     self.db_instance.CreateRosterDatabase()
 
+  def testUpgradeRosterDatabase(self):
+    self.db_instance.StartTransaction()
+    try:
+      self.db_instance.cursor.execute('SELECT COUNT(*) AS count FROM records')
+      record_count = self.db_instance.cursor.fetchone()['count']
+      self.db_instance.cursor.execute('DROP TABLE flat_records')
+      self.db_instance.cursor.execute('DROP TABLE ip_allocations')
+      self.db_instance.cursor.execute('DROP TABLE config_generation')
+      self.db_instance.cursor.execute('ALTER TABLE audit_log DROP INDEX '
+                                      'audit_log_timestamp_1')
+      self.db_instance.cursor.execute('ALTER TABLE audit_log DROP INDEX '
+                                      'action_success_1')
+    finally:
+      self.db_instance.EndTransaction()
+
+    self.assertEqual(self.db_instance.UpgradeRosterDatabase(),
+        {'tables': ['config_generation', 'flat_records', 'ip_allocations'],
+         'indexes': [u'audit_log.audit_log_timestamp_1',
+                     u'audit_log.action_success_1']})
+    self.assertEqual(self.db_instance.UpgradeRosterDatabase(),
+                     {'tables': [], 'indexes': []})
+
+    self.db_instance.StartTransaction()
+    try:
+      self.db_instance.cursor.execute('SELECT COUNT(*) AS count FROM '
+                                      'flat_records')
+      self.assertEqual(self.db_instance.cursor.fetchone()['count'],
+                       record_count)
+      self.db_instance.cursor.execute('SELECT config_generation FROM '
+                                      'config_generation')
+      self.assertEqual(len(self.db_instance.cursor.fetchall()), 1)
+    finally:
+      self.db_instance.EndTransaction()
+
   def testDumpDatabase(self):
     self.db_instance.StartTransaction()
     dump = self.db_instance.DumpDatabase()
@@ -36,6 +36,7 @@ __license__ = 'BSD'
 __version__ = '#TRUNK#'
 
 
+import inspect
 import unittest
 
 from roster_core import errors
@@ -51,6 +52,34 @@ class TestHelpersLib(unittest.TestCase):
         {'replay_args': ['test', 1],
          'audit_args': {'test_flag': 'test', 'other_flag': 1}})
 
+  def testAuditedMethod(self):
+    def AuditedFunction(test_flag, other_flag=1, *args, **kwargs):
+      """Returns its name and arguments."""
+      return helpers_lib.GetFunctionNameAndArgs()
+    audited_function = helpers_lib.AuditedMethod(AuditedFunction)
+    self.assertEqual(audited_function.__name__, 'AuditedFunction')
+    self.assertEqual(audited_function.__doc__, AuditedFunction.__doc__)
+    self.assertEqual(inspect.getargspec(audited_function),
+                     inspect.getargspec(AuditedFunction))
+    self.assertEqual(audited_function(u'test', other_flag=2, extra=3),
+        (u'AuditedFunction',
+         {'replay_args': [u'test', 2],
+          'audit_args': {'test_flag': u'test', 'other_flag': 2}}))
+    self.assertEqual(audited_function(u'test'),
+        (u'AuditedFunction',
+         {'replay_args': [u'test', 1],
+          'audit_args': {'test_flag': u'test', 'other_flag': 1}}))
+    self.assertEqual(helpers_lib.audited_calls.stack, [])
+
+    def DefaultedFunction(records=None):
+      if( records is None ):
+        records = []
+      return helpers_lib.GetFunctionNameAndArgs()
+    audited_function = helpers_lib.AuditedMethod(DefaultedFunction)
+    self.assertEqual(audited_function(),
+        (u'DefaultedFunction',
+         {'replay_args': [[]], 'audit_args': {'records': []}}))
+
   def testGetRowDict(self):
     self.assertEqual(helpers_lib.GetRowDict('acls'), 
                      {'acl_name': 'UnicodeString'})
@@ -103,6 +132,49 @@ class TestHelpersLib(unittest.TestCase):
     self.assertEquals(helpers_lib.CIDRExpand('192.168.0.1'),
                       [u'192.168.0.1'])
     self.assertRaises(errors.CoreError, helpers_lib.CIDRExpand, 'notavalidip')
+    self.assertEquals(helpers_lib.CIDRExpand('192.168.0/24', begin=2, end=4),
+                      [u'192.168.0.2', u'192.168.0.3'])
+
+  def testIPAddressRange(self):
+    ip_address_range = helpers_lib.CIDRExpand('192.168.0/24')
+    self.assertEqual(len(ip_address_range), 256)
+    self.assertEqual(ip_address_range[1], u'192.168.0.1')
+    self.assertEqual(ip_address_range[-1], u'192.168.0.255')
+    self.assertRaises(IndexError, ip_address_range.__getitem__, 256)
+    self.assertEqual(list(ip_address_range[253:]),
+                     [u'192.168.0.253', u'192.168.0.254', u'192.168.0.255'])
+    self.assertEqual(list(ip_address_range[10:2:-4]),
+                     [u'192.168.0.10', u'192.168.0.6'])
+    self.assertEqual(list(ip_address_range[::100][1:]),
+                     [u'192.168.0.100', u'192.168.0.200'])
+    self.assertEqual(list(ip_address_range[300:]), [])
+    self.assertTrue(ip_address_range)
+    self.assertFalse(ip_address_range[300:])
+    ip_address_range = helpers_lib.CIDRExpand('2001:0400::/64')
+    self.assertEqual(ip_address_range.length, 2 ** 64)
+    self.assertRaises(OverflowError, len, ip_address_range)
+    self.assertTrue(ip_address_range)
+    self.assertEqual(ip_address_range[-1],
+                     u'2001:0400:0000:0000:ffff:ffff:ffff:ffff')
+    self.assertEqual(list(ip_address_range[2:4]),
+                     [u'2001:0400:0000:0000:0000:0000:0000:0002',
+                      u'2001:0400:0000:0000:0000:0000:0000:0003'])
+
+  def testFormatIPAddress(self):
+    self.assertEqual(helpers_lib.FormatIPAddress(3232235777, 4),
+                     u'192.168.1.1')
+    self.assertEqual(
+        helpers_lib.FormatIPAddress(
+            0x432100000001000200030004056789abL, 6),
+        u'4321:0000:0001:0002:0003:0004:0567:89ab')
+
+  def testIterFreeAddressRanges(self):
+    self.assertEqual(list(helpers_lib.IterFreeAddressRanges(0, 9, [])),
+                     [(0, 9)])
+    self.assertEqual(list(helpers_lib.IterFreeAddressRanges(
+        0, 9, [0, 1, 4, 9])), [(2, 3), (5, 8)])
+    self.assertEqual(list(helpers_lib.IterFreeAddressRanges(
+        0, 3, [0, 1, 2, 3])), [])
 
   def testExpandIPV6(self):
     self.assertEqual(
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+
+# Copyright (c) 2009, Purdue University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# Redistributions in binary form must reproduce the above copyright notice, this
+# list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# Neither the name of the Purdue University nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Benchmark for CoreHelpers.ProcessRecordsBatch
+
+Times adding and then deleting batches of 1k, 10k and 100k A records, pass
+batch sizes as arguments to time others. Run it from the test directory:
+
+$ python process_records_batch_benchmark.py
+
+The MySQL settings that bound write speed are printed above the timings,
+publish them together with the timings of a change to ProcessRecordsBatch.
+
+Make sure you are running this against a database that can be destroyed.
+
+DO NOT EVER RUN THIS BENCHMARK AGAINST A PRODUCTION DATABASE.
+"""
+
+__copyright__ = 'Copyright (C) 2009, Purdue University'
+__license__ = 'BSD'
+__version__ = '#TRUNK#'
+
+
+import sys
+import time
+
+import roster_core
+
+
+CONFIG_FILE = 'test_data/roster.conf' # Example in test_data
+DATA_FILE = 'test_data/test_data.sql'
+MAIN_USER = u'sharrell'
+BATCH_SIZES = [1000, 10000, 100000]
+SETTINGS = ['innodb_buffer_pool_size', 'innodb_flush_log_at_trx_commit',
+            'sync_binlog', 'max_allowed_packet']
+
+
+def SetUpDatabase(config_instance):
+  """Loads a clean database with one zone to add records to.
+
+  Inputs:
+    config_instance: instantiated config class object
+
+  Outputs:
+    tuple: core instance and core helpers instance
+  """
+  db_instance = config_instance.GetDb()
+  db_instance.CreateRosterDatabase()
+  data = open(DATA_FILE, 'r').read()
+  db_instance.StartTransaction()
+  db_instance.cursor.execute(data)
+  db_instance.EndTransaction()
+  db_instance.close()
+
+  core_instance = roster_core.Core(MAIN_USER, config_instance)
+  core_helper_instance = roster_core.CoreHelpers(core_instance)
+  core_instance.MakeView(u'bench_view')
+  core_instance.MakeZone(u'bench_zone', u'master', u'bench.lcl.',
+                         view_name=u'bench_view')
+  core_instance.MakeRecord(
+      u'soa', u'@', u'bench_zone',
+      {u'name_server': u'ns1.bench.lcl.',
+       u'admin_email': u'admin.bench.lcl.',
+       u'serial_number': 1, u'refresh_seconds': 5,
+       u'retry_seconds': 5, u'expiry_seconds': 5,
+       u'minimum_seconds': 5}, view_name=u'bench_view')
+  return core_instance, core_helper_instance
+
+
+def MakeAddRecords(batch_size):
+  """Makes A records with unique targets and addresses in 10/8.
+
+  Inputs:
+    batch_size: int of number of records
+
+  Outputs:
+    list: list of add_records dicts for ProcessRecordsBatch
+  """
+  add_records = []
+  for index in range(batch_size):
+    add_records.append(
+        {'record_type': u'a', 'record_target': u'host-%s' % index,
+         'record_zone_name': u'bench_zone',
+         'record_view_dependency': u'bench_view',
+         'record_arguments': {u'assignment_ip': u'10.%s.%s.%s' % (
+             index >> 16 & 255, index >> 8 & 255, index & 255)}})
+  return add_records
+
+
+def ListDeleteRecords(core_instance):
+  """Lists the A records of the benchmark zone as delete_records dicts.
+
+  Inputs:
+    core_instance: instantiated core class object
+
+  Outputs:
+    list: list of delete_records dicts for ProcessRecordsBatch
+  """
+  db_instance = core_instance.db_instance
+  records_dict = db_instance.GetEmptyRowDict('records')
+  records_dict['record_type'] = u'a'
+  records_dict['record_zone_name'] = u'bench_zone'
+  db_instance.StartTransaction()
+  try:
+    return db_instance.ListRow('records', records_dict)
+  finally:
+    db_instance.EndTransaction()
+
+
+def PrintDatabaseSettings(config_instance):
+  """Prints the MySQL version and the settings that bound write speed.
+
+  Inputs:
+    config_instance: instantiated config class object
+  """
+  db_instance = config_instance.GetDb()
+  db_instance.StartTransaction()
+  try:
+    db_instance.cursor.execute('SELECT VERSION() AS version')
+    print 'mysql %s' % db_instance.cursor.fetchone()['version']
+    for variable in SETTINGS:
+      db_instance.cursor.execute('SHOW VARIABLES LIKE %s', (variable,))
+      row = db_instance.cursor.fetchone()
+      if( row ):
+        print '%s = %s' % (variable, row['Value'])
+  finally:
+    db_instance.EndTransaction()
+  db_instance.close()
+  print
+
+
+def main(args):
+  batch_sizes = BATCH_SIZES
+  if( args ):
+    batch_sizes = [int(arg) for arg in args]
+  config_instance = roster_core.Config(file_name=CONFIG_FILE)
+
+  PrintDatabaseSettings(config_instance)
+  print '%10s %12s %12s %14s' % ('records', 'add seconds', 'del seconds',
+                                 'adds / second')
+  for batch_size in batch_sizes:
+    core_instance, core_helper_instance = SetUpDatabase(config_instance)
+    add_records = MakeAddRecords(batch_size)
+
+    start = time.time()
+    core_helper_instance.ProcessRecordsBatch(add_records=add_records)
+    add_seconds = time.time() - start
+
+    delete_records = ListDeleteRecords(core_instance)
+    start = time.time()
+    core_helper_instance.ProcessRecordsBatch(delete_records=delete_records)
+    delete_seconds = time.time() - start
+
+    print '%10s %12.2f %12.2f %14.0f' % (batch_size, add_seconds,
+                                         delete_seconds,
+                                         batch_size / add_seconds)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -39,6 +39,7 @@ __copyright__ = 'Copyright (C) 2009, Purdue University'
 __license__ = 'BSD'
 __version__ = '#TRUNK#'
 
+import bz2
 import tarfile
 import unittest
 import os
@@ -55,7 +56,7 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
     self.tree_exporter_instance.db_instance.StartTransaction()
     self.data = self.tree_exporter_instance.GetRawData()
     self.tree_exporter_instance.db_instance.EndTransaction()
-    self.cooked_data = self.tree_exporter_instance.CookData(self.data[0])
+    self.cooked_data = self.tree_exporter_instance.CookData(self.data)
 
   def testTreeExporterListRecordArgumentDefinitions(self):
     search_record_arguments_dict = self.db_instance.GetEmptyRowDict(
@@ -95,13 +96,11 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
 
   def testTreeExporterSortRecords(self):
     records_dict = self.db_instance.GetEmptyRowDict('records')
-    record_args_assignment_dict = self.db_instance.GetEmptyRowDict(
-        'record_arguments_records_assignments')
+    flat_records_dict = self.db_instance.GetEmptyRowDict('flat_records')
     self.db_instance.StartTransaction()
     try:
-      records = self.db_instance.ListRow(
-          'records', records_dict, 'record_arguments_records_assignments',
-          record_args_assignment_dict)
+      records = self.db_instance.ListRow('records', records_dict,
+                                         'flat_records', flat_records_dict)
     finally:
       self.db_instance.EndTransaction()
 
@@ -369,7 +368,7 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
     self.core_instance.SetMaintenanceFlag(0)
     self.tree_exporter_instance.ExportAllBindTrees()
     self.config_lib_instance.UnTarDnsTree()
-    n_conf = self.tree_exporter_instance.MakeNamedConf(self.data[0],
+    n_conf = self.tree_exporter_instance.MakeNamedConf(self.data,
         self.cooked_data, u'internal_dns', 'db', 'remote_bind_dir')
    
     expected_n_conf = (
@@ -442,7 +441,7 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
     self.assertEqual(n_conf, expected_n_conf)
 
     # Test creating binary named conf
-    binary_n_conf = self.tree_exporter_instance.MakeNamedConf(self.data[0],
+    binary_n_conf = self.tree_exporter_instance.MakeNamedConf(self.data,
         self.cooked_data, u'internal_dns', 'db', 'remote_bind_dir', binary=True)
 
     expected_binary_n_conf = (
@@ -520,6 +519,43 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
     self.assertRaises(tree_exporter.ChangesNotFoundError,
                       self.tree_exporter_instance.ExportAllBindTrees)
 
+  def testTreeExporterWriteDatabaseDump(self):
+    self.db_instance.StartTransaction()
+    try:
+      raw_dump = self.db_instance.DumpDatabase()
+      audit_log_replay_dump_file_name, full_dump_file_name = (
+          self.tree_exporter_instance.WriteDatabaseDump())
+    finally:
+      self.db_instance.EndTransaction()
+    try:
+      dump_file = bz2.BZ2File(audit_log_replay_dump_file_name)
+      audit_log_replay_dump = dump_file.read()
+      dump_file.close()
+      dump_file = bz2.BZ2File(full_dump_file_name)
+      full_dump = dump_file.read()
+      dump_file.close()
+    finally:
+      os.remove(audit_log_replay_dump_file_name)
+      os.remove(full_dump_file_name)
+
+    self.assertTrue('DROP TABLE IF EXISTS `audit_log`;' in full_dump)
+    self.assertTrue('DROP TABLE IF EXISTS `locks`;' in full_dump)
+    self.assertFalse('`audit_log`' in audit_log_replay_dump)
+    self.assertFalse('`locks`' in audit_log_replay_dump)
+    self.assertTrue('DROP TABLE IF EXISTS `records`;' in audit_log_replay_dump)
+
+    self.core_instance.MakeZoneType(u'zonetype5')
+
+    self.db_instance.StartTransaction()
+    self.db_instance.cursor.execute(full_dump)
+    self.db_instance.EndTransaction()
+
+    self.db_instance.StartTransaction()
+    raw_dump_2 = self.db_instance.DumpDatabase()
+    self.db_instance.EndTransaction()
+
+    self.assertEquals(raw_dump, raw_dump_2)
+
   def testTreeExporterCookRawDump(self):
     self.db_instance.StartTransaction()
     raw_dump = self.db_instance.DumpDatabase()
@@ -581,10 +617,11 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
   def testTreeExporterGetRawData(self):
     self.tree_exporter_instance.db_instance.StartTransaction()
     raw_data = self.tree_exporter_instance.GetRawData()
+    raw_dump = self.tree_exporter_instance.db_instance.DumpDatabase()
     self.tree_exporter_instance.db_instance.EndTransaction()
 
-    ## Testing the RawData raw_data[0]
-    self.assertEqual(raw_data[0]['dns_server_sets'],
+    ## Testing the RawData raw_data
+    self.assertEqual(raw_data['dns_server_sets'],
         ({'dns_server_set_name':u'external_dns'},
          {'dns_server_set_name':u'internal_dns'},
          {'dns_server_set_name':u'private_dns'}))
@@ -606,13 +643,13 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
                         'view_acl_assignments_dns_server_set_name': u'private_dns',
                         'view_acl_assignments_acl_name': u'secret'}]
 
-    self.assertTrue(len(raw_data[0]['view_acl_assignments']) ==
+    self.assertTrue(len(raw_data['view_acl_assignments']) ==
                     len(test_assignments))
 
     for assign in test_assignments:
-      self.assertTrue(assign in raw_data[0]['view_acl_assignments'])
+      self.assertTrue(assign in raw_data['view_acl_assignments'])
 
-    self.assertEqual(raw_data[0]['view_dependency_assignments'],
+    self.assertEqual(raw_data['view_dependency_assignments'],
         ({'view_dependency_assignments_view_dependency':u'any',
           'view_dependency_assignments_view_name':u'external'},
          {'view_dependency_assignments_view_dependency':u'external_dep',
@@ -626,7 +663,7 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
          {'view_dependency_assignments_view_dependency':u'private_dep',
           'view_dependency_assignments_view_name':u'private'}))
 
-    self.assertEqual(raw_data[0]['zone_view_assignments'],
+    self.assertEqual(raw_data['zone_view_assignments'],
          ({'zone_origin': u'university.edu.',
            'zone_view_assignments_zone_type': u'master',
            'zone_view_assignments_zone_name': u'university.edu',
@@ -668,27 +705,27 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
            'zone_view_assignments_view_dependency': u'external_dep',
            'zone_options': u'(dp1\nVallow-update\np2\n(dp3\nVnone\np4\nI01\nss.'}))
 
-    ## Testing the RawDump raw_data[1]
-    self.assertEqual(raw_data[1]['zones']['rows'],
+    ## Testing the RawDump raw_dump
+    self.assertEqual(raw_dump['zones']['rows'],
          [{'zone_name': u"'168.192.in-addr'", 'zones_id': u'7'},
           {'zone_name': u"'4.3.2.in-addr'", 'zones_id': u'8'},
           {'zone_name': u"'int.university.edu'", 'zones_id': u'5'},
           {'zone_name': u"'priv.university.edu'", 'zones_id': u'6'},
           {'zone_name': u"'university.edu'", 'zones_id': u'4'}])
 
-    self.assertEqual(raw_data[1]['reserved_words']['columns'],
+    self.assertEqual(raw_dump['reserved_words']['columns'],
         [u'reserved_word_id', u'reserved_word'])
 
-    self.assertEqual(raw_data[1]['reserved_words']['rows'],
+    self.assertEqual(raw_dump['reserved_words']['rows'],
         [])
 
-    self.assertEqual(raw_data[1]['zone_types']['rows'],
+    self.assertEqual(raw_dump['zone_types']['rows'],
         [{'zone_type': "'forward'", 'zone_type_id': '3'},
          {'zone_type': "'hint'", 'zone_type_id': '4'},
          {'zone_type': "'master'", 'zone_type_id': '1'},
          {'zone_type': "'slave'", 'zone_type_id': '2'}])
 
-    self.assertEqual(raw_data[1]['users']['rows'],
+    self.assertEqual(raw_dump['users']['rows'],
         [{'access_level': '0',
           'user_name': "'tree_export_user'",
           'users_id': '1'},
@@ -702,7 +739,7 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
           'user_name': "'shuey'",
           'users_id': '4'}])
 
-    self.assertEqual(raw_data[1]['view_dependency_assignments']['rows'],
+    self.assertEqual(raw_dump['view_dependency_assignments']['rows'],
         [{'view_dependency_assignments_view_dependency': u"'any'",
           'view_dependency_assignments_id': u'4',
           'view_dependency_assignments_view_name': u"'external'"},
@@ -726,7 +763,7 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
     self.tree_exporter_instance.db_instance.StartTransaction()
     raw_data = self.tree_exporter_instance.GetRawData()
     self.tree_exporter_instance.db_instance.EndTransaction()
-    cooked_data = self.tree_exporter_instance.CookData(raw_data[0])
+    cooked_data = self.tree_exporter_instance.CookData(raw_data)
 
     self.assertEqual(cooked_data['dns_server_sets']['external_dns'],
          {'dns_servers': [u'ns1.university.edu', u'dns2.university.edu', u'dns3.university.edu'],
@@ -1053,22 +1090,22 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
 
   def testTreeExporterListACLNamesByView(self):
     acl_names_private = self.tree_exporter_instance.ListACLNamesByView(
-        self.data[0], u'private')
+        self.data, u'private')
     self.assertEqual(
         acl_names_private, [u'secret'])
     acl_names_internal = self.tree_exporter_instance.ListACLNamesByView(
-        self.data[0], u'internal')
+        self.data, u'internal')
     self.assertEqual(
         acl_names_internal, [u'secret', u'public'])
     acl_names_external = self.tree_exporter_instance.ListACLNamesByView(
-        self.data[0], u'external')
+        self.data, u'external')
     self.assertEqual(
         acl_names_external, [u'public'])
 
   def testTreeExporterListLatestNamedConfGlobalOptions(self):
     global_options_internal = (
         self.tree_exporter_instance.ListLatestNamedConfGlobalOptions(
-            self.data[0], u'internal_dns'))
+            self.data, u'internal_dns'))
     self.assertEqual(
         global_options_internal, (
           'include "/etc/rndc.key";\n'
@@ -1085,7 +1122,7 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
           'controls { inet * allow { control-hosts; } keys { rndc-key; }; };'))
     global_options_external = (
         self.tree_exporter_instance.ListLatestNamedConfGlobalOptions(
-            self.data[0], u'external_dns'))
+            self.data, u'external_dns'))
     self.assertEqual(
         global_options_external,
             u'include "/etc/rndc.key";\n'
@@ -1102,7 +1139,7 @@ class TestTreeExporter(tree_exporter_test_lib.TreeExportTestCase):
             'controls { inet * allow { control-hosts; } keys { rndc-key; }; };')
     global_options_private = (
         self.tree_exporter_instance.ListLatestNamedConfGlobalOptions(
-            self.data[0], u'private_dns'))
+            self.data, u'private_dns'))
     self.assertEqual(
         global_options_private,
             u'include "/etc/rndc.key";\n'
@@ -42,6 +42,8 @@ __version__ = '#TRUNK#'
 
 import unittest
 
+import IPy
+
 import roster_core
 from roster_core import audit_log
 from roster_core import db_access
@@ -264,6 +266,21 @@ class TestUser(unittest.TestCase):
     self.assertRaises(errors.MissingDataTypeError, user_instance.Authorize, u'MakeRecord',
                       no_record_args_dict_data)
 
+    # many records are authorized the same way as one
+    user_instance.AuthorizeRecords(u'MakeRecord', [
+        good_record_data, good_reverse_record_data,
+        good_10_reverse_record_data])
+    self.assertRaises(errors.AuthorizationError,
+                      user_instance.AuthorizeRecords, u'MakeRecord',
+                      [good_record_data, no_10_reverse_record_data])
+    self.assertRaises(errors.MissingDataTypeError,
+                      user_instance.AuthorizeRecords, u'MakeRecord',
+                      [good_record_data, no_record_args_dict_data])
+    self.core_instance.SetMaintenanceFlag(True)
+    self.assertRaises(errors.MaintenanceError, user_instance.AuthorizeRecords,
+                      u'MakeRecord', [good_record_data])
+    self.core_instance.SetMaintenanceFlag(False)
+
   def testGetUserName(self):
     user_instance = user.User(u'jcollins', self.db_instance, self.log_instance)
     self.assertEquals(user_instance.GetUserName(), 'jcollins')
@@ -274,6 +291,45 @@ class TestUser(unittest.TestCase):
                       {'user_access_level': 32, 'user_name': u'jcollins',
                        'forward_zones': [], 'groups': [], 'reverse_ranges': []})
 
+  def testReverseRangeIndex(self):
+    reverse_range_index = user.ReverseRangeIndex(
+        [{'cidr_block': u'192.168.0.0/16', 'group_permission': u'ptr'},
+         {'cidr_block': u'192.168.1.0/24', 'group_permission': u'cname'},
+         {'cidr_block': u'10.0.0.8/29', 'group_permission': u'ptr'},
+         {'cidr_block': u'2001:db8::/64', 'group_permission': u'ptr'}])
+    self.assertEqual(sorted(reverse_range_index.ListGroupPermissions(
+        IPy.IP('192.168.1.5'))), [u'cname', u'ptr'])
+    self.assertEqual(reverse_range_index.ListGroupPermissions(
+        IPy.IP('192.168.2.0/24')), [u'ptr'])
+    self.assertEqual(reverse_range_index.ListGroupPermissions(
+        IPy.IP('10.0.0.0/24')), [])
+    self.assertEqual(reverse_range_index.ListGroupPermissions(
+        IPy.IP('2001:db8::1')), [u'ptr'])
+    self.assertTrue(reverse_range_index.Overlaps(IPy.IP('10.0.0.0/24')))
+    self.assertTrue(reverse_range_index.Overlaps(IPy.IP('10.0.0.15')))
+    self.assertFalse(reverse_range_index.Overlaps(IPy.IP('10.0.0.16')))
+    self.assertFalse(reverse_range_index.Overlaps(IPy.IP('172.16.0.0/12')))
+    self.assertFalse(reverse_range_index.Overlaps(IPy.IP('2001:db9::1')))
+
+    # Answers match IPy for blocks around and inside every range.
+    cidr_blocks = [u'192.168.0.0/16', u'192.168.1.0/24', u'10.0.0.8/29']
+    reverse_range_index = user.ReverseRangeIndex(
+        [{'cidr_block': cidr_block, 'group_permission': cidr_block}
+         for cidr_block in cidr_blocks])
+    for prefix_length in range(8, 33):
+      for address in [u'10.0.0.0', u'10.0.0.8', u'10.0.0.15', u'10.0.0.16',
+                      u'192.168.0.0', u'192.168.1.128', u'192.169.0.0']:
+        ip_address = IPy.IP('%s/%s' % (address, prefix_length),
+                            make_net=True)
+        self.assertEqual(
+            reverse_range_index.Overlaps(ip_address),
+            any([IPy.IP(cidr_block).overlaps(ip_address)
+                 for cidr_block in cidr_blocks]))
+        self.assertEqual(
+            sorted(reverse_range_index.ListGroupPermissions(ip_address)),
+            sorted([cidr_block for cidr_block in cidr_blocks
+                    if ip_address in IPy.IP(cidr_block)]))
+
 
 if( __name__ == '__main__' ):
     unittest.main()